@@ -10,21 +10,25 @@
 - services/     : бизнес-логика (создание комнат, управление участниками, карта, персонажи)
 - sockets/      : обработчики WebSocket событий (чат, маркеры, игральные кости)
 - utils/        : вспомогательные функции и декораторы (@requires_participant, @requires_gm)
+- commands.py   : CLI-команды flask (импорт/экспорт шаблонов предметов)
+- backends/     : присутствие и pub/sub для нескольких воркеров (в памяти / через брокер)
 - extensions.py : инициализация Flask-расширений (db, migrate, jwt, socketio)
 - config.py     : конфигурация приложения (development, production)
 - constants.py  : общие константы (CHUNK_SIZE, типы тайлов и аномалий)
 """
 
+import hmac
 import logging
 import os
 from logging.handlers import RotatingFileHandler
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, jsonify, request
 from flask_jwt_extended import JWTManager
 from flask_socketio import SocketIO
 from app.extensions import db, migrate, jwt, socketio
-from app.config import config_by_name
+from app.backends import socketio_options, configure_backends
+from app.config import config_by_name, db_engine_options
 from app.services.exceptions import (
-    ServiceError, ValidationError, NotFoundError, PermissionDenied
+    ServiceError, ValidationError, NotFoundError, PermissionDenied, ConflictError
 )
 from marshmallow import ValidationError as MarshmallowValidationError
 
@@ -44,11 +48,17 @@ def create_app(config_name='default'):
     app.logger.setLevel(logging.INFO)
     app.logger.info('TTRPG application startup')
 
+    # Пул соединений под режим сервера (у SQLite свой пул, его не трогаем)
+    if not (app.config['SQLALCHEMY_DATABASE_URI'] or '').startswith('sqlite'):
+        app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', db_engine_options(app.config))
+
     # Инициализация расширений
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
-    socketio.init_app(app, cors_allowed_origins="*")
+    socketio.init_app(app, cors_allowed_origins="*", async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+                      **socketio_options(app.config))
+    configure_backends(app, socketio)
 
     # Регистрация blueprint'ов
     from app.auth import auth_bp
@@ -57,17 +67,64 @@ def create_app(config_name='default'):
     from app.lobbies import lobbies_bp
     app.register_blueprint(lobbies_bp, url_prefix='/lobbies')
 
-    # Импорт сокет-обработчиков
+    from app.dice import dice_bp
+    app.register_blueprint(dice_bp, url_prefix='/dice')
+
+    # CLI: flask templates import/export
+    from app.commands import templates_cli
+    app.cli.add_command(templates_cli)
+
+    # Импорт сокет-обработчиков, их инструментирование (метрики на /metrics) и лимиты частоты
     from app.sockets import auth, chat, dice, markers
+    from app.sockets.metrics import metrics, instrument_handlers
+    from app.sockets.ingest import chat_ingest
+    from app.sockets.character_edits import character_edits
+    from app.sockets.ratelimit import rate_limiter, limit_handlers
+    instrument_handlers(socketio, app.config['SOCKET_PAYLOAD_LOG_SAMPLE'])
+    # Лимиты — внешний слой: отклонённые события не попадают в метрики обработчиков
+    limit_handlers(socketio, app.config['SOCKET_RATE_LIMITS'])
+    chat_ingest.init_app(app)
+    character_edits.init_app(app)
+    # Буферы сбрасываются и при остановке сигналом (SIGTERM/SIGINT), не только при выходе
+    from app.utils.shutdown import install as install_shutdown
+    install_shutdown()
 
     @app.route('/')
     def index():
         return render_template('index.html')
 
+    @app.route('/metrics')
+    def get_metrics():
+        # Внутренние счётчики (сессии, кэши, лимиты) — не для всех
+        token = app.config['METRICS_TOKEN']
+        if token:
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+                return jsonify({'error': 'Unauthorized'}), 401
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            return jsonify({'error': 'Forbidden'}), 403
+        from app.services.access import access_cache
+        from app.services.derived_stats import derived_stats
+        from app.services.templates import template_cache, template_catalog
+        from app.sockets.scheduler import scheduler
+        from app.sockets.session import presence
+        return jsonify({
+            'sockets': metrics.snapshot(),
+            'access_cache': access_cache.stats(),
+            'template_cache': template_cache.stats(),
+            'template_catalog': template_catalog.stats(),
+            'derived_stats': derived_stats.stats(),
+            'chat_ingest': chat_ingest.stats(),
+            'character_edits': character_edits.stats(),
+            'rate_limits': rate_limiter.stats(),
+            'scheduler_pending': scheduler.pending(),
+            'local_sessions': len(presence.sessions())
+        }), 200
+
     # ---- Централизованная обработка ошибок ----
     @app.errorhandler(ValidationError)
     @app.errorhandler(NotFoundError)
     @app.errorhandler(PermissionDenied)
+    @app.errorhandler(ConflictError)
     def handle_service_error(error):
         response = jsonify({
             'error': {
@@ -79,6 +136,8 @@ def create_app(config_name='default'):
             response.status_code = 404
         elif isinstance(error, PermissionDenied):
             response.status_code = 403
+        elif isinstance(error, ConflictError):
+            response.status_code = 409
         else:
             response.status_code = 400
         return response
@@ -0,0 +1,61 @@
+# app/backends/__init__.py
+"""
+Подключаемые бэкенды для запуска нескольких воркеров.
+
+- presence.py : индекс присутствия (в памяти процесса / в брокере)
+- pubsub.py   : pub/sub между воркерами и менеджер клиентов Socket.IO
+- sharding.py : привязка комнат к воркерам (rendezvous-хеширование lobby_id)
+- broker.py   : локальный брокер (сервер + клиент), замена Redis на одной машине
+
+Без BROKER_URL всё работает внутри одного процесса. С BROKER_URL
+(broker://host:port) события Socket.IO, присутствие и инвалидации кэшей
+идут через брокер, и воркеров может быть сколько угодно. С WORKER_URL
+сокеты комнаты дополнительно собираются на одном воркере-владельце.
+"""
+
+import logging
+import uuid
+from .broker import BrokerClient
+from .presence import PresenceIndex, RemotePresenceIndex
+from .pubsub import pubsub, InProcessPubSub, BrokerPubSub, BrokerManager
+from .sharding import shards, REFRESH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def socketio_options(config):
+    """Дополнительные аргументы для socketio.init_app."""
+    url = config.get('BROKER_URL')
+    if not url:
+        return {}
+    return {'client_manager': BrokerManager(url)}
+
+
+def configure_backends(app, socketio):
+    """Подключает присутствие и pub/sub к брокеру (или оставляет в памяти)."""
+    from app.sockets.session import presence
+    from app.sockets.scheduler import scheduler
+
+    url = app.config.get('BROKER_URL')
+    if not url:
+        presence.use_index(PresenceIndex())
+        pubsub.use(InProcessPubSub())
+        return
+
+    client = BrokerClient(
+        url,
+        host_id=uuid.uuid4().hex,
+        async_mode=socketio.server.async_mode,
+        on_connect=lambda: shards.replay() + presence.replay()
+    )
+    presence.use_index(RemotePresenceIndex(client))
+    pubsub.use(BrokerPubSub(client, socketio.start_background_task))
+    logger.info(f"Realtime backends use broker at {url}")
+
+    shards.shared = True
+    worker_url = app.config.get('WORKER_URL')
+    if worker_url:
+        shards.configure(client, worker_url.rstrip('/'))
+        shards.start(socketio.start_background_task)
+        scheduler.every(('shards', 'refresh'), REFRESH_INTERVAL, shards.refresh)
+        logger.info(f"Lobby affinity enabled, this worker is {worker_url}")
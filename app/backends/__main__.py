@@ -0,0 +1,13 @@
+# app/backends/__main__.py
+"""Запуск локального брокера: python -m app.backends --host 127.0.0.1 --port 7070"""
+
+import argparse
+import logging
+from .broker import run_broker, DEFAULT_PORT
+
+parser = argparse.ArgumentParser(description='TTRPG realtime broker')
+parser.add_argument('--host', default='127.0.0.1')
+parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+options = parser.parse_args()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+run_broker(options.host, options.port)
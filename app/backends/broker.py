@@ -0,0 +1,261 @@
+# app/backends/broker.py
+"""
+Локальный брокер для нескольких воркеров: pub/sub каналы, общий индекс присутствия
+и список живых воркеров (для привязки комнат, см. sharding.py).
+
+Протокол — JSON построчно поверх TCP:
+    запрос  {"op": "...", "args": [...]}  ->  ответ {"ok": true, "result": ...}
+    {"op": "subscribe", "args": [channel, ...]} переводит соединение в режим
+    подписки: дальше сервер присылает {"channel": ..., "data": ...}.
+
+Это замена Redis для запуска нескольких воркеров на одной машине без внешних
+зависимостей. Запуск:
+    python -m app.backends --host 127.0.0.1 --port 7070
+"""
+
+import json
+import logging
+import socketserver
+import threading
+import time
+from urllib.parse import urlparse
+from .presence import PresenceIndex
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 7070
+
+
+class BrokerError(Exception):
+    pass
+
+
+def parse_broker_url(url):
+    """broker://host:port -> (host, port)."""
+    parsed = urlparse(url)
+    if parsed.scheme != 'broker':
+        raise ValueError(f"Unsupported broker url: {url}")
+    return parsed.hostname or '127.0.0.1', parsed.port or DEFAULT_PORT
+
+
+# ========== Сервер ==========
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.host_id = None
+        self.channels = set()
+        self.write_lock = threading.Lock()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                op, args = message['op'], message.get('args', [])
+            except (ValueError, KeyError, TypeError):
+                self.send({'ok': False, 'error': 'Malformed request'})
+                continue
+            try:
+                result = self.server.execute(self, op, args)
+            except Exception as e:
+                logger.exception(f"Broker op {op} failed")
+                self.send({'ok': False, 'error': str(e)})
+                continue
+            self.send({'ok': True, 'result': result})
+
+    def finish(self):
+        self.server.forget(self)
+        super().finish()
+
+    def send(self, payload):
+        data = (json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8')
+        with self.write_lock:
+            self.wfile.write(data)
+            self.wfile.flush()
+
+
+class BrokerServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, _BrokerHandler)
+        self.presence = PresenceIndex()
+        self._subscribers = {}   # channel -> {handler, ...}
+        self._hosts = {}         # host_id -> число командных соединений
+        self._workers = {}       # host_id -> публичный url воркера
+        self._lock = threading.Lock()
+
+    def execute(self, handler, op, args):
+        if op == 'hello':
+            handler.host_id = args[0]
+            with self._lock:
+                self._hosts[handler.host_id] = self._hosts.get(handler.host_id, 0) + 1
+            return True
+        if op == 'subscribe':
+            with self._lock:
+                for channel in args:
+                    self._subscribers.setdefault(channel, set()).add(handler)
+                    handler.channels.add(channel)
+            return True
+        if op == 'publish':
+            return self.publish(*args)
+        if op == 'workers.join':
+            with self._lock:
+                self._workers[handler.host_id] = args[0]
+                workers = dict(self._workers)
+            self.publish('workers', json.dumps(workers))
+            return workers
+        if op == 'workers.list':
+            with self._lock:
+                return dict(self._workers)
+        if op == 'presence.bind':
+            return self.presence.bind(*args, host=handler.host_id)
+        if op == 'presence.unbind':
+            return self.presence.unbind(*args)
+        if op == 'presence.revoke':
+            return self.presence.revoke(*args)
+        if op == 'presence.online_users':
+            return self.presence.online_users(*args)
+        if op == 'presence.is_online':
+            return self.presence.is_online(*args)
+        raise BrokerError(f"Unknown op: {op}")
+
+    def publish(self, channel, data):
+        with self._lock:
+            targets = list(self._subscribers.get(channel, ()))
+        for target in targets:
+            try:
+                target.send({'channel': channel, 'data': data})
+            except OSError:
+                self.forget(target)
+        return len(targets)
+
+    def forget(self, handler):
+        with self._lock:
+            for channel in handler.channels:
+                self._subscribers.get(channel, set()).discard(handler)
+            handler.channels = set()
+            host_id, handler.host_id = handler.host_id, None
+            if host_id is None:
+                return
+            self._hosts[host_id] -= 1
+            if self._hosts[host_id] > 0:
+                return
+            del self._hosts[host_id]
+            left = self._workers.pop(host_id, None) is not None
+            workers = dict(self._workers)
+        if left:
+            self.publish('workers', json.dumps(workers))
+        # Воркер отключился: его сокеты больше не онлайн
+        dropped = self.presence.drop_host(host_id)
+        if dropped:
+            logger.warning(f"Worker {host_id} disconnected, dropped {len(dropped)} presence entries")
+
+
+def run_broker(host='127.0.0.1', port=DEFAULT_PORT):
+    server = BrokerServer((host, port))
+    logger.info(f"Broker listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+# ========== Клиент ==========
+
+def _async_primitives(async_mode):
+    """Модуль socket, фабрика блокировок и sleep, совместимые с режимом socketio."""
+    if async_mode == 'eventlet':
+        import eventlet
+        from eventlet.green import socket
+        from eventlet.semaphore import Semaphore
+        return socket, Semaphore, eventlet.sleep
+    if async_mode == 'gevent':
+        import gevent
+        from gevent import socket
+        from gevent.lock import Semaphore
+        return socket, Semaphore, gevent.sleep
+    import socket
+    return socket, threading.Lock, time.sleep
+
+
+class BrokerClient:
+    """
+    Клиент брокера: одно командное соединение на процесс (переподключается
+    при обрыве) и отдельные соединения для подписок.
+    on_connect() может вернуть список (op, args), которые нужно повторить
+    после (пере)подключения, — так воркер восстанавливает свои записи присутствия.
+    """
+
+    def __init__(self, url, host_id, async_mode='threading', on_connect=None):
+        self.address = parse_broker_url(url)
+        self.host_id = host_id
+        self.on_connect = on_connect
+        self._socket, lock_factory, self._sleep = _async_primitives(async_mode)
+        self._lock = lock_factory()
+        self._conn = None
+        self._file = None
+
+    def call(self, op, *args):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._conn is None:
+                        self._connect()
+                    reply = self._request(op, list(args))
+                    break
+                except OSError:
+                    self._close()
+                    if attempt:
+                        raise
+        if not reply.get('ok'):
+            raise BrokerError(reply.get('error'))
+        return reply['result']
+
+    def listen(self, channels):
+        """Генератор (channel, data) для подписки; переподключается с backoff."""
+        retry = 1
+        while True:
+            try:
+                conn = self._socket.create_connection(self.address)
+                rfile = conn.makefile('rb')
+                conn.sendall(self._encode('subscribe', list(channels)))
+                retry = 1
+                for line in rfile:
+                    message = json.loads(line)
+                    if 'channel' in message:  # пропускаем подтверждение подписки
+                        yield message['channel'], message['data']
+                raise ConnectionError('Broker closed subscription')
+            except OSError as e:
+                logger.error(f"Broker subscription lost ({e}), retrying in {retry}s")
+                self._sleep(retry)
+                retry = min(retry * 2, 30)
+
+    def _connect(self):
+        self._conn = self._socket.create_connection(self.address)
+        self._file = self._conn.makefile('rb')
+        self._request('hello', [self.host_id])
+        for op, args in (self.on_connect() if self.on_connect else ()):
+            self._request(op, args)
+
+    def _request(self, op, args):
+        self._conn.sendall(self._encode(op, args))
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('Broker closed connection')
+        return json.loads(line)
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+        self._conn = None
+        self._file = None
+
+    @staticmethod
+    def _encode(op, args):
+        return (json.dumps({'op': op, 'args': args}, ensure_ascii=False) + '\n').encode('utf-8')
+
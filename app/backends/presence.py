@@ -0,0 +1,113 @@
+# app/backends/presence.py
+"""
+Индекс присутствия: sid -> (пользователь, комната), комната -> {user_id: {sid}}.
+
+PresenceIndex — реализация в памяти процесса (один воркер, а также хранилище
+внутри брокера). RemotePresenceIndex — тот же интерфейс поверх брокера,
+общий для всех воркеров.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+PresenceEntry = namedtuple('PresenceEntry', ['sid', 'user_id', 'username', 'lobby_id'])
+
+
+class PresenceIndex:
+    def __init__(self):
+        self._entries = {}   # sid -> PresenceEntry
+        self._hosts = {}     # host -> {sid, ...}
+        self._sid_host = {}  # sid -> host
+        self._lobbies = {}   # lobby_id -> {user_id: {sid, ...}}
+        self._users = {}     # user_id -> {sid, ...}
+        self._lock = threading.Lock()
+
+    def bind(self, sid, user_id, username, lobby_id, host=None):
+        """Привязывает sid. Возвращает True, если это первая вкладка пользователя в комнате."""
+        with self._lock:
+            previous, _ = self._unbind_locked(sid)
+            rebind = (previous is not None and previous.lobby_id == lobby_id
+                      and previous.user_id == user_id)
+            self._entries[sid] = PresenceEntry(sid, user_id, username, lobby_id)
+            self._users.setdefault(user_id, set()).add(sid)
+            if host is not None:
+                self._hosts.setdefault(host, set()).add(sid)
+                self._sid_host[sid] = host
+            members = self._lobbies.setdefault(lobby_id, {})
+            came_online = user_id not in members and not rebind
+            members.setdefault(user_id, set()).add(sid)
+        return came_online
+
+    def unbind(self, sid):
+        """Удаляет sid. Возвращает (entry, went_offline) или (None, False)."""
+        with self._lock:
+            return self._unbind_locked(sid)
+
+    def revoke(self, user_id, lobby_id=None):
+        """Удаляет все sid пользователя (в комнате lobby_id или во всех). Возвращает их записи."""
+        with self._lock:
+            sids = [sid for sid in self._users.get(user_id, ())
+                    if lobby_id is None or self._entries[sid].lobby_id == lobby_id]
+            return [self._unbind_locked(sid)[0] for sid in sids]
+
+    def drop_host(self, host):
+        """Удаляет все sid воркера host (воркер отключился от брокера)."""
+        with self._lock:
+            return [self._unbind_locked(sid)[0] for sid in list(self._hosts.get(host, ()))]
+
+    def online_users(self, lobby_id):
+        return list(self._lobbies.get(lobby_id, ()))
+
+    def is_online(self, user_id, lobby_id):
+        return user_id in self._lobbies.get(lobby_id, ())
+
+    def _unbind_locked(self, sid):
+        entry = self._entries.pop(sid, None)
+        if entry is None:
+            return None, False
+        host = self._sid_host.pop(sid, None)
+        if host is not None:
+            self._hosts[host].discard(sid)
+            if not self._hosts[host]:
+                del self._hosts[host]
+        user_sids = self._users.get(entry.user_id)
+        if user_sids is not None:
+            user_sids.discard(sid)
+            if not user_sids:
+                del self._users[entry.user_id]
+        went_offline = False
+        members = self._lobbies.get(entry.lobby_id)
+        if members is not None and entry.user_id in members:
+            members[entry.user_id].discard(sid)
+            if not members[entry.user_id]:
+                del members[entry.user_id]
+                went_offline = True
+            if not members:
+                del self._lobbies[entry.lobby_id]
+        return entry, went_offline
+
+
+class RemotePresenceIndex:
+    """Индекс присутствия в брокере (общий для всех воркеров)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def bind(self, sid, user_id, username, lobby_id):
+        return self.client.call('presence.bind', sid, user_id, username, lobby_id)
+
+    def unbind(self, sid):
+        entry, went_offline = self.client.call('presence.unbind', sid)
+        return (PresenceEntry(*entry) if entry else None), went_offline
+
+    def revoke(self, user_id, lobby_id=None):
+        return [PresenceEntry(*e) for e in self.client.call('presence.revoke', user_id, lobby_id)]
+
+    def online_users(self, lobby_id):
+        return self.client.call('presence.online_users', lobby_id)
+
+    def is_online(self, user_id, lobby_id):
+        return self.client.call('presence.is_online', user_id, lobby_id)
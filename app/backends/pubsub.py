@@ -0,0 +1,100 @@
+# app/backends/pubsub.py
+"""
+Pub/sub между воркерами.
+
+pubsub.publish(topic, data) доставляет сообщение подписчикам в ДРУГИХ воркерах
+(в своём процессе изменения уже применены вызывающим кодом).
+- InProcessPubSub : один процесс, рассылать некому
+- BrokerPubSub    : через локальный брокер (app.backends.broker)
+
+BrokerManager — менеджер клиентов python-socketio поверх того же брокера:
+emit в комнаты lobby_<id>/user_<id> доходит до сокетов на всех воркерах.
+"""
+
+import json
+import logging
+from socketio import PubSubManager
+from .broker import BrokerClient
+
+logger = logging.getLogger(__name__)
+
+
+class InProcessPubSub:
+    def publish(self, topic, data):
+        pass
+
+    def start(self, dispatch):
+        pass
+
+
+class BrokerPubSub:
+    channel = 'ttrpg'
+
+    def __init__(self, client, start_background_task):
+        self.client = client
+        self.start_background_task = start_background_task
+
+    def publish(self, topic, data):
+        message = json.dumps({'host': self.client.host_id, 'topic': topic, 'data': data})
+        self.client.call('publish', self.channel, message)
+
+    def start(self, dispatch):
+        def listen():
+            for _, raw in self.client.listen([self.channel]):
+                message = json.loads(raw)
+                if message['host'] != self.client.host_id:
+                    dispatch(message['topic'], message['data'])
+        self.start_background_task(listen)
+
+
+class PubSub:
+    def __init__(self):
+        self.backend = InProcessPubSub()
+        self._handlers = {}  # topic -> [callback, ...]
+
+    def use(self, backend):
+        self.backend = backend
+        backend.start(self._dispatch)
+
+    def subscribe(self, topic, callback):
+        self._handlers.setdefault(topic, []).append(callback)
+
+    def publish(self, topic, data):
+        try:
+            self.backend.publish(topic, data)
+        except Exception:
+            logger.exception(f"Failed to publish {topic}")
+
+    def _dispatch(self, topic, data):
+        for callback in self._handlers.get(topic, ()):
+            try:
+                callback(data)
+            except Exception:
+                logger.exception(f"Handler for {topic} failed")
+
+
+pubsub = PubSub()
+
+
+class BrokerManager(PubSubManager):
+    """Менеджер клиентов Socket.IO, публикующий события через брокер."""
+    name = 'broker'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.url = url
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            async_mode = self.server.async_mode if self.server else 'threading'
+            self._client = BrokerClient(self.url, host_id=self.host_id, async_mode=async_mode)
+        return self._client
+
+    def _publish(self, data):
+        return self.client.call('publish', self.channel, self.json.dumps(data))
+
+    def _listen(self):
+        for _, data in self.client.listen([self.channel]):
+            yield data
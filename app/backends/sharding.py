@@ -0,0 +1,113 @@
+# app/backends/sharding.py
+"""
+Привязка комнат к воркерам (lobby affinity).
+
+Каждый воркер с WORKER_URL регистрируется в брокере; комната закрепляется за
+воркером rendezvous-хешированием lobby_id по списку живых воркеров. Весь
+сокет-трафик комнаты идёт на один процесс, и он может держать состояние комнаты
+в памяти. При входе/выходе воркера переезжают только комнаты, чей владелец
+изменился (остальные остаются на месте).
+
+Без брокера воркер один и владеет всеми комнатами. С брокером, но без
+WORKER_URL привязки нет: состояние каждый раз читается из БД.
+"""
+
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL = 15  # сек, страховка на случай пропущенной рассылки брокера
+
+
+def _score(host_id, lobby_id):
+    digest = hashlib.blake2b(f"{host_id}:{lobby_id}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def pick_owner(workers, lobby_id):
+    """host_id воркера-владельца комнаты среди workers (host_id -> url) или None."""
+    if not workers:
+        return None
+    return max(workers, key=lambda host_id: _score(host_id, lobby_id))
+
+
+class ShardMap:
+    def __init__(self):
+        self.host_id = None
+        self.url = None
+        self.shared = False      # воркеров несколько (есть брокер)
+        self.client = None
+        self._workers = {}       # host_id -> url
+        self._listeners = []
+
+    @property
+    def enabled(self):
+        return self.shared and self.url is not None
+
+    def configure(self, client, url):
+        """Включает привязку комнат: воркер доступен клиентам по url."""
+        self.client = client
+        self.host_id = client.host_id
+        self.url = url
+        self.shared = True
+
+    def on_change(self, callback):
+        """callback() вызывается после изменения состава воркеров."""
+        self._listeners.append(callback)
+
+    def update(self, workers):
+        if workers == self._workers:
+            return
+        self._workers = dict(workers)
+        logger.info(f"Shard map updated: {len(self._workers)} workers")
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception:
+                logger.exception("Shard change handler failed")
+
+    def refresh(self):
+        try:
+            self.update(self.client.call('workers.list'))
+        except Exception as e:
+            logger.error(f"Failed to refresh shard map: {e}")
+
+    def owner(self, lobby_id):
+        """(host_id, url) владельца комнаты или None, если привязка не работает."""
+        if not self.enabled:
+            return None
+        host_id = pick_owner(self._workers, int(lobby_id))
+        if host_id is None:
+            return None
+        return host_id, self._workers[host_id]
+
+    def is_local(self, lobby_id):
+        """Этот воркер — единственный владелец комнаты (можно держать состояние в памяти)."""
+        if not self.shared:
+            return True
+        owner = self.owner(lobby_id)
+        return owner is not None and owner[0] == self.host_id
+
+    def redirect_url(self, lobby_id):
+        """URL воркера, куда нужно переподключиться, или None, если комната здесь."""
+        owner = self.owner(lobby_id)
+        if owner is None or owner[0] == self.host_id:
+            return None
+        return owner[1]
+
+    def replay(self):
+        """Операции для (пере)регистрации воркера в брокере."""
+        return [('workers.join', [self.url])] if self.enabled else []
+
+    def start(self, start_background_task):
+        """Слушает изменения состава воркеров, которые рассылает брокер."""
+        def listen():
+            for _, raw in self.client.listen(['workers']):
+                self.update(json.loads(raw))
+        start_background_task(listen)
+        self.refresh()
+
+
+shards = ShardMap()
@@ -0,0 +1,64 @@
+# app/commands.py
+"""
+CLI-команды (flask <группа> <команда>).
+
+templates export / import — массовая выгрузка и загрузка шаблонов предметов
+(глобальных или, с --lobby, локальных шаблонов комнаты), см. TemplateTransferService.
+Глобальные шаблоны через REST не меняются, их каталог загружается отсюда.
+"""
+
+import json
+import sys
+import click
+from flask.cli import AppGroup
+from app.services.exceptions import ServiceError
+from app.services.template_transfer import TemplateTransferService, FORMATS
+
+templates_cli = AppGroup('templates', help='Импорт и экспорт шаблонов предметов.')
+
+
+def _format(path, fmt):
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+@templates_cli.command('export')
+@click.argument('path', default='-')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='По умолчанию по расширению файла.')
+@click.option('--lobby', 'lobby_id', type=int, help='Локальные шаблоны комнаты вместо глобальных.')
+def export_templates(path, fmt, lobby_id):
+    """Выгружает шаблоны в PATH (- — stdout)."""
+    fmt = _format(path, fmt)
+    try:
+        lines = TemplateTransferService.export(lobby_id, fmt)
+    except ServiceError as e:
+        raise click.ClickException(str(e))
+    out = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+    try:
+        for line in lines:
+            out.write(line)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+@templates_cli.command('import')
+@click.argument('path')
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), help='По умолчанию по расширению файла.')
+@click.option('--mode', type=click.Choice(('upsert', 'insert')), default='upsert',
+              help='insert — существующие (name, category) не обновлять.')
+@click.option('--lobby', 'lobby_id', type=int, help='Локальные шаблоны комнаты вместо глобальных.')
+@click.option('--user', 'user_id', type=int, help='Автор локальных шаблонов (обязателен с --lobby).')
+def import_templates(path, fmt, mode, lobby_id, user_id):
+    """Загружает шаблоны из PATH (- — stdin) и печатает отчёт."""
+    fmt = _format(path, fmt)
+    source = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+    try:
+        report = TemplateTransferService.import_lines(source, fmt, lobby_id=lobby_id, user_id=user_id, mode=mode)
+    except ServiceError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    click.echo(json.dumps(report, ensure_ascii=False, indent=2))
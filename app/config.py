@@ -1,3 +1,4 @@
+import json
 import os
 from datetime import timedelta
 
@@ -5,6 +6,16 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# Пул соединений с БД по режиму сервера Socket.IO: (pool_size, max_overflow).
+# threading — поток на подключение, пики закрываются overflow;
+# eventlet/gevent — тысячи green threads ждут свободное соединение в очереди пула,
+# а не открывают новые (лимит соединений PostgreSQL делится между воркерами).
+DB_POOL_DEFAULTS = {
+    'threading': (10, 20),
+    'eventlet': (20, 0),
+    'gevent': (20, 0),
+}
+
 class Config:
     """Базовый класс конфигурации."""
     SECRET_KEY = os.environ.get('SECRET_KEY', 'default-secret-key')
@@ -12,6 +23,46 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JSON_AS_ASCII = False
     JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=4)
+    # Режим сервера Socket.IO: threading (по умолчанию), eventlet или gevent.
+    # Кооперативные режимы требуют monkey patching до импорта приложения (см. run.py).
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+    # Переопределение размера пула (иначе DB_POOL_DEFAULTS по режиму)
+    DB_POOL_SIZE = os.environ.get('DB_POOL_SIZE')
+    DB_MAX_OVERFLOW = os.environ.get('DB_MAX_OVERFLOW')
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    # Доля сокет-событий, payload которых пишется в лог (0 — не писать, 1 — все)
+    SOCKET_PAYLOAD_LOG_SAMPLE = float(os.environ.get('SOCKET_PAYLOAD_LOG_SAMPLE', 0))
+    # Лимиты частоты сокет-событий на пользователя (token bucket, см. app/sockets/ratelimit.py):
+    # rate — событий в секунду, burst — ёмкость ведра, coalesce — поле id перетаскиваемого
+    # объекта (сверх лимита выполняется только последнее событие по объекту, остальные
+    # события сверх лимита отклоняются). SOCKET_RATE_LIMITS в окружении (JSON) дополняет/переопределяет.
+    SOCKET_RATE_LIMITS = {
+        'move_marker': {'rate': 20, 'burst': 40, 'coalesce': 'marker_id'},
+        'move_in_location': {'rate': 10, 'burst': 20, 'coalesce': 'character_id'},
+        'send_message': {'rate': 2, 'burst': 10},
+        'add_marker': {'rate': 2, 'burst': 10},
+        'update_marker': {'rate': 5, 'burst': 20},
+        'delete_marker': {'rate': 2, 'burst': 10},
+        'roll_skill': {'rate': 2, 'burst': 10},
+        'roll_skills_batch': {'rate': 1, 'burst': 5},
+        'update_character_data': {'rate': 5, 'burst': 20},
+        'patch_character_data': {'rate': 20, 'burst': 40},
+        **json.loads(os.environ.get('SOCKET_RATE_LIMITS', '{}'))
+    }
+    # Правки листов персонажей копятся в памяти и пишутся в БД не чаще чем раз в столько мс
+    CHARACTER_FLUSH_INTERVAL = int(os.environ.get('CHARACTER_FLUSH_INTERVAL', 2000))
+    # Сообщения чата старше стольких дней переносятся в сжатый архив (0 — не архивировать)
+    CHAT_ARCHIVE_AFTER_DAYS = int(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', 30))
+    CHAT_ARCHIVE_INTERVAL = int(os.environ.get('CHAT_ARCHIVE_INTERVAL', 3600))  # сек между проходами архиватора
+    # Доступ к GET /metrics: с токеном — по заголовку Authorization: Bearer <токен>,
+    # без токена — только с localhost (за обратным прокси на той же машине задавайте токен)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # broker://host:port — общий брокер для нескольких воркеров (python -m app.backends).
+    # Не задан — один процесс, всё в памяти.
+    BROKER_URL = os.environ.get('BROKER_URL')
+    # Публичный адрес этого воркера (http://host:port). Вместе с BROKER_URL включает
+    # привязку комнат к воркерам: клиент комнаты подключается к её владельцу.
+    WORKER_URL = os.environ.get('WORKER_URL')
 
 class DevelopmentConfig(Config):
     """Конфигурация для разработки."""
@@ -25,6 +76,20 @@ class ProductionConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
 
+def db_engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS с пулом, подобранным под SOCKETIO_ASYNC_MODE."""
+    pool_size, max_overflow = DB_POOL_DEFAULTS.get(config['SOCKETIO_ASYNC_MODE'], DB_POOL_DEFAULTS['threading'])
+    if config.get('DB_POOL_SIZE'):
+        pool_size = int(config['DB_POOL_SIZE'])
+    if config.get('DB_MAX_OVERFLOW'):
+        max_overflow = int(config['DB_MAX_OVERFLOW'])
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': True,
+    }
+
 config_by_name = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
@@ -0,0 +1,32 @@
+import logging
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from app.services.exceptions import ValidationError
+from app.utils.dice import DiceError
+from app.utils.dice_stats import distribution
+
+logger = logging.getLogger(__name__)
+dice_bp = Blueprint('dice', __name__)
+
+@dice_bp.route('/probability', methods=['GET'])
+@jwt_required()
+def get_probability():
+    """
+    Точное распределение броска: ?expr=2d6+3 (та же нотация, что у /roll).
+    Возвращает min, max, mean, stdev, percentiles, pmf и cdf (значения от min до max).
+    ?target=10 добавляет P(результат >= target) — например, шанс проверки
+    навыка 1d20+5 против сложности.
+    """
+    expression = request.args.get('expr')
+    if not expression:
+        return jsonify({'error': 'expr is required'}), 400
+    target = request.args.get('target', type=int)
+    try:
+        dist = distribution(expression)
+    except DiceError as e:
+        raise ValidationError(str(e))
+    result = dict(dist.to_dict())
+    if target is not None:
+        result['target'] = target
+        result['p_at_least'] = dist.at_least(target)
+    return jsonify(result), 200
@@ -2,27 +2,36 @@
 import json
 import gzip
 import io
-from flask import Blueprint, request, jsonify, render_template, send_file
+from flask import Blueprint, request, jsonify, render_template, send_file, make_response, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.extensions import socketio, db
 from app.services.lobby import LobbyService
 from app.services.participant import ParticipantService
 from app.services.map import MapService
 from app.services.character import CharacterService
+from app.services.chat import ChatService, HISTORY_LIMIT, MAX_HISTORY_LIMIT
+from app.services.derived_stats import derived_stats
+from app.services.templates import template_catalog, template_key, invalidate_template
+from app.services.template_search import (
+    TemplateSearchService, SEARCH_LIMIT as TEMPLATE_SEARCH_LIMIT, MAX_SEARCH_LIMIT as MAX_TEMPLATE_SEARCH_LIMIT
+)
+from app.services.template_transfer import TemplateTransferService, MIMETYPES as TEMPLATE_MIMETYPES
+from app.services.chat_search import ChatSearchService, SEARCH_LIMIT, MAX_SEARCH_LIMIT
 from app.schemas.lobby import LobbyCreateSchema, LobbyDetailSchema, LobbyMySchema, LobbySchema
 from app.schemas.participant import BannedUserSchema
-from app.schemas.character import CharacterSchema, CharacterCreateSchema
+from app.schemas.character import CharacterSchema, CharacterCreateSchema, CharacterSummarySchema
 from app.schemas.map import GameStateSchema, MapChunkSchema, TileUpdateSchema
-from app.models import LobbyParticipant, GameState, LobbyCharacter
+from app.models import Lobby, GameState
 from app.utils.decorators import requires_participant, requires_gm
+from app.backends.sharding import shards
+from app.sockets.ingest import chat_ingest
+from app.sockets.character_edits import character_edits
 from app.models.location import Location
 from app.models.location_character import LocationCharacter
 from app.models.location_object import LocationObject
 from app.schemas.location import LocationCreateSchema, LocationSchema, LocationObjectSchema
 
 # Импорты для универсальных шаблонов
-from app.models.templates import ItemTemplate
-from app.schemas.templates import ItemTemplateSchema
 from app.models.lobby_templates import LobbyItemTemplate
 from app.schemas.lobby_templates import LobbyItemTemplateSchema
 
@@ -84,7 +93,55 @@ def list_lobbies():
 @requires_participant
 def get_lobby(lobby_id, lobby, participant):
     schema = LobbyDetailSchema()
-    return jsonify(schema.dump(lobby)), 200
+    return jsonify(schema.dump(Lobby.query.get(lobby_id))), 200
+
+@lobbies_bp.route('/<int:lobby_id>/shard', methods=['GET'])
+@jwt_required()
+@requires_participant
+def get_lobby_shard(lobby_id, lobby, participant):
+    """Адрес воркера-владельца комнаты для сокета (url=None — текущий сервер)."""
+    owner = shards.owner(lobby_id)
+    return jsonify({'url': owner[1] if owner else None}), 200
+
+@lobbies_bp.route('/<int:lobby_id>/chat', methods=['GET'])
+@jwt_required()
+@requires_participant
+def get_chat_history(lobby_id, lobby, participant):
+    """
+    История чата по курсору: ?before=<cursor> — старше, ?after=<cursor> — новее,
+    без курсора — последние сообщения. limit 1-100 (по умолчанию 50).
+    """
+    limit = request.args.get('limit', default=HISTORY_LIMIT, type=int)
+    if limit <= 0 or limit > MAX_HISTORY_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_HISTORY_LIMIT}'}), 400
+    chat_ingest.flush()
+    page = ChatService.get_history(
+        lobby_id,
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        limit=limit
+    )
+    return jsonify(page), 200
+
+@lobbies_bp.route('/<int:lobby_id>/chat/search', methods=['GET'])
+@jwt_required()
+@requires_participant
+def search_chat(lobby_id, lobby, participant):
+    """
+    Поиск по чату: ?q=<слова> — сообщения, где есть все слова (в тексте или имени автора),
+    по убыванию релевантности. Следующая страница — ?cursor=<next>. limit 1-100 (по умолчанию 20).
+    """
+    limit = request.args.get('limit', default=SEARCH_LIMIT, type=int)
+    if limit <= 0 or limit > MAX_SEARCH_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_SEARCH_LIMIT}'}), 400
+    chat_ingest.flush()
+    page = ChatSearchService.search(
+        lobby_id,
+        request.args.get('q', ''),
+        cursor=request.args.get('cursor'),
+        limit=limit
+    )
+    return jsonify(page), 200
 
 @lobbies_bp.route('/<int:lobby_id>/join', methods=['POST'])
 @jwt_required()
@@ -115,29 +172,9 @@ def lobby_page(lobby_id):
 @jwt_required()
 @requires_participant
 def get_participants_characters(lobby_id, lobby, participant):
-    is_gm = (lobby.gm_id == participant.user_id)
-
-    participants = LobbyParticipant.query.filter_by(lobby_id=lobby_id).all()
-    result = []
-    for p in participants:
-        user_data = {
-            'user_id': p.user_id,
-            'username': p.user.username
-        }
-        if p.character_id:
-            char = LobbyCharacter.query.get(p.character_id)
-            if char:
-                user_data['character'] = {
-                    'id': char.id,
-                    'name': char.name,
-                    'data': char.data
-                }
-            else:
-                user_data['character'] = None
-        else:
-            user_data['character'] = None
-        result.append(user_data)
-    return jsonify(result), 200
+    """Участники с именами и видимыми персонажами (фиксированное число запросов)."""
+    character_edits.flush_lobby(lobby_id)
+    return jsonify(ParticipantService.get_roster(lobby_id, participant.user_id)), 200
 
 @lobbies_bp.route('/<int:lobby_id>/map', methods=['GET'])
 @jwt_required()
@@ -206,8 +243,11 @@ def unban_participant(lobby_id, lobby, user_id):
 @jwt_required()
 @requires_participant
 def get_lobby_characters(lobby_id, lobby, participant):
-    characters = CharacterService.get_lobby_characters(lobby_id, participant.user_id)
-    schema = CharacterSchema(many=True)
+    """Видимые персонажи комнаты; ?summary=1 — только id, имя, владелец и версия."""
+    summary = request.args.get('summary') in ('1', 'true')
+    character_edits.flush_lobby(lobby_id)
+    characters = CharacterService.get_lobby_characters(lobby_id, participant.user_id, summary=summary)
+    schema = CharacterSummarySchema(many=True) if summary else CharacterSchema(many=True)
     return jsonify(schema.dump(characters)), 200
 
 @lobbies_bp.route('/<int:lobby_id>/characters', methods=['POST'])
@@ -237,22 +277,86 @@ def create_lobby_character(lobby_id, lobby, participant):
 @lobbies_bp.route('/characters/<int:character_id>', methods=['GET'])
 @jwt_required()
 def get_character(character_id):
+    # Правки из буфера сокетов — в БД до чтения/записи
+    character_edits.flush(character_id)
     user_id = int(get_jwt_identity())
     character = CharacterService.get_character(character_id, user_id)
     schema = CharacterSchema()
     return jsonify(schema.dump(character)), 200
 
+@lobbies_bp.route('/characters/<int:character_id>/skills', methods=['GET'])
+@jwt_required()
+def get_character_skills(character_id):
+    """Навыки и характеристики персонажа, по которым можно бросать: {имя: бонус}."""
+    character_edits.flush(character_id)
+    user_id = int(get_jwt_identity())
+    character = CharacterService.get_character(character_id, user_id)
+    return jsonify({
+        'character_id': character.id,
+        'skills': CharacterService.get_skill_index(character)
+    }), 200
+
+@lobbies_bp.route('/characters/<int:character_id>/stats', methods=['GET'])
+@jwt_required()
+def get_character_stats(character_id):
+    """Вес, объём, стоимость предметов персонажа и предупреждения о несовместимостях."""
+    character_edits.flush(character_id)
+    user_id = int(get_jwt_identity())
+    character = CharacterService.get_character(character_id, user_id)
+    return jsonify(derived_stats.get(character)), 200
+
 @lobbies_bp.route('/characters/<int:character_id>', methods=['PUT'])
 @jwt_required()
 def update_character(character_id):
     user_id = int(get_jwt_identity())
     data = request.get_json()
-    character = CharacterService.update_character(character_id, user_id, data)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Body must be a JSON object'}), 400
+    # Лист — через буфер правок, как из сокета: правки REST и сокетов идут под одной
+    # блокировкой персонажа и не теряются при отложенной записи
+    updates = {k: v for k, v in data.items() if k != 'data'}
+    character_edits.flush(character_id)
+    if updates:
+        CharacterService.update_character(character_id, user_id, updates)
+    if 'data' in data:
+        CharacterService.get_character(character_id, user_id)
+        character_edits.edit(character_id, user_id, None, 'character_data_updated', {
+            'character_id': character_id,
+            'updates': {'data': data['data']},
+            'updated_by': user_id
+        }, data=data['data'])
+        character_edits.flush(character_id)
     return jsonify({'message': 'Character updated'}), 200
 
+@lobbies_bp.route('/characters/<int:character_id>', methods=['PATCH'])
+@jwt_required()
+def patch_character(character_id):
+    """JSON Patch к data: тело — список операций или {'patch': [...], 'version': n}."""
+    user_id = int(get_jwt_identity())
+    body = request.get_json(silent=True)
+    if isinstance(body, list):
+        patch, version = body, None
+    elif isinstance(body, dict) and isinstance(body.get('patch'), list):
+        patch, version = body['patch'], body.get('version')
+    else:
+        return jsonify({'error': 'Body must be a JSON Patch (list of operations)'}), 400
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+        return jsonify({'error': 'version must be an integer'}), 400
+
+    CharacterService.get_character(character_id, user_id)
+    version = character_edits.edit(character_id, user_id, None, 'character_data_patched', {
+        'character_id': character_id,
+        'patch': patch,
+        'updated_by': user_id
+    }, patch=patch, base_version=version)
+    # Ответ REST — после записи в БД
+    character_edits.flush(character_id)
+    return jsonify({'character_id': character_id, 'version': version}), 200
+
 @lobbies_bp.route('/characters/<int:character_id>', methods=['DELETE'])
 @jwt_required()
 def delete_character(character_id):
+    character_edits.flush(character_id)
     user_id = int(get_jwt_identity())
     character = CharacterService.get_character(character_id, user_id)
     CharacterService.delete_character(character_id, user_id)
@@ -344,7 +448,7 @@ def export_lobby(lobby_id, lobby):
 @requires_gm
 def update_weather(lobby_id, lobby):
     data = request.get_json()
-    lobby.weather_settings = data
+    Lobby.query.get(lobby_id).weather_settings = data
     db.session.commit()
 
     socketio.emit('weather_updated', data, room=f"lobby_{lobby_id}")
@@ -372,30 +476,51 @@ def get_joined_lobbies():
 @jwt_required()
 @requires_participant
 def get_lobby_templates(lobby_id, lobby, participant):
-    """Возвращает объединённый список глобальных и локальных шаблонов с фильтрацией по категории."""
+    """
+    Возвращает объединённый список глобальных и локальных шаблонов с фильтрацией по категории.
+    Ответ собирается из кэша каталога и несёт ETag: при совпадении If-None-Match — 304.
+    """
     category = request.args.get('category')
     subcategory = request.args.get('subcategory')
 
-    query_global = ItemTemplate.query
-    query_local = LobbyItemTemplate.query.filter_by(lobby_id=lobby_id)
-
-    if category:
-        query_global = query_global.filter_by(category=category)
-        query_local = query_local.filter_by(category=category)
-    if subcategory:
-        query_global = query_global.filter_by(subcategory=subcategory)
-        query_local = query_local.filter_by(subcategory=subcategory)
-
-    global_templates = query_global.all()
-    local_templates = query_local.all()
+    etag, global_templates, local_templates = template_catalog.view(lobby_id, category, subcategory)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = jsonify({'global': global_templates, 'local': local_templates})
+    response.set_etag(etag)
+    # Браузер хранит ответ, но каждый раз сверяет ETag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-    global_schema = ItemTemplateSchema(many=True)
-    local_schema = LobbyItemTemplateSchema(many=True)
 
-    return jsonify({
-        'global': global_schema.dump(global_templates),
-        'local': local_schema.dump(local_templates)
-    })
+@lobbies_bp.route('/<int:lobby_id>/templates/search', methods=['GET'])
+@jwt_required()
+@requires_participant
+def search_lobby_templates(lobby_id, lobby, participant):
+    """
+    Поиск по глобальным и локальным шаблонам: ?q=&match=prefix|substring&category=&subcategory=
+    &min_price=&max_price= (и weight, volume)&attr.<имя>=<значение>&attr.<имя>.min=
+    &sort=name|price|weight|volume&order=asc|desc&limit=1-200&cursor=<next_cursor>.
+    """
+    limit = request.args.get('limit', default=TEMPLATE_SEARCH_LIMIT, type=int)
+    if limit <= 0 or limit > MAX_TEMPLATE_SEARCH_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_TEMPLATE_SEARCH_LIMIT}'}), 400
+    ranges, attrs = TemplateSearchService.parse_args(request.args)
+    page = TemplateSearchService.search(
+        lobby_id,
+        q=request.args.get('q'),
+        match=request.args.get('match', 'prefix'),
+        category=request.args.get('category'),
+        subcategory=request.args.get('subcategory'),
+        ranges=ranges,
+        attrs=attrs,
+        sort=request.args.get('sort', 'name'),
+        order=request.args.get('order', 'asc'),
+        cursor=request.args.get('cursor'),
+        limit=limit
+    )
+    return jsonify(page), 200
 
 
 @lobbies_bp.route('/<int:lobby_id>/templates', methods=['POST'])
@@ -413,9 +538,49 @@ def create_lobby_template(lobby_id, lobby):
     )
     db.session.add(template)
     db.session.commit()
+    invalidate_template(template_key(template), lobby_id)
     return jsonify(schema.dump(template)), 201
 
 
+@lobbies_bp.route('/<int:lobby_id>/templates/export', methods=['GET'])
+@jwt_required()
+@requires_participant
+def export_lobby_templates(lobby_id, lobby, participant):
+    """Локальные шаблоны комнаты потоком: ?format=ndjson|csv."""
+    fmt = request.args.get('format', 'ndjson')
+    lines = TemplateTransferService.export(lobby_id, fmt)
+    return Response(
+        stream_with_context(lines),
+        mimetype=TEMPLATE_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename=lobby_{lobby_id}_templates.{fmt}'}
+    )
+
+
+@lobbies_bp.route('/<int:lobby_id>/templates/import', methods=['POST'])
+@jwt_required()
+@requires_gm
+def import_lobby_templates(lobby_id, lobby):
+    """
+    Массовый импорт локальных шаблонов: файл (multipart, поле file) или тело запроса
+    в NDJSON/CSV. ?format=ndjson|csv (по умолчанию по расширению файла), ?mode=upsert|insert.
+    Шаблоны сопоставляются по (name, category); в ответе — отчёт с ошибками по строкам.
+    """
+    file = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if file and file.filename and file.filename.lower().endswith('.csv') else 'ndjson'
+    stream = file.stream if file else request.stream
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        report = TemplateTransferService.import_lines(
+            lines, fmt, lobby_id=lobby_id, user_id=int(get_jwt_identity()),
+            mode=request.args.get('mode', 'upsert')
+        )
+    except UnicodeDecodeError:
+        return jsonify({'error': 'File must be UTF-8 encoded'}), 400
+    return jsonify(report), 200
+
+
 @lobbies_bp.route('/<int:lobby_id>/templates/<int:template_id>', methods=['PUT'])
 @jwt_required()
 @requires_gm
@@ -427,6 +592,7 @@ def update_lobby_template(lobby_id, lobby, template_id):
     for key, value in validated_data.items():
         setattr(template, key, value)
     db.session.commit()
+    invalidate_template(template_key(template), lobby_id)
     return jsonify(schema.dump(template))
 
 
@@ -435,8 +601,10 @@ def update_lobby_template(lobby_id, lobby, template_id):
 @requires_gm
 def delete_lobby_template(lobby_id, lobby, template_id):
     template = LobbyItemTemplate.query.filter_by(id=template_id, lobby_id=lobby_id).first_or_404()
+    key = template_key(template)
     db.session.delete(template)
     db.session.commit()
+    invalidate_template(key, lobby_id)
     return '', 204
 
 # ========== L O C A T I O N S   E N D P O I N T S ==========
@@ -6,7 +6,10 @@
 - LobbyParticipant : связь пользователей с комнатами (участники)
 - GameState      : состояние карты (маркеры)
 - ChatMessage    : сообщения чата
+- ChatSearchPosting, ChatSearchWatermark : обратный индекс для поиска по чату
+- ChatArchiveSegment : сжатые сегменты старых сообщений чата
 - LobbyCharacter : персонажи в комнате
+- CharacterViewer : кому виден персонаж (индекс по visible_to)
 - MapChunk       : данные чанков карты
 - ItemTemplate   : глобальные шаблоны предметов
 - LobbyItemTemplate : локальные (кастомные) шаблоны комнаты
@@ -17,7 +20,9 @@ from .lobby import Lobby
 from .participant import LobbyParticipant
 from .game_state import GameState
 from .chat_message import ChatMessage
-from .character import LobbyCharacter
+from .chat_search import ChatSearchPosting, ChatSearchWatermark
+from .chat_archive import ChatArchiveSegment
+from .character import LobbyCharacter, CharacterViewer
 from .map_chunk import MapChunk
 from .location import Location
 from .location_character import LocationCharacter
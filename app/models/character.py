@@ -10,8 +10,24 @@ class LobbyCharacter(db.Model):
     name = db.Column(db.String(100), nullable=False)
     data = db.Column(db.JSON, nullable=False, default={})
     visible_to = db.Column(db.JSON, nullable=False, default=list)
+    # Плоский индекс навыков/характеристик {имя: бонус}, строится из data при записи
+    # (CharacterService.refresh_skill_index). NULL — ещё не построен.
+    skill_index = db.Column(db.JSON)
+    # Растёт на каждое изменение data: клиенты по нему применяют патчи по порядку
+    version = db.Column(db.Integer, nullable=False, default=0)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     updated_at = db.Column(db.DateTime, onupdate=lambda: datetime.now(timezone.utc))
 
     lobby = db.relationship('Lobby', backref='characters')
-    owner = db.relationship('User', foreign_keys=[owner_id])
\ No newline at end of file
+    owner = db.relationship('User', foreign_keys=[owner_id])
+    viewers = db.relationship('CharacterViewer', cascade='all, delete-orphan')
+
+
+class CharacterViewer(db.Model):
+    """
+    Кому виден персонаж: индекс по visible_to, чтобы фильтровать список персонажей
+    в запросе. Ведётся CharacterService.set_viewers вместе с visible_to.
+    """
+    __tablename__ = 'character_viewers'
+    character_id = db.Column(db.Integer, db.ForeignKey('lobby_characters.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
\ No newline at end of file
@@ -0,0 +1,20 @@
+# app/models/chat_archive.py
+from datetime import datetime, timezone
+from app.extensions import db
+
+class ChatArchiveSegment(db.Model):
+    """
+    Сжатый сегмент старых сообщений комнаты: сообщения с seq из [first_seq, last_seq],
+    удалённые из chat_messages (см. ChatArchiveService).
+    """
+    __tablename__ = 'chat_archive_segments'
+    __table_args__ = (
+        db.Index('ix_chat_archive_segments_lobby_seq', 'lobby_id', 'first_seq', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    lobby_id = db.Column(db.Integer, db.ForeignKey('lobbies.id'), nullable=False)
+    first_seq = db.Column(db.BigInteger, nullable=False)
+    last_seq = db.Column(db.BigInteger, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)  # zlib(JSON-список сообщений)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
@@ -4,12 +4,29 @@ from app.extensions import db
 
 class ChatMessage(db.Model):
     __tablename__ = 'chat_messages'
+    # seq — порядок сообщений в комнате; история читается страницами по (lobby_id, seq),
+    # см. ChatService.get_history. Уникальность защищает от двойной нумерации.
+    #
+    # Существующей БД (миграций в репозитории нет) нужно, например в PostgreSQL:
+    #   ALTER TABLE chat_messages ADD COLUMN seq BIGINT;
+    #   -- до запуска новой версии, пока ни у одного сообщения нет seq:
+    #   UPDATE chat_messages m SET seq = r.rn
+    #   FROM (SELECT id, row_number() OVER (PARTITION BY lobby_id ORDER BY timestamp, id) AS rn
+    #         FROM chat_messages) r
+    #   WHERE m.id = r.id;
+    #   CREATE UNIQUE INDEX ix_chat_messages_lobby_seq ON chat_messages (lobby_id, seq);
+    # Индекс допускает NULL; сообщения без seq, если UPDATE не выполнялся, нумерует
+    # ChatService.ensure_sequence при первом обращении к комнате.
+    __table_args__ = (
+        db.Index('ix_chat_messages_lobby_seq', 'lobby_id', 'seq', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     lobby_id = db.Column(db.Integer, db.ForeignKey('lobbies.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     username = db.Column(db.String(80), nullable=False)
     message = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    seq = db.Column(db.BigInteger)  # NULL у сообщений, сохранённых до появления seq
 
     lobby = db.relationship('Lobby', backref='chat_messages')
     user = db.relationship('User')
\ No newline at end of file
@@ -0,0 +1,17 @@
+# app/models/chat_search.py
+from app.extensions import db
+
+class ChatSearchPosting(db.Model):
+    """Обратный индекс чата: слово -> сообщения комнаты (по seq), см. ChatSearchService."""
+    __tablename__ = 'chat_search_postings'
+    lobby_id = db.Column(db.Integer, db.ForeignKey('lobbies.id'), primary_key=True)
+    term = db.Column(db.String(64), primary_key=True)
+    seq = db.Column(db.BigInteger, primary_key=True)
+    hits = db.Column(db.Integer, nullable=False, default=1)  # вес слова в сообщении
+
+
+class ChatSearchWatermark(db.Model):
+    """До какого seq сообщения комнаты уже попали в индекс (NULL — индекс строится)."""
+    __tablename__ = 'chat_search_watermarks'
+    lobby_id = db.Column(db.Integer, db.ForeignKey('lobbies.id'), primary_key=True)
+    indexed_seq = db.Column(db.BigInteger)
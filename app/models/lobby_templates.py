@@ -5,6 +5,11 @@ from app.extensions import db
 
 class LobbyItemTemplate(db.Model):
     __tablename__ = 'lobby_item_templates'
+    # Шаблоны всегда выбираются по комнате: индексы начинаются с lobby_id
+    __table_args__ = (
+        db.Index('ix_lobby_item_templates_lobby_name_lower', 'lobby_id', db.func.lower(db.text('name'))),
+        db.Index('ix_lobby_item_templates_lobby_category', 'lobby_id', 'category', 'subcategory'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     lobby_id = db.Column(db.Integer, db.ForeignKey('lobbies.id', ondelete='CASCADE'), nullable=False)
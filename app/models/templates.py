@@ -5,6 +5,14 @@ from app.extensions import db
 
 class ItemTemplate(db.Model):
     __tablename__ = 'item_templates'
+    # Поиск шаблонов (TemplateSearchService): префикс названия без регистра, диапазоны, сортировка
+    __table_args__ = (
+        db.Index('ix_item_templates_name_lower', db.func.lower(db.text('name'))),
+        db.Index('ix_item_templates_category_subcategory', 'category', 'subcategory'),
+        db.Index('ix_item_templates_price', 'price'),
+        db.Index('ix_item_templates_weight', 'weight'),
+        db.Index('ix_item_templates_volume', 'volume'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)  # название
@@ -12,8 +12,20 @@ class CharacterSchema(Schema):
     owner_username = fields.Method("get_owner_username")
     data = fields.Dict()
     visible_to = fields.List(fields.Int())
+    version = fields.Int(dump_only=True)
     created_at = fields.DateTime()
     updated_at = fields.DateTime()
 
     def get_owner_username(self, obj):
-        return obj.owner.username if obj.owner is not None else None
\ No newline at end of file
+        return obj.owner.username if obj.owner is not None else None
+
+class CharacterSummarySchema(Schema):
+    """Краткая запись для списков: лист целиком — GET /lobbies/characters/<id>."""
+    id = fields.Int(dump_only=True)
+    name = fields.Str()
+    owner_id = fields.Int()
+    owner_username = fields.Method("get_owner_username")
+    version = fields.Int(dump_only=True)
+
+    def get_owner_username(self, obj):
+        return obj.owner.username if obj.owner is not None else None
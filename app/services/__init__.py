@@ -6,5 +6,9 @@
 - participant.py : вход/выход из комнаты, бан/разбан, получение списка забаненных
 - map.py         : работа с чанками и тайлами, экспорт/импорт, генерация карты
 - character.py   : управление персонажами (создание, обновление, видимость)
+- chat.py        : история чата с постраничной выборкой по курсору
+- chat_search.py : полнотекстовый поиск по чату (обратный индекс)
+- chat_archive.py: архив старых сообщений чата в сжатых сегментах
+- access.py      : кэш прав доступа к комнатам (GM, участники, баны)
 - exceptions.py  : кастомные исключения (ValidationError, NotFoundError, PermissionDenied)
 """
\ No newline at end of file
@@ -0,0 +1,122 @@
+# app/services/access.py
+"""
+Кэш прав доступа к комнатам: GM, участники и флаги бана.
+
+Используется декораторами @requires_participant/@requires_gm, сокет-обработчиками
+и сервисами вместо пары запросов Lobby + LobbyParticipant на каждую проверку.
+Запись комнаты собирается двумя запросами при первом обращении и живёт до явной
+инвалидации (ParticipantService.join_lobby/leave_lobby/ban_user/unban_user,
+LobbyService.delete_lobby); инвалидация рассылается остальным воркерам через pubsub.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from app.backends.pubsub import pubsub
+from app.extensions import db
+from app.models import Lobby, LobbyParticipant
+
+logger = logging.getLogger(__name__)
+
+ParticipantAccess = namedtuple('ParticipantAccess', ['lobby_id', 'user_id', 'is_banned'])
+
+
+class LobbyAccess:
+    """Снимок прав в комнате. Атрибуты id/gm_id/is_active совместимы с Lobby."""
+    __slots__ = ('id', 'gm_id', 'is_active', 'members')
+
+    def __init__(self, lobby_id, gm_id, is_active, members):
+        self.id = lobby_id
+        self.gm_id = gm_id
+        self.is_active = is_active
+        self.members = members  # user_id -> is_banned
+
+    def is_gm(self, user_id):
+        return self.gm_id == user_id
+
+    def participant(self, user_id):
+        """Запись участника (в том числе забаненного) или None."""
+        if user_id not in self.members:
+            return None
+        return ParticipantAccess(self.id, user_id, self.members[user_id])
+
+    def is_member(self, user_id):
+        """Участник комнаты и не забанен."""
+        return self.members.get(user_id) is False
+
+
+class LobbyAccessCache:
+    def __init__(self):
+        self._entries = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, lobby_id):
+        """Возвращает LobbyAccess для комнаты или None, если комнаты нет."""
+        entry = self._entries.get(lobby_id)
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        generation = self._generations.get(lobby_id, 0)
+        entry = self._load(lobby_id)
+        if entry is None:
+            return None
+        with self._lock:
+            # Если пока мы читали БД комнату инвалидировали, не кладём устаревший снимок
+            if self._generations.get(lobby_id, 0) == generation:
+                self._entries[lobby_id] = entry
+        return entry
+
+    def invalidate(self, lobby_id, broadcast=True):
+        with self._lock:
+            self._entries.pop(lobby_id, None)
+            self._generations[lobby_id] = self._generations.get(lobby_id, 0) + 1
+            self.invalidations += 1
+        logger.debug(f"Access cache invalidated for lobby {lobby_id}")
+        if broadcast:
+            pubsub.publish('access.invalidate', lobby_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'size': len(self._entries)
+        }
+
+    @staticmethod
+    def _load(lobby_id):
+        row = db.session.query(Lobby.gm_id, Lobby.is_active).filter(Lobby.id == lobby_id).first()
+        if row is None:
+            return None
+        members = dict(
+            db.session.query(LobbyParticipant.user_id, LobbyParticipant.is_banned)
+            .filter(LobbyParticipant.lobby_id == lobby_id)
+            .all()
+        )
+        # is_banned может быть NULL у старых записей
+        members = {uid: bool(banned) for uid, banned in members.items()}
+        return LobbyAccess(lobby_id, row.gm_id, bool(row.is_active), members)
+
+
+access_cache = LobbyAccessCache()
+pubsub.subscribe('access.invalidate', lambda lobby_id: access_cache.invalidate(lobby_id, broadcast=False))
+
+
+def get_lobby_access(lobby_id):
+    """Права в активной комнате или None (нет комнаты / комната удалена)."""
+    try:
+        lobby_id = int(lobby_id)
+    except (TypeError, ValueError):
+        return None
+    access = access_cache.get(lobby_id)
+    if access is None or not access.is_active:
+        return None
+    return access
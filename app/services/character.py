@@ -1,17 +1,103 @@
 # app/services/character.py
 import logging
-from sqlalchemy.orm import joinedload
+import threading
+from sqlalchemy import or_, func, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only
 from app.extensions import db
-from app.models import LobbyCharacter, Lobby, LobbyParticipant
-from app.services.exceptions import NotFoundError, PermissionDenied, ValidationError
+from app.models import LobbyCharacter, CharacterViewer, User
+from app.services.access import get_lobby_access
+from app.services.exceptions import NotFoundError, PermissionDenied, ValidationError, ConflictError
+from app.utils.json_patch import apply_patch, JsonPatchError
 
 logger = logging.getLogger(__name__)
 
+# Комнаты, для которых character_viewers уже сверен с visible_to (см. ensure_viewers)
+_indexed_lobbies = set()
+_indexed_lock = threading.Lock()
+
+def _is_bonus(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
 class CharacterService:
+    @staticmethod
+    def build_skill_index(data):
+        """
+        Плоский индекс {имя: бонус} из листа персонажа. Числовые значения берутся
+        из skills (верхнего уровня или data.skills) и из вложенных словарей
+        (характеристики и т.п.); при совпадении имён приоритет у skills.
+        """
+        if not isinstance(data, dict):
+            return {}
+        root = data['data'] if 'skills' not in data and isinstance(data.get('data'), dict) else data
+        index = {}
+        for section in root.values():
+            if isinstance(section, dict):
+                for name, value in section.items():
+                    if _is_bonus(value):
+                        index.setdefault(name, value)
+        skills = root.get('skills')
+        if isinstance(skills, dict):
+            index.update({name: value for name, value in skills.items() if _is_bonus(value)})
+        return index
+
+    @staticmethod
+    def refresh_skill_index(character):
+        """Пересобирает индекс навыков после изменения data (коммит — на вызывающем)."""
+        character.skill_index = CharacterService.build_skill_index(character.data)
+        return character.skill_index
+
+    @staticmethod
+    def get_skill_index(character):
+        """Индекс навыков персонажа; у персонажей, сохранённых до появления индекса, строится и сохраняется."""
+        if character.skill_index is None:
+            CharacterService.refresh_skill_index(character)
+            db.session.commit()
+        return character.skill_index
+
+    @staticmethod
+    def get_skill_bonus(character, skill_name):
+        """Бонус навыка или характеристики для броска; None — такого нет."""
+        return CharacterService.get_skill_index(character).get(skill_name)
+
+    @staticmethod
+    def store_data(character_id, data, version):
+        """
+        Записывает лист и версию одним UPDATE (отложенная запись буфера правок).
+        Лист не старее записанного: если в БД версия не меньше, ничего не пишется
+        (False) — так запоздавший снимок не затрёт более новый.
+        """
+        updated = LobbyCharacter.query.filter(
+            LobbyCharacter.id == character_id,
+            func.coalesce(LobbyCharacter.version, 0) < version
+        ).update({
+            'data': data,
+            'skill_index': CharacterService.build_skill_index(data),
+            'version': version
+        }, synchronize_session=False)
+        db.session.commit()
+        return updated > 0
+
+    @staticmethod
+    def rebase_data(character_id, data):
+        """
+        Записывает лист поверх того, что в БД, со следующей версией (версия буфера
+        правок оказалась не новее записанной). Возвращает новую версию.
+        """
+        character = db.session.get(LobbyCharacter, character_id, with_for_update=True)
+        if not character:
+            raise NotFoundError("Character not found")
+        character.data = data
+        CharacterService.refresh_skill_index(character)
+        character.version = (character.version or 0) + 1
+        db.session.commit()
+        return character.version
+
     @staticmethod
     def create_character(lobby_id, owner_id, name, data=None):
-        participant = LobbyParticipant.query.filter_by(lobby_id=lobby_id, user_id=owner_id).first()
-        if not participant:
+        access = get_lobby_access(lobby_id)
+        if not access or not access.participant(owner_id):
             raise PermissionDenied("You are not in this lobby")
 
         character = LobbyCharacter(
@@ -21,6 +107,7 @@ class CharacterService:
             data=data or {},
             visible_to=[]
         )
+        CharacterService.refresh_skill_index(character)
         db.session.add(character)
         db.session.commit()
         db.session.refresh(character, attribute_names=['owner'])
@@ -35,10 +122,8 @@ class CharacterService:
             raise NotFoundError("Character not found")
 
         # Проверяем, что пользователь в той же комнате
-        participant = LobbyParticipant.query.filter_by(
-            lobby_id=character.lobby_id, user_id=user_id
-        ).first()
-        if not participant:
+        access = get_lobby_access(character.lobby_id)
+        if not access or not access.participant(user_id):
             raise PermissionDenied("Access denied")
 
         return character
@@ -51,19 +136,15 @@ class CharacterService:
             raise NotFoundError("Character not found")
 
         # Проверяем, что пользователь вообще в лобби
-        participant = LobbyParticipant.query.filter_by(
-            lobby_id=character.lobby_id, user_id=user_id
-        ).first()
-        if not participant:
+        lobby = get_lobby_access(character.lobby_id)
+        if not lobby or not lobby.participant(user_id):
             raise PermissionDenied("You are not in this lobby")
 
-        lobby = Lobby.query.get(character.lobby_id)
-
         # Если пытаются изменить visible_to, проверяем права (только владелец или GM)
         if 'visible_to' in updates:
             if character.owner_id != user_id and lobby.gm_id != user_id:
                 raise PermissionDenied("Only owner or GM can change visibility")
-            character.visible_to = list(updates['visible_to'])
+            CharacterService.set_viewers(character, updates['visible_to'])
 
         # Разрешаем обновление остальных полей
         if 'name' in updates:
@@ -71,11 +152,47 @@ class CharacterService:
         if 'data' in updates:
             # Можно разрешить менять data всем
             character.data = updates['data']
+            CharacterService.refresh_skill_index(character)
+            character.version = (character.version or 0) + 1
 
         db.session.commit()
         logger.info(f"Character {character_id} updated by user {user_id}")
         return character
 
+    @staticmethod
+    def patch_character(character_id, user_id, patch, base_version=None):
+        """
+        Применяет JSON Patch (RFC 6902) к data персонажа и увеличивает version.
+        base_version — версия, от которой считал патч клиент; если персонаж уже
+        изменился, патч не применяется (ConflictError). None — без проверки.
+        """
+        character = db.session.get(LobbyCharacter, character_id, with_for_update=True)
+        if not character:
+            raise NotFoundError("Character not found")
+
+        lobby = get_lobby_access(character.lobby_id)
+        if not lobby or not lobby.participant(user_id):
+            raise PermissionDenied("You are not in this lobby")
+
+        if base_version is not None and base_version != character.version:
+            db.session.rollback()
+            raise ConflictError(f"Character changed: version {character.version}, patch is for {base_version}")
+        try:
+            data = apply_patch(character.data or {}, patch)
+        except JsonPatchError as e:
+            db.session.rollback()
+            raise ValidationError(f"Invalid patch: {e}")
+        if not isinstance(data, dict):
+            db.session.rollback()
+            raise ValidationError("Character data must stay an object")
+
+        character.data = data
+        CharacterService.refresh_skill_index(character)
+        character.version = (character.version or 0) + 1
+        db.session.commit()
+        logger.debug(f"Character {character_id} patched by user {user_id} ({len(patch)} ops, v{character.version})")
+        return character
+
     @staticmethod
     def delete_character(character_id, user_id):
         """Удаление персонажа (владелец или GM)."""
@@ -83,8 +200,8 @@ class CharacterService:
         if not character:
             raise NotFoundError("Character not found")
 
-        lobby = Lobby.query.get(character.lobby_id)
-        if character.owner_id != user_id and lobby.gm_id != user_id:
+        lobby = get_lobby_access(character.lobby_id)
+        if character.owner_id != user_id and (not lobby or lobby.gm_id != user_id):
             raise PermissionDenied("Permission denied")
 
         db.session.delete(character)
@@ -92,25 +209,86 @@ class CharacterService:
         logger.info(f"Character {character_id} deleted by user {user_id}")
 
     @staticmethod
-    def get_lobby_characters(lobby_id, user_id):
-        """Возвращает список персонажей в комнаты, видимых пользователю."""
-        participant = LobbyParticipant.query.filter_by(lobby_id=lobby_id, user_id=user_id).first()
-        if not participant:
+    def get_lobby_characters(lobby_id, user_id, summary=False):
+        """
+        Персонажи комнаты, видимые пользователю (свои, из visible_to, все — для GM).
+        Видимость проверяется в запросе по character_viewers. summary — без data:
+        только id, name, владелец и версия.
+        """
+        lobby = get_lobby_access(lobby_id)
+        if not lobby or not lobby.participant(user_id):
             raise PermissionDenied("You are not in this lobby")
 
-        lobby = Lobby.query.get(lobby_id)
-        is_gm = (lobby.gm_id == user_id)
+        query = LobbyCharacter.query.filter(LobbyCharacter.lobby_id == lobby_id)
+        if not lobby.is_gm(user_id):
+            CharacterService.ensure_viewers(lobby_id)
+            query = query.filter(or_(
+                LobbyCharacter.owner_id == user_id,
+                LobbyCharacter.viewers.any(CharacterViewer.user_id == user_id)
+            ))
+        if summary:
+            query = query.options(
+                load_only(LobbyCharacter.id, LobbyCharacter.name, LobbyCharacter.owner_id, LobbyCharacter.version),
+                joinedload(LobbyCharacter.owner).load_only(User.username)
+            )
+        else:
+            query = query.options(joinedload(LobbyCharacter.owner))
+        return query.order_by(LobbyCharacter.id).all()
 
-        # Явно загружаем связанного владельца
-        characters = LobbyCharacter.query.filter_by(lobby_id=lobby_id).options(
-            joinedload(LobbyCharacter.owner)
-        ).all()
+    @staticmethod
+    def ensure_viewers(lobby_id):
+        """
+        Заполняет character_viewers по visible_to персонажей комнаты, сохранённых
+        до появления таблицы (раз на комнату в процессе), — иначе такие персонажи
+        пропали бы из списков других игроков. Только добавляет недостающие строки.
+        """
+        if lobby_id in _indexed_lobbies:
+            return
+        with _indexed_lock:
+            if lobby_id in _indexed_lobbies:
+                return
+            CharacterService._backfill_viewers(lobby_id)
+            _indexed_lobbies.add(lobby_id)
 
-        result = []
-        for c in characters:
-            if c.owner_id == user_id or is_gm or user_id in c.visible_to:
-                result.append(c)
-        return result
+    @staticmethod
+    def _backfill_viewers(lobby_id):
+        rows = db.session.query(LobbyCharacter.id, LobbyCharacter.visible_to) \
+            .filter(LobbyCharacter.lobby_id == lobby_id).all()
+        wanted = {(character_id, int(u)) for character_id, visible_to in rows for u in visible_to or []
+                  if (isinstance(u, int) and not isinstance(u, bool)) or (isinstance(u, str) and u.isdigit())}
+        if not wanted:
+            return
+        # Несуществующих пользователей из старых visible_to пропускаем (внешний ключ)
+        users = {u for (u,) in db.session.query(User.id).filter(User.id.in_({u for _, u in wanted}))}
+        wanted = {(c, u) for c, u in wanted if u in users}
+        existing = set(db.session.query(CharacterViewer.character_id, CharacterViewer.user_id)
+                       .filter(CharacterViewer.character_id.in_([r.id for r in rows])).all())
+        missing = wanted - existing
+        if not missing:
+            return
+        db.session.execute(insert(CharacterViewer),
+                           [{'character_id': c, 'user_id': u} for c, u in sorted(missing)])
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Строки уже добавил другой воркер
+            db.session.rollback()
+            return
+        logger.info(f"Backfilled {len(missing)} character viewers in lobby {lobby_id}")
+
+    @staticmethod
+    def set_viewers(character, visible_to):
+        """Меняет visible_to и индекс character_viewers (коммит — на вызывающем)."""
+        if not isinstance(visible_to, list) or \
+                not all(isinstance(u, int) and not isinstance(u, bool) for u in visible_to):
+            raise ValidationError("visible_to must be a list of user ids")
+        user_ids = set(visible_to)
+        current = {v.user_id: v for v in character.viewers}
+        for user_id in current.keys() - user_ids:
+            character.viewers.remove(current[user_id])
+        for user_id in user_ids - current.keys():
+            character.viewers.append(CharacterViewer(user_id=user_id))
+        character.visible_to = list(visible_to)
 
     @staticmethod
     def set_visibility(character_id, gm_id, visible_to):
@@ -119,14 +297,14 @@ class CharacterService:
         if not character:
             raise NotFoundError("Character not found")
 
-        lobby = Lobby.query.get(character.lobby_id)
-        if lobby.gm_id != gm_id:
+        lobby = get_lobby_access(character.lobby_id)
+        if not lobby or lobby.gm_id != gm_id:
             raise PermissionDenied("Only GM can change visibility")
 
         if not isinstance(visible_to, list):
             raise ValidationError("visible_to must be a list")
 
-        character.visible_to = list(visible_to)
+        CharacterService.set_viewers(character, visible_to)
         db.session.commit()
         logger.info(f"Visibility of character {character_id} set to {visible_to} by GM {gm_id}")
         return character
\ No newline at end of file
@@ -0,0 +1,157 @@
+# app/services/chat.py
+import logging
+import threading
+from datetime import timezone
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import ChatMessage
+from app.services.chat_archive import ChatArchiveService
+from app.services.exceptions import ValidationError
+
+logger = logging.getLogger(__name__)
+
+HISTORY_LIMIT = 50      # страница истории по умолчанию (и при первом входе)
+MAX_HISTORY_LIMIT = 100
+CATCH_UP_LIMIT = 200    # догрузка пропущенных сообщений после переподключения
+
+# Комнаты, у которых старые сообщения (seq IS NULL) уже пронумерованы этим процессом
+_sequenced_lobbies = set()
+_sequenced_lock = threading.Lock()
+
+
+class ChatService:
+    """
+    Порядок сообщений в комнате задаёт seq — номер, который сервер присваивает
+    при приёме сообщения (строго возрастает внутри комнаты). Курсор истории — seq.
+    """
+
+    @staticmethod
+    def encode_cursor(seq):
+        return str(seq)
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            return int(cursor)
+        except (TypeError, ValueError):
+            raise ValidationError("Invalid cursor")
+
+    @staticmethod
+    def payload(seq, username, text, timestamp):
+        """Сообщение в формате new_message / истории (время — всегда с явным UTC)."""
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        return {
+            'seq': seq,
+            'username': username,
+            'message': text,
+            'timestamp': timestamp.isoformat(),
+            'cursor': ChatService.encode_cursor(seq)
+        }
+
+    @staticmethod
+    def serialize(message):
+        return ChatService.payload(message.seq, message.username, message.message, message.timestamp)
+
+    @staticmethod
+    def ensure_sequence(lobby_id):
+        """
+        Нумерует сообщения комнаты, сохранённые до появления seq, и возвращает
+        текущий максимальный seq. Старые сообщения получают номера ниже
+        минимального (по порядку (timestamp, id)), поэтому остаются в начале истории.
+        """
+        if lobby_id not in _sequenced_lobbies:
+            with _sequenced_lock:
+                if lobby_id not in _sequenced_lobbies:
+                    ChatService._backfill(lobby_id)
+                    _sequenced_lobbies.add(lobby_id)
+        hot_max = db.session.query(func.max(ChatMessage.seq)).filter(ChatMessage.lobby_id == lobby_id).scalar()
+        if hot_max is not None:
+            return hot_max
+        # Горячая таблица пуста — вся история может быть в архиве
+        return ChatArchiveService.seq_bounds(lobby_id)[1] or 0
+
+    @staticmethod
+    def _backfill(lobby_id):
+        legacy_ids = [row.id for row in db.session.query(ChatMessage.id)
+                      .filter(ChatMessage.lobby_id == lobby_id, ChatMessage.seq.is_(None))
+                      .order_by(ChatMessage.timestamp, ChatMessage.id)]
+        if not legacy_ids:
+            return
+        lowest = db.session.query(func.min(ChatMessage.seq)).filter(ChatMessage.lobby_id == lobby_id).scalar()
+        archived_lowest = ChatArchiveService.seq_bounds(lobby_id)[0]
+        if archived_lowest is not None:
+            lowest = archived_lowest
+        start = (lowest if lowest is not None else 1) - len(legacy_ids)
+        db.session.bulk_update_mappings(ChatMessage, [
+            {'id': message_id, 'seq': start + i} for i, message_id in enumerate(legacy_ids)
+        ])
+        db.session.commit()
+        logger.info(f"Assigned seq to {len(legacy_ids)} legacy chat messages in lobby {lobby_id}")
+
+    @staticmethod
+    def create_message(lobby_id, user_id, username, text, attempts=3):
+        """
+        Синхронная запись с seq = max + 1 — для воркеров, которые не владеют
+        комнатой (несколько воркеров без привязки комнат). Конфликт seq между
+        воркерами ловит уникальный индекс, запись повторяется.
+        """
+        for attempt in range(attempts):
+            seq = ChatService.ensure_sequence(lobby_id) + 1
+            message = ChatMessage(lobby_id=lobby_id, user_id=user_id, username=username, message=text, seq=seq)
+            db.session.add(message)
+            try:
+                db.session.commit()
+                return message
+            except IntegrityError:
+                db.session.rollback()
+                if attempt == attempts - 1:
+                    raise
+
+    @staticmethod
+    def get_history(lobby_id, before=None, after=None, limit=HISTORY_LIMIT):
+        """
+        Страница истории чата (keyset по (lobby_id, seq), индекс ix_chat_messages_lobby_seq),
+        при необходимости дочитывается из архива.
+        - before: курсор — сообщения старше него (без курсоров — последние сообщения)
+        - after: курсор — сообщения новее него (догрузка после переподключения)
+        Возвращает словарь: messages (по возрастанию seq), has_more,
+        older/newer — курсоры для следующих страниц в обе стороны.
+        """
+        if before is not None and after is not None:
+            raise ValidationError("Use either before or after, not both")
+        if not isinstance(limit, int) or limit < 1:
+            raise ValidationError("limit must be a positive integer")
+
+        ChatService.ensure_sequence(lobby_id)
+        query = ChatMessage.query.filter(ChatMessage.lobby_id == lobby_id)
+        if after is not None:
+            query = query.filter(ChatMessage.seq > ChatService.decode_cursor(after)).order_by(ChatMessage.seq.asc())
+        else:
+            if before is not None:
+                query = query.filter(ChatMessage.seq < ChatService.decode_cursor(before))
+            query = query.order_by(ChatMessage.seq.desc())
+
+        # limit + 1: лишняя строка говорит, есть ли ещё страница
+        rows = query.limit(limit + 1).all()
+        # Архив: seq в нём меньше любого seq горячей таблицы (см. ChatArchiveService)
+        if after is None and len(rows) <= limit:
+            bound = rows[-1].seq if rows else (ChatService.decode_cursor(before) if before is not None else None)
+            rows += ChatArchiveService.read_before(lobby_id, bound, limit + 1 - len(rows))
+        elif after is not None:
+            archived = ChatArchiveService.read_after(lobby_id, ChatService.decode_cursor(after), limit + 1)
+            rows = (archived + rows)[:limit + 1]
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if after is None:
+            rows.reverse()
+
+        messages = [ChatService.serialize(m) for m in rows]
+        return {
+            'messages': messages,
+            'has_more': has_more,
+            'direction': 'older' if after is None else 'newer',
+            'older': messages[0]['cursor'] if messages else before,
+            'newer': messages[-1]['cursor'] if messages else after
+        }
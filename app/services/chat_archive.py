@@ -0,0 +1,143 @@
+# app/services/chat_archive.py
+import json
+import logging
+import zlib
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import ChatMessage, ChatArchiveSegment
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SIZE = 1000   # сообщений в сегменте
+
+# Сообщение из архива: те же поля, что читает ChatService.serialize у ChatMessage
+ArchivedMessage = namedtuple('ArchivedMessage', 'seq user_id username message timestamp')
+
+
+class ChatArchiveService:
+    """
+    Архив старых сообщений чата.
+
+    Сообщения комнаты старше порога уходят из chat_messages в сжатые сегменты
+    chat_archive_segments (до SEGMENT_SIZE сообщений, по возрастанию seq).
+    Архивируется только начало истории — всё, что раньше первого сообщения
+    моложе порога, — поэтому у каждой комнаты seq в архиве всегда меньше seq
+    в горячей таблице. На этом держится чтение: история и поиск дочитывают
+    архив после (или до) горячей таблицы без слияния.
+    """
+
+    @staticmethod
+    def pack(messages):
+        rows = [[m.seq, m.user_id, m.username, m.message, m.timestamp.isoformat() if m.timestamp else None]
+                for m in messages]
+        return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def unpack(segment):
+        rows = json.loads(zlib.decompress(segment.data).decode('utf-8'))
+        return [ArchivedMessage(seq, user_id, username, message, datetime.fromisoformat(ts) if ts else None)
+                for seq, user_id, username, message, ts in rows]
+
+    @staticmethod
+    def seq_bounds(lobby_id):
+        """(min first_seq, max last_seq) архива комнаты или (None, None)."""
+        return db.session.query(func.min(ChatArchiveSegment.first_seq), func.max(ChatArchiveSegment.last_seq)) \
+            .filter(ChatArchiveSegment.lobby_id == lobby_id).one()
+
+    @staticmethod
+    def read_before(lobby_id, before=None, limit=SEGMENT_SIZE):
+        """До limit архивных сообщений с seq < before (None — самые новые), по убыванию seq."""
+        query = ChatArchiveSegment.query.filter(ChatArchiveSegment.lobby_id == lobby_id)
+        if before is not None:
+            query = query.filter(ChatArchiveSegment.first_seq < before)
+        result = []
+        for segment in query.order_by(ChatArchiveSegment.first_seq.desc()).yield_per(4):
+            messages = [m for m in ChatArchiveService.unpack(segment) if before is None or m.seq < before]
+            result.extend(reversed(messages))
+            if len(result) >= limit:
+                break
+        return result[:limit]
+
+    @staticmethod
+    def read_after(lobby_id, after=None, limit=SEGMENT_SIZE):
+        """До limit архивных сообщений с seq > after (None — с начала), по возрастанию seq."""
+        query = ChatArchiveSegment.query.filter(ChatArchiveSegment.lobby_id == lobby_id)
+        if after is not None:
+            query = query.filter(ChatArchiveSegment.last_seq > after)
+        result = []
+        for segment in query.order_by(ChatArchiveSegment.first_seq.asc()).yield_per(4):
+            result.extend(m for m in ChatArchiveService.unpack(segment) if after is None or m.seq > after)
+            if len(result) >= limit:
+                break
+        return result[:limit]
+
+    @staticmethod
+    def get_messages(lobby_id, seqs):
+        """Архивные сообщения с указанными seq: словарь seq -> ArchivedMessage."""
+        wanted_set = set(seqs)
+        wanted = sorted(wanted_set)
+        if not wanted:
+            return {}
+        found = {}
+        segments = ChatArchiveSegment.query.filter(
+            ChatArchiveSegment.lobby_id == lobby_id,
+            ChatArchiveSegment.first_seq <= wanted[-1],
+            ChatArchiveSegment.last_seq >= wanted[0]
+        ).with_entities(ChatArchiveSegment.id, ChatArchiveSegment.first_seq, ChatArchiveSegment.last_seq).all()
+        # Распаковываем только сегменты, в диапазон которых попал хотя бы один seq
+        needed = [s.id for s in segments
+                  if bisect_left(wanted, s.first_seq) < len(wanted) and wanted[bisect_left(wanted, s.first_seq)] <= s.last_seq]
+        for segment in ChatArchiveSegment.query.filter(ChatArchiveSegment.id.in_(needed)):
+            for message in ChatArchiveService.unpack(segment):
+                if message.seq in wanted_set:
+                    found[message.seq] = message
+        return found
+
+    @staticmethod
+    def archive_lobby(lobby_id, cutoff, segment_size=SEGMENT_SIZE):
+        """
+        Переносит в архив сообщения комнаты, которые старше cutoff и идут раньше
+        первого сообщения моложе cutoff. Один сегмент — одна транзакция
+        (INSERT сегмента + DELETE строк). Возвращает число перенесённых сообщений.
+        """
+        boundary = db.session.query(func.min(ChatMessage.seq)).filter(
+            ChatMessage.lobby_id == lobby_id, ChatMessage.timestamp >= cutoff).scalar()
+        archived = 0
+        while True:
+            query = ChatMessage.query.filter(ChatMessage.lobby_id == lobby_id, ChatMessage.seq.isnot(None))
+            if boundary is not None:
+                query = query.filter(ChatMessage.seq < boundary)
+            rows = query.order_by(ChatMessage.seq).limit(segment_size).all()
+            if not rows:
+                break
+            db.session.add(ChatArchiveSegment(
+                lobby_id=lobby_id, first_seq=rows[0].seq, last_seq=rows[-1].seq,
+                count=len(rows), data=ChatArchiveService.pack(rows)
+            ))
+            deleted = ChatMessage.query.filter(ChatMessage.id.in_([r.id for r in rows])) \
+                .delete(synchronize_session=False)
+            if deleted != len(rows):
+                # Те же строки параллельно архивирует другой воркер
+                db.session.rollback()
+                break
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                break
+            archived += len(rows)
+            if len(rows) < segment_size:
+                break
+        if archived:
+            logger.info(f"Archived {archived} chat messages of lobby {lobby_id}")
+        return archived
+
+    @staticmethod
+    def lobbies_to_archive(cutoff):
+        """Комнаты, у которых в горячей таблице есть сообщения старше cutoff."""
+        return [row.lobby_id for row in db.session.query(ChatMessage.lobby_id)
+                .filter(ChatMessage.timestamp < cutoff).distinct()]
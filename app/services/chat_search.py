@@ -0,0 +1,186 @@
+# app/services/chat_search.py
+import logging
+import re
+import threading
+from collections import Counter
+from sqlalchemy import func, or_, and_, update, insert
+from sqlalchemy.exc import IntegrityError
+from app.extensions import db
+from app.models import ChatMessage, ChatSearchPosting, ChatSearchWatermark
+from app.services.chat import ChatService
+from app.services.chat_archive import ChatArchiveService
+from app.services.exceptions import ValidationError
+
+logger = logging.getLogger(__name__)
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_TERMS = 8
+MAX_TERM_LENGTH = 64
+USERNAME_WEIGHT = 2      # совпадение в имени автора весит больше, чем в тексте
+CATCH_UP_CHUNK = 2000    # сообщений за одну транзакцию при построении индекса
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_index_lock = threading.Lock()
+
+
+class ChatSearchService:
+    """
+    Поиск по чату комнаты через обратный индекс chat_search_postings
+    (lobby_id, term, seq) -> hits.
+
+    Индекс комнаты строится при первом поиске (catch_up) и дальше
+    поддерживается при записи сообщений (index_new). Водяной знак
+    chat_search_watermarks.indexed_seq — последний проиндексированный seq:
+    если новые сообщения идут не сразу за ним (разрыв, запись с другого
+    воркера, индекс ещё не построен), index_new их пропускает, а догоняет
+    следующий catch_up.
+
+    Индекс покрывает и архив (chat_archive_segments): архивные сообщения
+    индексируются при catch_up и достаются из сегментов для выдачи.
+
+    Запрос — слова через пробел, нужны все (AND). Ранг — сумма hits
+    совпавших слов, при равенстве — новее выше. Курсор страницы — "score:seq".
+    """
+
+    @staticmethod
+    def tokenize(text):
+        return [t[:MAX_TERM_LENGTH] for t in _TOKEN_RE.findall((text or '').lower())]
+
+    @staticmethod
+    def postings(lobby_id, seq, username, text):
+        hits = Counter(ChatSearchService.tokenize(text))
+        for term in ChatSearchService.tokenize(username):
+            hits[term] += USERNAME_WEIGHT
+        return [{'lobby_id': lobby_id, 'term': term, 'seq': seq, 'hits': count} for term, count in hits.items()]
+
+    @staticmethod
+    def index_new(lobby_id, rows):
+        """
+        Индексирует только что записанные сообщения комнаты (словари с seq,
+        username, message; по возрастанию seq). Возвращает False, если
+        индекс комнаты не продолжается этими сообщениями — их подберёт catch_up.
+        """
+        if not rows:
+            return True
+        # Условное обновление: водяной знак сдвигается, только если сообщения идут сразу за ним
+        result = db.session.execute(
+            update(ChatSearchWatermark)
+            .where(ChatSearchWatermark.lobby_id == lobby_id,
+                   ChatSearchWatermark.indexed_seq == rows[0]['seq'] - 1)
+            .values(indexed_seq=rows[-1]['seq'])
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            return False
+        postings = [p for row in rows
+                    for p in ChatSearchService.postings(lobby_id, row['seq'], row['username'], row['message'])]
+        if postings:
+            db.session.execute(insert(ChatSearchPosting), postings)
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def catch_up(lobby_id, attempts=3):
+        """Доводит индекс комнаты до последнего сообщения. Возвращает число проиндексированных сообщений."""
+        indexed = 0
+        with _index_lock:
+            ChatService.ensure_sequence(lobby_id)
+            for attempt in range(attempts):
+                try:
+                    indexed += ChatSearchService._catch_up_chunks(lobby_id)
+                    break
+                except IntegrityError:
+                    # Тот же участок параллельно проиндексировал другой воркер — перечитываем водяной знак
+                    db.session.rollback()
+                    if attempt == attempts - 1:
+                        logger.warning(f"Chat search index of lobby {lobby_id} is busy, searching partial index")
+        if indexed:
+            logger.info(f"Indexed {indexed} chat messages in lobby {lobby_id}")
+        return indexed
+
+    @staticmethod
+    def _catch_up_chunks(lobby_id):
+        indexed = 0
+        watermark = db.session.get(ChatSearchWatermark, lobby_id, populate_existing=True)
+        if watermark is None:
+            watermark = ChatSearchWatermark(lobby_id=lobby_id, indexed_seq=None)
+            db.session.add(watermark)
+            db.session.flush()
+        while True:
+            # Сначала архив (его seq меньше, чем в горячей таблице), потом горячая таблица
+            rows = ChatArchiveService.read_after(lobby_id, watermark.indexed_seq, CATCH_UP_CHUNK)
+            if not rows:
+                query = db.session.query(ChatMessage.seq, ChatMessage.username, ChatMessage.message) \
+                    .filter(ChatMessage.lobby_id == lobby_id)
+                if watermark.indexed_seq is not None:
+                    query = query.filter(ChatMessage.seq > watermark.indexed_seq)
+                rows = query.order_by(ChatMessage.seq).limit(CATCH_UP_CHUNK).all()
+            if not rows:
+                db.session.commit()
+                return indexed
+            postings = [p for row in rows
+                        for p in ChatSearchService.postings(lobby_id, row.seq, row.username, row.message)]
+            if postings:
+                db.session.execute(insert(ChatSearchPosting), postings)
+            watermark.indexed_seq = rows[-1].seq
+            db.session.commit()
+            indexed += len(rows)
+
+    @staticmethod
+    def search(lobby_id, query_text, cursor=None, limit=SEARCH_LIMIT):
+        """
+        Ищет сообщения комнаты, содержащие все слова запроса (в тексте или имени автора).
+        Возвращает словарь: results (по убыванию ранга, у каждого — поле score),
+        has_more, next — курсор следующей страницы.
+        """
+        terms = list(dict.fromkeys(ChatSearchService.tokenize(query_text)))
+        if not terms:
+            raise ValidationError("Search query must contain at least one word")
+        if len(terms) > MAX_QUERY_TERMS:
+            raise ValidationError(f"Search query is limited to {MAX_QUERY_TERMS} words")
+        if not isinstance(limit, int) or limit < 1:
+            raise ValidationError("limit must be a positive integer")
+
+        ChatSearchService.catch_up(lobby_id)
+
+        score = func.sum(ChatSearchPosting.hits)
+        query = db.session.query(ChatSearchPosting.seq, score.label('score')) \
+            .filter(ChatSearchPosting.lobby_id == lobby_id, ChatSearchPosting.term.in_(terms)) \
+            .group_by(ChatSearchPosting.seq) \
+            .having(func.count(ChatSearchPosting.term) == len(terms))
+        if cursor is not None:
+            after_score, after_seq = ChatSearchService._decode_cursor(cursor)
+            query = query.having(or_(score < after_score,
+                                     and_(score == after_score, ChatSearchPosting.seq < after_seq)))
+        # limit + 1: лишняя строка говорит, есть ли ещё страница
+        ranked = query.order_by(score.desc(), ChatSearchPosting.seq.desc()).limit(limit + 1).all()
+        has_more = len(ranked) > limit
+        ranked = ranked[:limit]
+
+        seqs = [r.seq for r in ranked]
+        messages = {m.seq: m for m in ChatMessage.query.filter(
+            ChatMessage.lobby_id == lobby_id, ChatMessage.seq.in_(seqs))}
+        if len(messages) < len(seqs):
+            messages.update(ChatArchiveService.get_messages(lobby_id, [seq for seq in seqs if seq not in messages]))
+        results = []
+        for row in ranked:
+            message = messages.get(row.seq)
+            if message is None:
+                continue
+            item = ChatService.serialize(message)
+            item['score'] = int(row.score)
+            results.append(item)
+        return {
+            'results': results,
+            'has_more': has_more,
+            'next': f"{int(ranked[-1].score)}:{ranked[-1].seq}" if has_more else None
+        }
+
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            score, seq = cursor.split(':')
+            return int(score), int(seq)
+        except (AttributeError, ValueError):
+            raise ValidationError("Invalid cursor")
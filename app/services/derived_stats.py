@@ -0,0 +1,274 @@
+# app/services/derived_stats.py
+"""
+Производные характеристики листа персонажа: общий вес, объём, стоимость
+предметов и предупреждения о несовместимостях.
+
+Предмет — любой словарь листа с полем templateId или category. Его вес,
+объём и цена берутся из шаблона (app.services.templates), без шаблона — из
+самого предмета. Правила веса те же, что в getTotalWeight на клиенте:
+магазин весит loadedWeight/emptyWeight, пачка патронов — 0.1 или 0.25 кг;
+содержимое (contents), модули (installedModules) и подсумки (pouches)
+суммируются рекурсивно. Установленный магазин (installedMagazine) — копия
+предмета из инвентаря, в вес не входит, но проверяется на совместимость.
+
+Результат кэшируется по (персонаж, version) и сбрасывается, когда меняется
+любой шаблон, на который ссылается лист.
+"""
+
+import logging
+import threading
+from app.services.templates import template_cache, on_template_change
+
+logger = logging.getLogger(__name__)
+
+CHILD_KEYS = ('contents', 'installedModules', 'pouches')
+MAX_CACHED = 2000          # листов в кэше; сверх — вытесняются самые старые
+MAX_WARNINGS = 100
+
+
+def _number(value, default=0.0):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+
+def _template_id(item):
+    value = item.get('templateId')
+    if value is None and 'pouches' not in item:
+        value = item.get('type')   # подсумки ссылаются на шаблон через type
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)
+    return value if isinstance(value, int) and not isinstance(value, bool) and value > 0 else None
+
+
+def _is_item(node):
+    return 'templateId' in node or 'category' in node
+
+
+def _collect_items(node, out):
+    """Все предметы листа (с вложенными) в порядке обхода."""
+    if isinstance(node, list):
+        for value in node:
+            _collect_items(value, out)
+    elif isinstance(node, dict):
+        if _is_item(node):
+            out.append(node)
+            for key in CHILD_KEYS:
+                _collect_items(node.get(key), out)
+            magazine = node.get('installedMagazine')
+            if isinstance(magazine, dict):
+                out.append(magazine)
+        else:
+            for key, value in node.items():
+                if key != 'attributes':
+                    _collect_items(value, out)
+    return out
+
+
+class _Calculator:
+    def __init__(self, templates, lobby_id):
+        self.templates = templates
+        self.lobby_id = lobby_id
+        self.warnings = []
+
+    def template(self, item):
+        key = _template_id(item)
+        info = self.templates.get(key) if key is not None else None
+        # Локальный шаблон чужой комнаты для этого листа не существует
+        if info is not None and info.lobby_id not in (None, self.lobby_id):
+            return None
+        return info
+
+    def attributes(self, item):
+        info = self.template(item)
+        return info.attributes if info is not None else (item.get('attributes') or {})
+
+    def category(self, item):
+        info = self.template(item)
+        return info.category if info is not None else item.get('category')
+
+    def unit_volume(self, item):
+        info = self.template(item)
+        if info is None:
+            return _number(item.get('volume'))
+        return _number(info.attributes.get('volume'), info.volume)
+
+    def weight(self, item):
+        info = self.template(item)
+        attrs = self.attributes(item)
+        category = self.category(item)
+        quantity = _number(item.get('quantity'), 1)
+        if category == 'ammo':
+            if not quantity:
+                return 0.0
+            return 0.1 if (self.unit_volume(item) or 0.02) * quantity < 0.5 else 0.25
+        if category == 'magazine':
+            loaded = sum(_number(a.get('quantity'), 0) for a in item.get('ammo') or [] if isinstance(a, dict))
+            field = 'loadedWeight' if loaded > 0 else 'emptyWeight'
+            base = _number(attrs.get(field), _number(item.get(field)))
+        elif info is not None:
+            base = _number(info.attributes.get('weight'), info.weight)
+        else:
+            base = _number(item.get('weight'))
+        return base * quantity
+
+    def volume(self, item):
+        return self.unit_volume(item) * _number(item.get('quantity'), 1)
+
+    def value(self, item):
+        info = self.template(item)
+        price = info.price if info is not None else _number(item.get('price'))
+        return price * _number(item.get('quantity'), 1)
+
+    def warn(self, kind, item, message):
+        if len(self.warnings) < MAX_WARNINGS:
+            self.warnings.append({'type': kind, 'item_id': item.get('id'), 'name': item.get('name'),
+                                  'message': message})
+
+    def check_item(self, item):
+        if _template_id(item) is not None and self.template(item) is None and 'templateId' in item:
+            self.warn('missing_template', item, f"Шаблон {item.get('templateId')} не найден")
+        children = [m for m in item.get('installedModules') or [] if isinstance(m, dict)]
+        magazine = item.get('installedMagazine')
+        if isinstance(magazine, dict):
+            children.append(magazine)
+        for child in children:
+            self.check_pair(item, child)
+
+    def check_pair(self, parent, child):
+        """Модуль или магазин, установленный в предмет."""
+        parent_info = self.template(parent)
+        parent_key, child_key = _template_id(parent), _template_id(child)
+        if parent_info is not None and child_key is not None and parent_info.compatible_ids \
+                and child_key not in parent_info.compatible_ids:
+            self.warn('incompatible', child, f"{child.get('name')} не подходит к {parent.get('name')}")
+            return
+        child_attrs = self.attributes(child)
+        allowed = child_attrs.get('compatible_weapons')
+        if allowed and parent_key is not None and parent_key not in allowed:
+            self.warn('incompatible', child, f"{child.get('name')} не подходит к {parent.get('name')}")
+            return
+        parent_caliber = self.attributes(parent).get('caliber')
+        child_caliber = child_attrs.get('caliber') or child.get('caliber')
+        if parent_caliber and child_caliber and parent_caliber != child_caliber:
+            self.warn('caliber_mismatch', child,
+                      f"Калибр {child.get('name')} ({child_caliber}) не совпадает с {parent.get('name')} ({parent_caliber})")
+
+    def check_equipment(self, equipment):
+        if not isinstance(equipment, dict):
+            return
+        helmet = equipment.get('helmet')
+        has_visor = isinstance(helmet, dict) and any(
+            isinstance(m, dict) and m.get('slotType') == 'visor' for m in helmet.get('installedModules') or [])
+        for slot, item in equipment.items():
+            if not isinstance(item, dict):
+                continue
+            attrs = self.attributes(item)
+            if attrs.get('incompatible_with_gasmask') and equipment.get('gasMask') and slot != 'gasMask':
+                self.warn('equipment_conflict', item, f"{item.get('name')} нельзя носить с противогазом")
+            if attrs.get('incompatible_with_visor') and has_visor:
+                self.warn('equipment_conflict', item, f"{item.get('name')} нельзя носить со шлемом с забралом")
+
+
+def compute_stats(data, templates, lobby_id=None):
+    """Характеристики листа по уже загруженным шаблонам ({ключ: TemplateInfo})."""
+    calc = _Calculator(templates, lobby_id)
+    sections = {}
+    totals = {'weight': 0.0, 'volume': 0.0, 'value': 0}
+    items = 0
+    for section, content in (data.items() if isinstance(data, dict) else []):
+        if section == 'equipment' and isinstance(content, dict):
+            calc.check_equipment(content)
+        section_items = _collect_items(content, [])
+        if not section_items:
+            continue
+        installed = {id(m) for i in section_items for m in [i.get('installedMagazine')] if isinstance(m, dict)}
+        part = {'weight': 0.0, 'volume': 0.0, 'value': 0}
+        for item in section_items:
+            calc.check_item(item)
+            if id(item) in installed:
+                continue
+            items += 1
+            part['weight'] += calc.weight(item)
+            part['volume'] += calc.volume(item)
+            part['value'] += calc.value(item)
+        for key in totals:
+            totals[key] += part[key]
+        sections[section] = {k: round(v, 3) for k, v in part.items()}
+    return {
+        'weight': round(totals['weight'], 3),
+        'volume': round(totals['volume'], 3),
+        'value': round(totals['value'], 3),
+        'items': items,
+        'sections': sections,
+        'warnings': calc.warnings
+    }
+
+
+def template_keys(data):
+    return {key for item in _collect_items(data, []) for key in [_template_id(item)] if key is not None}
+
+
+class DerivedStatsCache:
+    def __init__(self, max_entries=MAX_CACHED):
+        self.max_entries = max_entries
+        self._entries = {}        # character_id -> (version, stats, ключи шаблонов)
+        self._by_template = {}    # ключ шаблона -> {character_id}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, character):
+        """Характеристики персонажа (character — строка LobbyCharacter с актуальной version)."""
+        with self._lock:
+            entry = self._entries.get(character.id)
+            if entry is not None and entry[0] == character.version:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+
+        data = character.data or {}
+        keys = template_keys(data)
+        stats = compute_stats(data, template_cache.resolve(keys), character.lobby_id)
+        stats = dict(stats, character_id=character.id, version=character.version)
+
+        with self._lock:
+            # Шаблон изменился, пока считали, — результат не кэшируем
+            if self._generation == generation:
+                self._forget(character.id)
+                if len(self._entries) >= self.max_entries:
+                    self._forget(next(iter(self._entries)))
+                self._entries[character.id] = (character.version, stats, keys)
+                for key in keys:
+                    self._by_template.setdefault(key, set()).add(character.id)
+        return stats
+
+    def invalidate_template(self, key):
+        with self._lock:
+            self._generation += 1
+            for character_id in self._by_template.pop(key, ()):
+                self._forget(character_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'size': len(self._entries)
+        }
+
+    def _forget(self, character_id):
+        entry = self._entries.pop(character_id, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            ids = self._by_template.get(key)
+            if ids is not None:
+                ids.discard(character_id)
+                if not ids:
+                    del self._by_template[key]
+
+
+derived_stats = DerivedStatsCache()
+on_template_change(derived_stats.invalidate_template)
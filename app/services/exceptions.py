@@ -15,4 +15,7 @@ class NotFoundError(ServiceError):
 
 class PermissionDenied(ServiceError):
     def __init__(self, message, code=403):
-        super().__init__(message, code)
\ No newline at end of file
+        super().__init__(message, code)
+class ConflictError(ServiceError):
+    def __init__(self, message, code=409):
+        super().__init__(message, code)
@@ -5,6 +5,7 @@ import string
 from app.extensions import db
 from app.models import Lobby, LobbyParticipant, MapChunk
 from app.constants import MAX_CHUNKS_WIDTH, MAX_CHUNKS_HEIGHT
+from app.services.access import access_cache, get_lobby_access
 from app.services.exceptions import ValidationError, NotFoundError, PermissionDenied
 
 logger = logging.getLogger(__name__)
@@ -93,15 +94,14 @@ class LobbyService:
     @staticmethod
     def get_lobby(lobby_id, user_id):
         """Получение информации о комнмате (с проверкой участия)."""
-        lobby = Lobby.query.get(lobby_id)
-        if not lobby or not lobby.is_active:
+        access = get_lobby_access(lobby_id)
+        if not access:
             raise NotFoundError("Lobby not found")
 
-        participant = LobbyParticipant.query.filter_by(lobby_id=lobby_id, user_id=user_id).first()
-        if not participant:
+        if not access.participant(user_id):
             raise PermissionDenied("You are not in this lobby")
 
-        return lobby
+        return Lobby.query.get(lobby_id)
 
     @staticmethod
     def delete_lobby(lobby_id, gm_id):
@@ -115,6 +115,7 @@ class LobbyService:
 
         lobby.is_active = False
         db.session.commit()
+        access_cache.invalidate(lobby_id)
         logger.info(f"Lobby {lobby_id} deactivated by GM {gm_id}")
 
     @staticmethod
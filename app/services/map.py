@@ -3,7 +3,8 @@ import logging
 import copy
 import random
 from app.extensions import db
-from app.models import MapChunk, Lobby, LobbyParticipant
+from app.models import MapChunk, Lobby
+from app.services.access import get_lobby_access
 from app.constants import CHUNK_SIZE, MAX_CHUNKS_WIDTH, MAX_CHUNKS_HEIGHT, ANOMALY_TYPES
 from app.services.exceptions import NotFoundError, PermissionDenied, ValidationError
 
@@ -16,10 +17,8 @@ class MapService:
         Возвращает чанки в заданных границах.
         bounds: (min_x, max_x, min_y, max_y)
         """
-        participant = LobbyParticipant.query.filter_by(
-            lobby_id=lobby_id, user_id=user_id
-        ).first()
-        if not participant:
+        access = get_lobby_access(lobby_id)
+        if not access or not access.participant(user_id):
             raise PermissionDenied("Not in lobby")
 
         lobby = Lobby.query.get(lobby_id)
@@ -1,7 +1,9 @@
 # app/services/participant.py
 import logging
 from app.extensions import db
-from app.models import Lobby, LobbyParticipant
+from app.models import Lobby, LobbyParticipant, User
+from app.services.access import access_cache, get_lobby_access
+from app.services.character import CharacterService
 from app.services.exceptions import NotFoundError, PermissionDenied, ValidationError
 
 logger = logging.getLogger(__name__)
@@ -32,6 +34,7 @@ class ParticipantService:
         participant = LobbyParticipant(lobby_id=lobby_id, user_id=user_id)
         db.session.add(participant)
         db.session.commit()
+        access_cache.invalidate(lobby_id)
         logger.info(f"User {user_id} joined lobby {lobby_id}")
         return participant
 
@@ -50,6 +53,7 @@ class ParticipantService:
 
         db.session.delete(participant)
         db.session.commit()
+        access_cache.invalidate(lobby_id)
         logger.info(f"User {user_id} left lobby {lobby_id}")
 
     @staticmethod
@@ -73,6 +77,7 @@ class ParticipantService:
 
         participant.is_banned = True
         db.session.commit()
+        access_cache.invalidate(lobby_id)
         logger.warning(f"User {target_user_id} banned from lobby {lobby_id} by GM {gm_id}")
 
         # Импортируем функцию кика из сокетов
@@ -102,6 +107,7 @@ class ParticipantService:
 
         participant.is_banned = False
         db.session.commit()
+        access_cache.invalidate(lobby_id)
         logger.info(f"User {target_user_id} unbanned from lobby {lobby_id} by GM {gm_id}")
 
     @staticmethod
@@ -118,4 +124,39 @@ class ParticipantService:
             lobby_id=lobby_id, is_banned=True
         ).all()
         logger.debug(f"Banned list requested for lobby {lobby_id} by GM {gm_id}, count={len(banned)}")
-        return [{'user_id': p.user_id, 'username': p.user.username} for p in banned]
\ No newline at end of file
+        return [{'user_id': p.user_id, 'username': p.user.username} for p in banned]
+
+    @staticmethod
+    def get_roster(lobby_id, user_id):
+        """
+        Участники комнаты (кроме забаненных) с их персонажами, видимыми user_id.
+        Два запроса при любом размере комнаты: участники с именами и персонажи.
+        """
+        lobby = get_lobby_access(lobby_id)
+        if not lobby or not lobby.participant(user_id):
+            raise PermissionDenied("You are not in this lobby")
+
+        rows = (db.session.query(LobbyParticipant.user_id, User.username)
+                .join(User, User.id == LobbyParticipant.user_id)
+                .filter(LobbyParticipant.lobby_id == lobby_id,
+                        LobbyParticipant.is_banned.isnot(True))
+                .order_by(LobbyParticipant.joined_at)
+                .all())
+
+        by_owner = {}
+        for c in CharacterService.get_lobby_characters(lobby_id, user_id):
+            by_owner.setdefault(c.owner_id, []).append({'id': c.id, 'name': c.name, 'data': c.data})
+
+        roster = []
+        for participant_id, username in rows:
+            characters = by_owner.get(participant_id, [])
+            roster.append({
+                'user_id': participant_id,
+                'username': username,
+                'is_gm': participant_id == lobby.gm_id,
+                'characters': characters,
+                # Первый персонаж — для клиентов, ждущих одного персонажа на участника
+                'character': characters[0] if characters else None
+            })
+        logger.debug(f"Roster of lobby {lobby_id} for user {user_id}: {len(roster)} participants")
+        return roster
@@ -0,0 +1,188 @@
+# app/services/template_search.py
+"""
+Поиск по шаблонам предметов: глобальные и локальные шаблоны комнаты одним списком.
+
+Фильтры (все необязательные):
+- q + match: название начинается с q (prefix, по умолчанию) или содержит q
+  (substring), без учёта регистра;
+- category, subcategory — точное совпадение;
+- min_/max_ price, weight, volume — диапазоны;
+- attrs: {имя: значение} — равенство значения в attributes (по текстовому
+  представлению, так совпадают и строки, и числа; true/false — как логические),
+  {имя: (min, max)} — числовой диапазон.
+
+Сортировка по name, price, weight или volume (asc/desc), при равенстве — по
+ключу шаблона (LOCAL_TEMPLATE_OFFSET, как в листах). Пагинация курсором по
+(значение сортировки, ключ): страница не зависит от глубины и не плывёт,
+если между запросами шаблоны добавляются.
+
+Фильтры применяются к каждой таблице до UNION ALL, чтобы работали индексы
+(lower(name), category/subcategory, price, weight, volume; у локальных — с lobby_id).
+"""
+
+import base64
+import json
+import logging
+from sqlalchemy import select, union_all, literal, func, or_, and_, cast, String
+from app.extensions import db
+from app.models.templates import ItemTemplate
+from app.models.lobby_templates import LobbyItemTemplate
+from app.services.exceptions import ValidationError
+from app.services.templates import LOCAL_TEMPLATE_OFFSET
+
+logger = logging.getLogger(__name__)
+
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+SORT_FIELDS = ('name', 'price', 'weight', 'volume')
+RANGE_FIELDS = ('price', 'weight', 'volume')
+MAX_ATTRIBUTE_FILTERS = 10
+
+_RESULT_FIELDS = ('name', 'category', 'subcategory', 'item_class', 'description',
+                  'price', 'weight', 'volume', 'attributes', 'compatible_ids')
+
+
+def _escape_like(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _attribute_value(raw):
+    """Значение фильтра по attributes из строки запроса: логическое или строка."""
+    if raw in ('true', 'false'):
+        return raw == 'true'
+    return raw
+
+
+class TemplateSearchService:
+    @staticmethod
+    def search(lobby_id, q=None, match='prefix', category=None, subcategory=None,
+               ranges=None, attrs=None, sort='name', order='asc', cursor=None, limit=SEARCH_LIMIT):
+        """Страница шаблонов: {'templates': [...], 'next_cursor': str|None}."""
+        if sort not in SORT_FIELDS:
+            raise ValidationError(f"sort must be one of: {', '.join(SORT_FIELDS)}")
+        if order not in ('asc', 'desc'):
+            raise ValidationError("order must be asc or desc")
+        if match not in ('prefix', 'substring'):
+            raise ValidationError("match must be prefix or substring")
+        if not isinstance(limit, int) or limit <= 0 or limit > MAX_SEARCH_LIMIT:
+            raise ValidationError(f"limit must be between 1 and {MAX_SEARCH_LIMIT}")
+        if attrs and len(attrs) > MAX_ATTRIBUTE_FILTERS:
+            raise ValidationError(f"At most {MAX_ATTRIBUTE_FILTERS} attribute filters are allowed")
+
+        def filtered(model, key, source, *where):
+            columns = [key.label('key'), model.id.label('id'), literal(source).label('source')] + \
+                      [getattr(model, f).label(f) for f in _RESULT_FIELDS]
+            stmt = select(*columns).where(*where)
+            if q:
+                pattern = _escape_like(q.lower())
+                pattern = f"{pattern}%" if match == 'prefix' else f"%{pattern}%"
+                stmt = stmt.where(func.lower(model.name).like(pattern, escape='\\'))
+            if category:
+                stmt = stmt.where(model.category == category)
+            if subcategory:
+                stmt = stmt.where(model.subcategory == subcategory)
+            for field, (low, high) in (ranges or {}).items():
+                column = getattr(model, field)
+                if low is not None:
+                    stmt = stmt.where(column >= low)
+                if high is not None:
+                    stmt = stmt.where(column <= high)
+            for name, value in (attrs or {}).items():
+                stmt = stmt.where(*TemplateSearchService._attribute_clauses(model.attributes[name], value))
+            return stmt
+
+        merged = union_all(
+            filtered(ItemTemplate, ItemTemplate.id, 'global'),
+            filtered(LobbyItemTemplate, LobbyItemTemplate.id + LOCAL_TEMPLATE_OFFSET, 'local',
+                     LobbyItemTemplate.lobby_id == lobby_id)
+        ).subquery()
+
+        sort_column = func.lower(merged.c.name) if sort == 'name' else func.coalesce(merged.c[sort], 0)
+        descending = order == 'desc'
+        query = select(merged)
+        if cursor is not None:
+            after_value, after_key = TemplateSearchService._decode_cursor(cursor, sort)
+            if descending:
+                query = query.where(or_(sort_column < after_value,
+                                        and_(sort_column == after_value, merged.c.key < after_key)))
+            else:
+                query = query.where(or_(sort_column > after_value,
+                                        and_(sort_column == after_value, merged.c.key > after_key)))
+        if descending:
+            query = query.order_by(sort_column.desc(), merged.c.key.desc())
+        else:
+            query = query.order_by(sort_column, merged.c.key)
+
+        rows = db.session.execute(query.limit(limit + 1)).mappings().all()
+        page = [dict(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            value = last['name'].lower() if sort == 'name' else (last[sort] or 0)
+            next_cursor = TemplateSearchService._encode_cursor(value, last['key'])
+        logger.debug(f"Template search in lobby {lobby_id}: q={q!r} sort={sort} -> {len(page)} rows")
+        return {'templates': page, 'next_cursor': next_cursor}
+
+    @staticmethod
+    def _attribute_clauses(element, value):
+        if isinstance(value, tuple):
+            low, high = value
+            clauses = []
+            if low is not None:
+                clauses.append(element.as_float() >= low)
+            if high is not None:
+                clauses.append(element.as_float() <= high)
+            return clauses
+        if isinstance(value, bool):
+            return [element.as_boolean() == value]
+        # SQLite отдаёт числа из JSON числами: приводим к тексту, чтобы '30' совпало с 30
+        return [cast(element.as_string(), String) == str(value)]
+
+    @staticmethod
+    def _encode_cursor(value, key):
+        raw = json.dumps([value, key], ensure_ascii=False).encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decode_cursor(cursor, sort):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            value, key = json.loads(raw)
+        except (ValueError, TypeError):
+            raise ValidationError("Invalid cursor")
+        expected = str if sort == 'name' else (int, float)
+        if not isinstance(key, int) or isinstance(value, bool) or not isinstance(value, expected):
+            raise ValidationError("Invalid cursor")
+        return value, key
+
+    @staticmethod
+    def parse_args(args):
+        """Диапазоны и фильтры по attributes из строки запроса (attr.<имя>, attr.<имя>.min/.max)."""
+        ranges = {}
+        for field in RANGE_FIELDS:
+            bounds = []
+            for prefix in ('min_', 'max_'):
+                raw = args.get(prefix + field)
+                try:
+                    bounds.append(float(raw) if raw not in (None, '') else None)
+                except ValueError:
+                    raise ValidationError(f"{prefix}{field} must be a number")
+            if bounds != [None, None]:
+                ranges[field] = tuple(bounds)
+
+        attrs = {}
+        for arg, raw in args.items():
+            if not arg.startswith('attr.'):
+                continue
+            name = arg[len('attr.'):]
+            if name.endswith('.min') or name.endswith('.max'):
+                name, bound = name[:-4], name[-3:]
+                try:
+                    number = float(raw)
+                except ValueError:
+                    raise ValidationError(f"{arg} must be a number")
+                low, high = attrs.get(name) if isinstance(attrs.get(name), tuple) else (None, None)
+                attrs[name] = (number, high) if bound == 'min' else (low, number)
+            elif name:
+                attrs[name] = _attribute_value(raw)
+        return ranges, attrs
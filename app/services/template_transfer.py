@@ -0,0 +1,261 @@
+# app/services/template_transfer.py
+"""
+Массовый импорт и экспорт шаблонов предметов в NDJSON и CSV.
+
+Каталог — глобальные шаблоны (lobby_id=None, ItemTemplate) или локальные
+шаблоны комнаты (LobbyItemTemplate).
+
+Экспорт — генератор строк: шаблоны читаются пачками по id, ответ отдаётся
+потоком и не собирается в памяти целиком. В CSV attributes и compatible_ids
+записаны как JSON.
+
+Импорт читает строки по одной и обрабатывает пачками по IMPORT_BATCH_SIZE:
+- каждая строка проверяется схемой ItemTemplateSchema, ошибки попадают в
+  отчёт с номером строки и не останавливают импорт;
+- шаблон ищется по (name, category): один запрос на пачку;
+- новые шаблоны добавляются одним bulk INSERT, существующие обновляются
+  одним bulk UPDATE по первичному ключу (mode='insert' — не трогать
+  существующие, а отметить их в отчёте). Строка заменяет шаблон целиком:
+  незаданные поля получают значения по умолчанию схемы. Повтор (name,
+  category) в одной пачке тоже в отчёте: при upsert — вытесненная строка,
+  при insert — повтор;
+- каждая пачка — своя транзакция.
+После импорта кэши шаблонов и каталог сбрасываются одним сообщением.
+"""
+
+import csv
+import io
+import json
+import logging
+from marshmallow import ValidationError as MarshmallowValidationError
+from sqlalchemy import insert, update, tuple_
+from app.extensions import db
+from app.models.templates import ItemTemplate
+from app.models.lobby_templates import LobbyItemTemplate
+from app.schemas.templates import ItemTemplateSchema
+from app.services.exceptions import ValidationError
+from app.services.templates import LOCAL_TEMPLATE_OFFSET, invalidate_templates
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'csv')
+MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+IMPORT_BATCH_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000   # ошибок в отчёте; сверх — только счётчик
+
+FIELDS = ('name', 'category', 'subcategory', 'item_class', 'description',
+          'price', 'weight', 'volume', 'attributes', 'compatible_ids')
+JSON_FIELDS = ('attributes', 'compatible_ids')
+# Поля экспорта, которые при импорте пропускаются
+IGNORED_FIELDS = ('id', 'lobby_id', 'created_by', 'created_at', 'updated_at')
+
+
+def _model(lobby_id):
+    return ItemTemplate if lobby_id is None else LobbyItemTemplate
+
+
+def _key(template_id, lobby_id):
+    return template_id if lobby_id is None else template_id + LOCAL_TEMPLATE_OFFSET
+
+
+class _Report:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+        self.keys = []
+
+    def error(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors)
+        }
+
+
+class TemplateTransferService:
+    @staticmethod
+    def export(lobby_id=None, fmt='ndjson'):
+        """Генератор строк выгрузки каталога (глобального или комнаты)."""
+        if fmt not in FORMATS:
+            raise ValidationError(f"format must be one of: {', '.join(FORMATS)}")
+        return TemplateTransferService._export_lines(lobby_id, fmt)
+
+    @staticmethod
+    def _export_lines(lobby_id, fmt):
+        model = _model(lobby_id)
+        columns = [model.id] + [getattr(model, f) for f in FIELDS]
+        if fmt == 'csv':
+            yield TemplateTransferService._csv_line(('id',) + FIELDS)
+        last_id = 0
+        while True:
+            query = db.session.query(*columns).filter(model.id > last_id)
+            if lobby_id is not None:
+                query = query.filter(model.lobby_id == lobby_id)
+            rows = query.order_by(model.id).limit(EXPORT_BATCH_SIZE).all()
+            if not rows:
+                return
+            for row in rows:
+                if fmt == 'csv':
+                    yield TemplateTransferService._csv_line(
+                        [row.id] + [json.dumps(getattr(row, f), ensure_ascii=False) if f in JSON_FIELDS
+                                    else getattr(row, f) for f in FIELDS])
+                else:
+                    yield json.dumps(row._asdict(), ensure_ascii=False, separators=(',', ':')) + '\n'
+            last_id = rows[-1].id
+
+    @staticmethod
+    def _csv_line(values):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(['' if v is None else v for v in values])
+        return buffer.getvalue()
+
+    @staticmethod
+    def import_lines(lines, fmt='ndjson', lobby_id=None, user_id=None, mode='upsert'):
+        """
+        Импорт из итератора строк текста. Возвращает отчёт:
+        {'created', 'updated', 'failed', 'errors': [{'line', 'errors'}], 'errors_truncated'}.
+        """
+        if fmt not in FORMATS:
+            raise ValidationError(f"format must be one of: {', '.join(FORMATS)}")
+        if mode not in ('upsert', 'insert'):
+            raise ValidationError("mode must be upsert or insert")
+        if lobby_id is not None and user_id is None:
+            raise ValidationError("user_id is required for lobby templates")
+
+        report = _Report()
+        schema = ItemTemplateSchema()
+        batch = []
+        try:
+            for line, raw in TemplateTransferService._parse(lines, fmt, report):
+                try:
+                    batch.append((line, TemplateTransferService._validate(schema, raw)))
+                except MarshmallowValidationError as e:
+                    report.error(line, e.messages)
+                if len(batch) >= IMPORT_BATCH_SIZE:
+                    TemplateTransferService._write_batch(batch, lobby_id, user_id, mode, report)
+                    batch = []
+            if batch:
+                TemplateTransferService._write_batch(batch, lobby_id, user_id, mode, report)
+        finally:
+            # Записанные пачки уже в БД, даже если вход оборвался на середине
+            if report.keys:
+                invalidate_templates(report.keys, lobby_id)
+        scope = 'global' if lobby_id is None else f'lobby {lobby_id}'
+        logger.info(f"Template import ({scope}, {fmt}): {report.created} created, "
+                    f"{report.updated} updated, {report.failed} failed")
+        return report.as_dict()
+
+    @staticmethod
+    def _parse(lines, fmt, report):
+        """(номер строки, словарь) по входу; нечитаемые строки сразу уходят в отчёт."""
+        if fmt == 'csv':
+            reader = csv.DictReader(lines)
+            for record in reader:
+                if None in record:
+                    report.error(reader.line_num, {'_row': ['Too many values']})
+                    continue
+                # Пустая ячейка — значение по умолчанию
+                raw = {k: v for k, v in record.items() if v not in (None, '')}
+                try:
+                    for field in JSON_FIELDS:
+                        if field in raw:
+                            raw[field] = json.loads(raw[field])
+                except ValueError:
+                    report.error(reader.line_num, {field: ['Invalid JSON']})
+                    continue
+                yield reader.line_num, raw
+            return
+        for line, text in enumerate(lines, start=1):
+            if not text.strip():
+                continue
+            try:
+                raw = json.loads(text)
+            except ValueError:
+                report.error(line, {'_row': ['Invalid JSON']})
+                continue
+            if not isinstance(raw, dict):
+                report.error(line, {'_row': ['Expected a JSON object']})
+                continue
+            yield line, raw
+
+    @staticmethod
+    def _validate(schema, raw):
+        data = schema.load({k: v for k, v in raw.items() if k not in IGNORED_FIELDS})
+        errors = {}
+        for field, value in data.items():
+            length = getattr(ItemTemplate.__table__.c[field].type, 'length', None)
+            if length and isinstance(value, str) and len(value) > length:
+                errors[field] = [f'Longer than maximum length {length}.']
+        if not data['name'].strip():
+            errors['name'] = ['Field may not be blank.']
+        if errors:
+            raise MarshmallowValidationError(errors)
+        return data
+
+    @staticmethod
+    def _write_batch(batch, lobby_id, user_id, mode, report):
+        model = _model(lobby_id)
+        # Повтор (name, category) внутри пачки: при upsert действует последняя строка,
+        # при insert — первая; вытесненная строка попадает в отчёт
+        rows = {}
+        for line, data in batch:
+            key = (data['name'], data['category'])
+            if key not in rows:
+                rows[key] = (line, data)
+            elif mode == 'insert':
+                report.error(line, {'_row': [f"Duplicate of line {rows[key][0]}: "
+                                             f"template '{key[0]}' ({key[1]}) already in the import"]})
+            else:
+                report.error(rows[key][0], {'_row': [f"Overwritten by line {line}: "
+                                                     f"template '{key[0]}' ({key[1]}) repeats in the import"]})
+                rows[key] = (line, data)
+
+        query = db.session.query(model.id, model.name, model.category) \
+            .filter(tuple_(model.name, model.category).in_(list(rows)))
+        if lobby_id is not None:
+            query = query.filter(model.lobby_id == lobby_id)
+        existing = {}
+        for row in query.order_by(model.id):
+            existing.setdefault((row.name, row.category), row.id)
+
+        inserts, updates = [], []
+        for key, (line, data) in rows.items():
+            if key not in existing:
+                extra = {} if lobby_id is None else {'lobby_id': lobby_id, 'created_by': user_id}
+                inserts.append(dict(data, **extra))
+            elif mode == 'insert':
+                report.error(line, {'_row': [f"Template '{key[0]}' ({key[1]}) already exists"]})
+            else:
+                updates.append(dict(data, id=existing[key]))
+
+        try:
+            if inserts:
+                created = db.session.execute(insert(model).returning(model.id), inserts).scalars().all()
+            else:
+                created = []
+            if updates:
+                db.session.execute(update(model), updates)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Template import batch failed ({len(inserts)} inserts, {len(updates)} updates)")
+            for key, (line, data) in rows.items():
+                if key not in existing or mode == 'upsert':
+                    report.error(line, {'_row': ['Database error, batch was not saved']})
+            return
+
+        report.created += len(created)
+        report.updated += len(updates)
+        report.keys.extend(_key(template_id, lobby_id) for template_id in created)
+        report.keys.extend(_key(row['id'], lobby_id) for row in updates)
+
@@ -0,0 +1,298 @@
+# app/services/templates.py
+"""
+Кэши шаблонов предметов.
+
+TemplateCache — шаблоны по ключу для серверных вычислений по листам персонажей.
+
+Предмет в листе ссылается на шаблон по templateId: глобальный шаблон — его id,
+локальный шаблон комнаты — id + LOCAL_TEMPLATE_OFFSET (та же схема, что на
+клиенте, см. loadTemplatesForLobby в characterSheet.js).
+
+resolve() отдаёт шаблоны пачкой: недостающие в кэше читаются двумя запросами
+(IN по глобальным и по локальным id), отсутствующие тоже запоминаются.
+Записи живут до инвалидации (маршруты изменения шаблонов), инвалидация
+рассылается остальным воркерам через pubsub.
+
+TemplateCatalog — сериализованный каталог для GET /lobbies/<id>/templates:
+глобальные шаблоны (меняются редко, один снимок на процесс) и локальные
+шаблоны каждой комнаты, оба с индексом по категории и подкатегории.
+Глобальный каталог меняют и вне веб-процессов (flask templates import), а
+без брокера их инвалидация до воркеров не доходит: снимок не чаще чем раз в
+CATALOG_CHECK_INTERVAL сверяется с БД по (count, max(id), max(created_at),
+max(updated_at)) и при расхождении собирается заново.
+У каждого снимка есть хэш содержимого, из них собирается ETag ответа.
+Маршруты изменения шаблонов вызывают invalidate_template(), массовый импорт —
+invalidate_templates().
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from sqlalchemy import func
+from app.backends.pubsub import pubsub
+from app.extensions import db
+from app.models.templates import ItemTemplate
+from app.models.lobby_templates import LobbyItemTemplate
+from app.schemas.templates import ItemTemplateSchema
+from app.schemas.lobby_templates import LobbyItemTemplateSchema
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TEMPLATE_OFFSET = 1_000_000
+CATALOG_CHECK_INTERVAL = 5.0   # сек между сверками глобального снимка с БД
+
+TemplateInfo = namedtuple('TemplateInfo', [
+    'key', 'lobby_id', 'name', 'category', 'price', 'weight', 'volume', 'attributes', 'compatible_ids'
+])
+
+_COLUMNS = ('id', 'name', 'category', 'price', 'weight', 'volume', 'attributes', 'compatible_ids')
+
+
+def template_key(template):
+    """Ключ шаблона в листах персонажей."""
+    if isinstance(template, LobbyItemTemplate):
+        return template.id + LOCAL_TEMPLATE_OFFSET
+    return template.id
+
+
+def _info(row, key, lobby_id):
+    return TemplateInfo(key, lobby_id, row.name, row.category, row.price or 0, row.weight or 0.0,
+                        row.volume or 0.0, row.attributes or {}, row.compatible_ids or [])
+
+
+class TemplateCache:
+    def __init__(self):
+        self._entries = {}        # ключ -> TemplateInfo или None (шаблона нет)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def resolve(self, keys):
+        """Шаблоны по ключам: {ключ: TemplateInfo}; несуществующих ключей в ответе нет."""
+        found, missing = {}, []
+        with self._lock:
+            generation = self._generation
+            for key in keys:
+                if key in self._entries:
+                    self.hits += 1
+                    if self._entries[key] is not None:
+                        found[key] = self._entries[key]
+                else:
+                    missing.append(key)
+            self.misses += len(missing)
+        if not missing:
+            return found
+
+        loaded = dict.fromkeys(missing)
+        global_ids = [k for k in missing if 0 < k < LOCAL_TEMPLATE_OFFSET]
+        local_ids = [k - LOCAL_TEMPLATE_OFFSET for k in missing if k > LOCAL_TEMPLATE_OFFSET]
+        if global_ids:
+            for row in db.session.query(*(getattr(ItemTemplate, c) for c in _COLUMNS)) \
+                    .filter(ItemTemplate.id.in_(global_ids)):
+                loaded[row.id] = _info(row, row.id, None)
+        if local_ids:
+            for row in db.session.query(LobbyItemTemplate.lobby_id,
+                                        *(getattr(LobbyItemTemplate, c) for c in _COLUMNS)) \
+                    .filter(LobbyItemTemplate.id.in_(local_ids)):
+                key = row.id + LOCAL_TEMPLATE_OFFSET
+                loaded[key] = _info(row, key, row.lobby_id)
+
+        with self._lock:
+            # Если пока читали БД шаблоны менялись, не кладём возможно устаревшие записи
+            if self._generation == generation:
+                self._entries.update(loaded)
+        found.update((k, v) for k, v in loaded.items() if v is not None)
+        return found
+
+    def invalidate(self, key, broadcast=True):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generation += 1
+            self.invalidations += 1
+        for callback in _listeners:
+            callback(key)
+        logger.debug(f"Template cache invalidated for {key}")
+        if broadcast:
+            pubsub.publish('templates.invalidate', key)
+
+    def invalidate_many(self, keys, broadcast=True):
+        """Пачка ключей (массовый импорт): одно сообщение в pubsub вместо сообщения на шаблон."""
+        keys = list(keys)
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+            self._generation += 1
+            self.invalidations += len(keys)
+        for key in keys:
+            for callback in _listeners:
+                callback(key)
+        logger.debug(f"Template cache invalidated for {len(keys)} templates")
+        if broadcast and keys:
+            pubsub.publish('templates.invalidate_many', keys)
+
+    def global_keys(self):
+        """Ключи глобальных шаблонов, которые сейчас в кэше."""
+        with self._lock:
+            return [key for key in self._entries if key < LOCAL_TEMPLATE_OFFSET]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'size': len(self._entries)
+        }
+
+
+_listeners = []
+
+
+def on_template_change(callback):
+    """callback(ключ) после инвалидации шаблона (в том числе пришедшей с другого воркера)."""
+    _listeners.append(callback)
+
+
+class CatalogSnapshot:
+    """Сериализованные шаблоны с индексом (категория, подкатегория) и хэшем содержимого."""
+    __slots__ = ('items', 'by_category', 'by_subcategory', 'digest', 'stamp')
+
+    def __init__(self, items, stamp=None):
+        self.items = items
+        self.stamp = stamp
+        self.by_category = {}
+        self.by_subcategory = {}
+        for item in items:
+            self.by_category.setdefault(item['category'], []).append(item)
+            self.by_subcategory.setdefault((item['category'], item.get('subcategory')), []).append(item)
+        raw = json.dumps(items, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        self.digest = hashlib.sha1(raw).hexdigest()[:16]
+
+    def select(self, category=None, subcategory=None):
+        if category and subcategory:
+            return self.by_subcategory.get((category, subcategory), [])
+        if category:
+            return self.by_category.get(category, [])
+        if subcategory:
+            return [item for item in self.items if item.get('subcategory') == subcategory]
+        return self.items
+
+
+class TemplateCatalog:
+    def __init__(self):
+        self._global = None
+        self._lobbies = {}        # lobby_id -> CatalogSnapshot
+        self._generations = {}    # None (глобальный) / lobby_id -> счётчик инвалидаций
+        self._lock = threading.Lock()
+        self._checked_at = 0.0    # когда глобальный снимок последний раз сверяли с БД
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def global_snapshot(self):
+        snapshot = self._global
+        if snapshot is not None:
+            now = time.monotonic()
+            if now - self._checked_at < CATALOG_CHECK_INTERVAL:
+                self.hits += 1
+                return snapshot
+            self._checked_at = now
+            if _global_stamp() == snapshot.stamp:
+                self.hits += 1
+                return snapshot
+            self.stale += 1
+            logger.info("Global template catalog changed outside this process, rebuilding")
+            self.invalidate(None, broadcast=False)
+            # Те же изменения не дошли и до кэша шаблонов по ключу
+            template_cache.invalidate_many(template_cache.global_keys(), broadcast=False)
+        return self._build(None)
+
+    def lobby_snapshot(self, lobby_id):
+        snapshot = self._lobbies.get(lobby_id)
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+        return self._build(lobby_id)
+
+    def view(self, lobby_id, category=None, subcategory=None):
+        """(etag, глобальные, локальные) — ответ каталога комнаты с фильтром."""
+        global_snapshot, lobby_snapshot = self.global_snapshot(), self.lobby_snapshot(lobby_id)
+        parts = (global_snapshot.digest, lobby_snapshot.digest, category or '', subcategory or '')
+        etag = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:24]
+        return (etag, global_snapshot.select(category, subcategory),
+                lobby_snapshot.select(category, subcategory))
+
+    def invalidate(self, lobby_id=None, broadcast=True):
+        """lobby_id=None — глобальный каталог, иначе локальные шаблоны комнаты."""
+        with self._lock:
+            if lobby_id is None:
+                self._global = None
+            else:
+                self._lobbies.pop(lobby_id, None)
+            self._generations[lobby_id] = self._generations.get(lobby_id, 0) + 1
+        logger.debug(f"Template catalog invalidated ({'global' if lobby_id is None else f'lobby {lobby_id}'})")
+        if broadcast:
+            pubsub.publish('templates.catalog', lobby_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'stale': self.stale,
+            'global': len(self._global.items) if self._global is not None else None,
+            'lobbies': len(self._lobbies)
+        }
+
+    def _build(self, lobby_id):
+        self.misses += 1
+        generation = self._generations.get(lobby_id, 0)
+        if lobby_id is None:
+            # Отметка до чтения: изменение во время чтения даст расхождение при сверке
+            stamp = _global_stamp()
+            self._checked_at = time.monotonic()
+            rows = ItemTemplate.query.order_by(ItemTemplate.id).all()
+            snapshot = CatalogSnapshot(ItemTemplateSchema(many=True).dump(rows), stamp)
+        else:
+            rows = LobbyItemTemplate.query.filter_by(lobby_id=lobby_id).order_by(LobbyItemTemplate.id).all()
+            snapshot = CatalogSnapshot(LobbyItemTemplateSchema(many=True).dump(rows))
+        with self._lock:
+            # Если пока читали БД каталог инвалидировали, отдаём снимок, но не кэшируем
+            if self._generations.get(lobby_id, 0) == generation:
+                if lobby_id is None:
+                    self._global = snapshot
+                else:
+                    self._lobbies[lobby_id] = snapshot
+        return snapshot
+
+
+def _global_stamp():
+    """Отметка состояния глобальных шаблонов: меняется при добавлении, удалении и изменении."""
+    return tuple(db.session.query(func.count(ItemTemplate.id), func.max(ItemTemplate.id),
+                                  func.max(ItemTemplate.created_at), func.max(ItemTemplate.updated_at)).one())
+
+
+def invalidate_template(key, lobby_id=None):
+    """Шаблон создан/изменён/удалён: сбрасывает кэш шаблона и каталог (глобальный или комнаты)."""
+    template_cache.invalidate(key)
+    template_catalog.invalidate(lobby_id)
+
+
+def invalidate_templates(keys, lobby_id=None):
+    """То же для пачки шаблонов одного каталога (массовый импорт)."""
+    template_cache.invalidate_many(keys)
+    template_catalog.invalidate(lobby_id)
+
+
+template_cache = TemplateCache()
+template_catalog = TemplateCatalog()
+pubsub.subscribe('templates.invalidate', lambda key: template_cache.invalidate(key, broadcast=False))
+pubsub.subscribe('templates.invalidate_many', lambda keys: template_cache.invalidate_many(keys, broadcast=False))
+pubsub.subscribe('templates.catalog', lambda lobby_id: template_catalog.invalidate(lobby_id, broadcast=False))
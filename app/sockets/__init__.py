@@ -4,10 +4,16 @@
 
 - auth.py        : подключение, аутентификация, выход
 - chat.py        : отправка сообщений, команды /roll
-- dice.py        : броски навыков персонажа
+- dice.py        : броски навыков персонажа, групповые проверки
 - markers.py     : создание, редактирование, перемещение маркеров на карте
 - character.py   : обновление данных персонажа в реальном времени
 - kick.py        : вспомогательная функция для кика пользователя
+- ingest.py      : приём сообщений чата: seq, мгновенная рассылка, пакетная запись в БД
+- session.py     : сессии сокетов (пользователь привязывается к sid при authenticate)
+- state.py       : состояние карты комнаты в памяти воркера-владельца, перебалансировка
+- metrics.py     : счётчики, гистограммы задержек/запросов/размеров по событиям, выборочный лог payload
+- ratelimit.py   : token bucket на пользователя и событие, слияние событий перетаскивания
+- scheduler.py   : общий планировщик дедлайнов (таймаут аутентификации, периодические проверки)
 - utils.py       : получение пользователя из JWT токена
 """
 
@@ -23,7 +29,3 @@ from . import dice
 from . import markers
 from . import character
 from . import location
-
-@socketio.on('*')
-def catch_all(event, data):
-    print(f"GOT EVENT: {event} with data {data}")
\ No newline at end of file
@@ -1,49 +1,51 @@
 # app/sockets/auth.py
 import logging
-import threading
 from flask import request
 from flask_socketio import join_room, leave_room, emit
 from app.extensions import socketio, db
-from app.models import LobbyParticipant, ChatMessage
-from .utils import get_user_from_token
+from app.models import User
+from app.services.access import get_lobby_access
+from app.services.chat import ChatService, CATCH_UP_LIMIT
+from app.services.exceptions import ValidationError
+from app.backends.sharding import shards
+from .utils import decode_user_token
+from .session import presence
+from .scheduler import scheduler
+from .ingest import chat_ingest
+from .character_edits import character_edits
 
 logger = logging.getLogger(__name__)
 
-sid_to_user = {}
-user_lobby = {}
-pending_auth = {}
 AUTH_TIMEOUT = 10
 
+def timeout_disconnect(sid):
+    logger.warning(f"Client {sid} timed out waiting for authentication")
+    socketio.server.disconnect(sid, namespace='/')
+
 @socketio.on('connect')
 def handle_connect():
     logger.info('Client connected')
+    # Дедлайн аутентификации — запись в куче общего планировщика, а не отдельный поток
+    scheduler.schedule(('auth', request.sid), AUTH_TIMEOUT, timeout_disconnect, request.sid)
 
-    def timeout_disconnect(sid):
-        if sid in pending_auth:
-            logger.warning(f"Client {sid} timed out waiting for authentication")
-            socketio.disconnect(sid)
-            pending_auth.pop(sid, None)
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    # Отменяем дедлайн аутентификации, если он ещё не сработал
+    scheduler.cancel(('auth', request.sid))
 
-    timer = threading.Timer(AUTH_TIMEOUT, timeout_disconnect, args=[request.sid])
-    timer.daemon = True
-    timer.start()
-    pending_auth[request.sid] = timer
+    # Несохранённые правки листов, которые редактировал клиент, пишутся в БД
+    character_edits.flush_sid(request.sid)
 
-@socketio.on('disconnect')
-def handle_disconnect():
-    # Отменяем таймер аутентификации, если он ещё не сработал
-    if request.sid in pending_auth:
-        pending_auth[request.sid].cancel()
-        del pending_auth[request.sid]
-
-    user_id = sid_to_user.pop(request.sid, None)
-    if user_id:
-        lobby_id = user_lobby.pop(user_id, None)
-        if lobby_id:
-            emit('user_left', {'user_id': user_id}, room=f"lobby_{lobby_id}")
-            logger.info(f"User {user_id} left lobby {lobby_id}")
+    session, went_offline = presence.unbind(request.sid)
+    if session and went_offline:
+        # user_left – только когда закрыта последняя вкладка пользователя
+        emit_user_left(session.user, session.lobby_id)
     logger.info('Client disconnected')
 
+def emit_user_left(user, lobby_id):
+    socketio.emit('user_left', {'user_id': user.id, 'username': user.username}, room=f"lobby_{lobby_id}")
+    logger.info(f"User {user.id} left lobby {lobby_id}")
+
 @socketio.on('authenticate')
 def handle_authenticate(data):
     token = data.get('token')
@@ -51,19 +53,19 @@ def handle_authenticate(data):
     if not token or not lobby_id:
         return
 
-    # Отменяем таймер аутентификации, если клиент успел прислать данные
-    if request.sid in pending_auth:
-        pending_auth[request.sid].cancel()
-        del pending_auth[request.sid]
+    # Отменяем дедлайн аутентификации, если клиент успел прислать данные
+    scheduler.cancel(('auth', request.sid))
 
-    user = get_user_from_token(token)
+    claims = decode_user_token(token)
+    user = User.query.get(claims['sub']) if claims else None
     if not user:
         logger.warning("Authentication failed: invalid token")
         emit('error', {'message': 'Invalid token'})
         return
 
     # Проверяем, не забанен ли пользователь
-    participant = LobbyParticipant.query.filter_by(lobby_id=lobby_id, user_id=user.id).first()
+    lobby = get_lobby_access(lobby_id)
+    participant = lobby.participant(user.id) if lobby else None
     if not participant:
         logger.warning(f"User {user.id} tried to authenticate in lobby {lobby_id} but is not a participant")
         emit('error', {'message': 'You are not in this lobby'})
@@ -73,9 +75,27 @@ def handle_authenticate(data):
         emit('error', {'message': 'You are banned from this lobby'})
         return
 
-    # Сохраняем информацию о подключении
-    sid_to_user[request.sid] = user.id
-    user_lobby[user.id] = lobby_id
+    lobby_id = lobby.id
+
+    # Комната закреплена за другим воркером: клиент переподключается туда сам,
+    # а если не переподключится — отключаем по таймауту аутентификации
+    url = shards.redirect_url(lobby_id)
+    if url:
+        logger.info(f"Lobby {lobby_id} is served by {url}, redirecting {request.sid}")
+        emit('shard_redirect', {'url': url}, room=request.sid)
+        scheduler.schedule(('auth', request.sid), AUTH_TIMEOUT, timeout_disconnect, request.sid)
+        return
+
+    # Повторная аутентификация того же sid в другой комнате
+    previous = presence.get(request.sid)
+    if previous and previous.lobby_id != lobby_id:
+        _, went_offline = presence.unbind(request.sid)
+        leave_room(f"lobby_{previous.lobby_id}")
+        if went_offline:
+            emit_user_left(previous.user, previous.lobby_id)
+
+    # Сохраняем информацию о подключении; дальше события берут пользователя из сессии
+    _, came_online = presence.bind(request.sid, user, lobby_id, claims.get('exp'))
 
     join_room(f"lobby_{lobby_id}")
     join_room(f"user_{user.id}")  # личная комната для кика
@@ -83,15 +103,22 @@ def handle_authenticate(data):
     emit('authenticated', {'username': user.username}, room=request.sid)
     logger.info(f"User {user.id} ({user.username}) authenticated in lobby {lobby_id}")
 
-    # Оповещаем всех в комнате о новом участнике
-    emit('user_joined', {'user_id': user.id, 'username': user.username}, room=f"lobby_{lobby_id}")
+    # Оповещаем всех в комнате о новом участнике (вторая вкладка – не новый участник)
+    if came_online:
+        emit('user_joined', {'user_id': user.id, 'username': user.username}, room=f"lobby_{lobby_id}")
 
     # Отправляем новому участнику список текущих онлайн-пользователей
-    online_users = [uid for uid, lid in user_lobby.items() if lid == lobby_id]
-    emit('online_users', online_users, room=request.sid)
-
-    # Загружаем историю чата
-    messages = ChatMessage.query.filter_by(lobby_id=lobby_id).order_by(ChatMessage.timestamp.desc()).limit(50).all()
-    messages.reverse()
-    history = [{'username': msg.username, 'message': msg.message, 'timestamp': msg.timestamp.isoformat()} for msg in messages]
-    emit('chat_history', history, room=request.sid)
\ No newline at end of file
+    emit('online_users', presence.online_users(lobby_id), room=request.sid)
+
+    # История чата: после переподключения (since — курсор последнего полученного
+    # сообщения) отправляем только пропущенное, иначе последнюю страницу
+    chat_ingest.flush()
+    since = data.get('since')
+    if since:
+        try:
+            emit('chat_history_page', ChatService.get_history(lobby_id, after=since, limit=CATCH_UP_LIMIT),
+                 room=request.sid)
+            return
+        except ValidationError:
+            logger.debug(f"Invalid chat cursor from {request.sid}, sending latest history")
+    emit('chat_history', ChatService.get_history(lobby_id)['messages'], room=request.sid)
\ No newline at end of file
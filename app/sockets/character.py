@@ -2,8 +2,15 @@ import logging
 from flask import request
 from flask_socketio import emit, join_room, leave_room
 from app.extensions import socketio, db
-from app.models import LobbyCharacter, LobbyParticipant
-from .utils import get_user_from_token
+from app.models import LobbyCharacter
+from app.services.access import get_lobby_access
+from app.services.character import CharacterService
+from app.services.exceptions import ServiceError, NotFoundError, ConflictError
+from .character_edits import character_edits
+from .session import get_session_user
+
+# Поля персонажа, которые можно менять через update_character_data (кроме data)
+EDITABLE_FIELDS = ('name', 'visible_to')
 
 logger = logging.getLogger(__name__)
 
@@ -11,10 +18,10 @@ logger = logging.getLogger(__name__)
 def handle_join_character(data):
     token = data.get('token')
     character_id = data.get('character_id')
-    if not token or not character_id:
+    if not character_id:
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         emit('error', {'message': 'Invalid token'})
         return
@@ -24,10 +31,8 @@ def handle_join_character(data):
         emit('error', {'message': 'Character not found'})
         return
 
-    participant = LobbyParticipant.query.filter_by(
-        lobby_id=character.lobby_id, user_id=user.id
-    ).first()
-    if not participant:
+    lobby = get_lobby_access(character.lobby_id)
+    if not lobby or not lobby.participant(user.id):
         emit('error', {'message': 'You are not in this lobby'})
         return
 
@@ -39,10 +44,10 @@ def handle_join_character(data):
 def handle_leave_character(data):
     token = data.get('token')
     character_id = data.get('character_id')
-    if not token or not character_id:
+    if not character_id:
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         return
 
@@ -55,39 +60,89 @@ def handle_update_character_data(data):
     token = data.get('token')
     character_id = data.get('character_id')
     updates = data.get('updates')
-    if not token or not character_id or updates is None:
+    if not character_id or not isinstance(updates, dict):
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         emit('error', {'message': 'Invalid token'}, room=request.sid)
         return
 
-    character = LobbyCharacter.query.get(character_id)
-    if not character:
-        emit('error', {'message': 'Character not found'}, room=request.sid)
+    try:
+        lobby = get_lobby_access(character_edits.lobby_of(character_id))
+    except NotFoundError as e:
+        emit('error', {'message': str(e)}, room=request.sid)
         return
-
-    participant = LobbyParticipant.query.filter_by(
-        lobby_id=character.lobby_id, user_id=user.id
-    ).first()
-    if not participant:
+    if not lobby or not lobby.participant(user.id):
         emit('error', {'message': 'You are not in this lobby'}, room=request.sid)
         return
 
-    # Применяем обновления
+    payload = {'character_id': character_id, 'updates': updates, 'updated_by': user.id}
     if 'data' in updates:
-        character.data = updates['data']
-    else:
-        for key, value in updates.items():
-            if hasattr(character, key):
-                setattr(character, key, value)
-    db.session.commit()
-
-    emit('character_data_updated', {
-        'character_id': character_id,
-        'updates': updates,
-        'updated_by': user.id
-    }, room=f"character_{character_id}", include_self=False)
-
-    logger.info(f"Character {character_id} updated by {user.id}")
\ No newline at end of file
+        # Лист целиком — через буфер правок: рассылка сразу, запись в БД отложенная
+        try:
+            character_edits.edit(character_id, user.id, request.sid, 'character_data_updated', payload,
+                                 data=updates['data'])
+        except ServiceError as e:
+            emit('error', {'message': str(e)}, room=request.sid)
+            return
+        logger.debug(f"Character {character_id} updated by {user.id} (buffered)")
+        return
+
+    # Прочие поля — только из белого списка и с теми же правами, что через REST
+    # (visible_to меняют владелец и GM); пишутся сразу, поверх сброшенного буфера
+    forbidden = sorted(set(updates) - set(EDITABLE_FIELDS))
+    if forbidden:
+        emit('error', {'message': f"Fields cannot be changed: {', '.join(forbidden)}"}, room=request.sid)
+        return
+    character_edits.flush(character_id)
+    try:
+        character = CharacterService.update_character(character_id, user.id, updates)
+    except ServiceError as e:
+        db.session.rollback()
+        emit('error', {'message': str(e)}, room=request.sid)
+        return
+
+    emit('character_data_updated', dict(payload, version=character.version),
+         room=f"character_{character_id}", include_self=False)
+
+    logger.info(f"Character {character_id} updated by {user.id}")
+
+@socketio.on('patch_character_data')
+def handle_patch_character_data(data):
+    """
+    Частичное изменение листа: {character_id, patch: [операции RFC 6902], version?}.
+    В комнату персонажа уходит только патч с новой версией; отправителю —
+    character_patch_applied с версией. Клиент, у которого версия не совпала
+    с предыдущей, перечитывает лист целиком. Запись в БД — через буфер правок.
+    """
+    token = data.get('token')
+    character_id = data.get('character_id')
+    patch = data.get('patch')
+    if not character_id or not isinstance(patch, list):
+        return
+
+    user = get_session_user(token)
+    if not user:
+        emit('error', {'message': 'Invalid token'}, room=request.sid)
+        return
+
+    try:
+        lobby = get_lobby_access(character_edits.lobby_of(character_id))
+        if not lobby or not lobby.participant(user.id):
+            emit('error', {'message': 'You are not in this lobby'}, room=request.sid)
+            return
+        version = character_edits.edit(character_id, user.id, request.sid, 'character_data_patched', {
+            'character_id': character_id,
+            'patch': patch,
+            'updated_by': user.id
+        }, patch=patch, base_version=data.get('version'))
+    except ConflictError as e:
+        emit('error', {'message': str(e), 'character_id': character_id,
+                       'version': character_edits.version(character_id)}, room=request.sid)
+        return
+    except ServiceError as e:
+        emit('error', {'message': str(e)}, room=request.sid)
+        return
+
+    emit('character_patch_applied', {'character_id': character_id, 'version': version})
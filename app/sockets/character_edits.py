@@ -0,0 +1,279 @@
+# app/sockets/character_edits.py
+"""
+Буфер правок листов персонажей с отложенной записью в БД.
+
+Правка (update_character_data, patch_character_data, data в REST PUT/PATCH
+персонажа) применяется к копии листа в памяти, получает следующую версию и
+сразу рассылается в комнату character_<id>. В БД лист пишется одним UPDATE не чаще чем раз в
+CHARACTER_FLUSH_INTERVAL мс: все правки за интервал сливаются в одну запись.
+
+Гарантии:
+- порядок: версия присваивается и событие рассылается под блокировкой
+  персонажа, клиенты получают правки в порядке версий;
+- долговечность: правка рассылается ДО записи в БД. Буфер сбрасывается по
+  таймеру, при отключении редактировавшего клиента и при остановке процесса
+  (выход или SIGTERM/SIGINT, см. app.utils.shutdown); при падении процесса
+  теряются правки последнего интервала;
+- общий порядок: если лист всё же записан в обход буфера (правка на другом
+  воркере) и версия в БД не старее буферизованной, лист из памяти пишется
+  поверх следующей версией и рассылается целиком (_rebase);
+- чтение: REST-эндпоинты персонажей и броски навыков перед чтением
+  сбрасывают буфер персонажа (flush), поэтому видят все разосланные правки.
+  После записи чистый лист из памяти удаляется, следующая правка читает БД.
+
+Персонажи комнат, которыми владеет другой воркер (app.backends.sharding),
+не буферизуются: правка пишется сразу, как раньше.
+"""
+
+import logging
+import threading
+from app.extensions import socketio, db
+from app.backends.sharding import shards
+from app.models import LobbyCharacter
+from app.services.character import CharacterService
+from app.services.exceptions import NotFoundError, ValidationError, ConflictError
+from app.utils.json_patch import apply_patch, JsonPatchError
+from app.utils.shutdown import on_shutdown
+from .scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 2.0  # сек; переопределяется CHARACTER_FLUSH_INTERVAL (мс)
+
+
+class _Entry:
+    __slots__ = ('character_id', 'lobby_id', 'data', 'version', 'dirty', 'dropped', 'sids', 'lock', 'flush_lock')
+
+    def __init__(self, character):
+        self.character_id = character.id
+        self.lobby_id = character.lobby_id
+        self.data = character.data or {}
+        self.version = character.version or 0
+        self.dirty = False
+        self.dropped = False
+        self.sids = set()          # кто правил с последней записи: их отключение сбрасывает буфер
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()   # одна запись персонажа в БД за раз, по порядку версий
+
+
+class CharacterEditBuffer:
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self.app = None
+        self._entries = {}         # character_id -> _Entry
+        self._lock = threading.Lock()
+        self.edits = 0
+        self.writes = 0
+        self.failed = 0
+        self.rebased = 0
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config['CHARACTER_FLUSH_INTERVAL'] / 1000
+        on_shutdown(self.flush_all)
+
+    def lobby_of(self, character_id):
+        """Комната персонажа (из буфера или БД); NotFoundError, если персонажа нет."""
+        with self._lock:
+            entry = self._entries.get(character_id)
+        if entry is not None:
+            return entry.lobby_id
+        character = LobbyCharacter.query.get(character_id)
+        if not character:
+            raise NotFoundError("Character not found")
+        return character.lobby_id
+
+    def version(self, character_id):
+        """Текущая версия листа с учётом буфера (None — персонажа нет)."""
+        with self._lock:
+            entry = self._entries.get(character_id)
+        if entry is not None:
+            return entry.version
+        character = LobbyCharacter.query.get(character_id)
+        return character.version if character else None
+
+    def edit(self, character_id, user_id, sid, event, payload, patch=None, data=None, base_version=None):
+        """
+        Применяет правку (patch — JSON Patch, иначе data — лист целиком), рассылает
+        event с payload и новой версией в комнату персонажа (кроме sid) и
+        возвращает версию. Права доступа проверяет вызывающий.
+        """
+        lobby_id = self.lobby_of(character_id)
+        if not shards.is_local(lobby_id):
+            character = self._write_through(character_id, user_id, patch, data, base_version)
+            payload = dict(payload, version=character.version)
+            socketio.emit(event, payload, room=f"character_{character_id}", skip_sid=sid)
+            return character.version
+
+        while True:
+            entry = self._entry(character_id)
+            with entry.lock:
+                if entry.dropped:
+                    continue  # запись только что сброшена и удалена — берём свежую
+                if base_version is not None and base_version != entry.version:
+                    raise ConflictError(f"Character changed: version {entry.version}, patch is for {base_version}")
+                entry.data = _apply(entry.data, patch, data)
+                entry.version += 1
+                if sid:
+                    entry.sids.add(sid)
+                first = not entry.dirty
+                entry.dirty = True
+                version = entry.version
+                socketio.emit(event, dict(payload, version=version),
+                              room=f"character_{character_id}", skip_sid=sid)
+                break
+
+        with self._lock:
+            self.edits += 1
+        if first:
+            scheduler.schedule(('character', character_id), self.interval, self.flush, character_id)
+        return version
+
+    def flush(self, character_id):
+        """Пишет буферизованный лист персонажа в БД. True — была запись."""
+        with self._lock:
+            entry = self._entries.get(character_id)
+        if entry is None:
+            return False
+        scheduler.cancel(('character', character_id))
+        # Сброс по таймеру, явный flush и flush_all могут совпасть: снимок и запись
+        # под flush_lock, чтобы более старый снимок не записался последним
+        with entry.flush_lock:
+            with entry.lock:
+                dirty, data, version = entry.dirty, entry.data, entry.version
+                entry.dirty = False
+                entry.sids.clear()
+            written = dirty and self._store(character_id, data, version)
+            if written is None:
+                written = self._rebase(entry)
+            with self._lock, entry.lock:
+                if dirty and not written:
+                    # Не записалось — правки остаются в памяти, следующая попытка по таймеру
+                    entry.dirty = True
+                    scheduler.schedule(('character', character_id), self.interval, self.flush, character_id)
+                elif not entry.dirty and self._entries.get(character_id) is entry:
+                    entry.dropped = True
+                    del self._entries[character_id]
+        return written
+
+    def flush_many(self, character_ids):
+        return sum(1 for character_id in character_ids if self.flush(character_id))
+
+    def flush_sid(self, sid):
+        """Сбрасывает листы, которые правил отключившийся клиент."""
+        with self._lock:
+            ids = [e.character_id for e in self._entries.values() if sid in e.sids]
+        return self.flush_many(ids)
+
+    def flush_lobby(self, lobby_id):
+        with self._lock:
+            ids = [e.character_id for e in self._entries.values() if e.lobby_id == lobby_id]
+        return self.flush_many(ids)
+
+    def flush_all(self):
+        with self._lock:
+            ids = list(self._entries)
+        return self.flush_many(ids)
+
+    def forget_remote(self):
+        """После перебалансировки: листы комнат, ушедших на другие воркеры, пишутся в БД."""
+        with self._lock:
+            ids = [e.character_id for e in self._entries.values() if not shards.is_local(e.lobby_id)]
+        self.flush_many(ids)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._entries),
+                'dirty': sum(1 for e in self._entries.values() if e.dirty),
+                'edits': self.edits,
+                'writes': self.writes,
+                'failed': self.failed,
+                'rebased': self.rebased
+            }
+
+    def _entry(self, character_id):
+        with self._lock:
+            entry = self._entries.get(character_id)
+        if entry is not None:
+            return entry
+        character = LobbyCharacter.query.get(character_id)
+        if not character:
+            raise NotFoundError("Character not found")
+        loaded = _Entry(character)
+        with self._lock:
+            # Пока читали БД, запись мог создать другой поток
+            return self._entries.setdefault(character_id, loaded)
+
+    def _store(self, character_id, data, version):
+        if self.app is None:
+            return False
+        with self.app.app_context():
+            try:
+                # None — в БД версия не старее (лист записали в обход буфера), см. _rebase
+                written = True if CharacterService.store_data(character_id, data, version) else None
+            except Exception:
+                db.session.rollback()
+                logger.exception(f"Character {character_id} flush failed (v{version})")
+                written = False
+        with self._lock:
+            if written:
+                self.writes += 1
+            elif written is False:
+                self.failed += 1
+        return written
+
+    def _rebase(self, entry):
+        """
+        Лист изменили в обход буфера (другой воркер писал напрямую), и версия
+        буфера не новее записанной. Разосланные правки не выбрасываем: лист из
+        памяти пишется поверх со следующей версией и целиком рассылается в комнату,
+        клиенты переходят на него.
+        """
+        with entry.lock:
+            data = entry.data
+            with self.app.app_context():
+                try:
+                    version = CharacterService.rebase_data(entry.character_id, data)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception(f"Character {entry.character_id} rebase failed")
+                    with self._lock:
+                        self.failed += 1
+                    return False
+            logger.warning(f"Character {entry.character_id} was written outside the edit buffer, "
+                           f"rebased buffered sheet as v{version}")
+            entry.version = version
+            entry.dirty = False
+            socketio.emit('character_data_updated', {
+                'character_id': entry.character_id,
+                'updates': {'data': data},
+                'updated_by': None,
+                'version': version
+            }, room=f"character_{entry.character_id}")
+        with self._lock:
+            self.writes += 1
+            self.rebased += 1
+        return True
+
+    def _write_through(self, character_id, user_id, patch, data, base_version):
+        if patch is not None:
+            return CharacterService.patch_character(character_id, user_id, patch, base_version)
+        return CharacterService.update_character(character_id, user_id, {'data': data})
+
+
+def _apply(document, patch, data):
+    if patch is None:
+        new = data
+    else:
+        try:
+            new = apply_patch(document, patch)
+        except JsonPatchError as e:
+            raise ValidationError(f"Invalid patch: {e}")
+    if not isinstance(new, dict):
+        raise ValidationError("Character data must stay an object")
+    return new
+
+
+character_edits = CharacterEditBuffer()
+shards.on_change(character_edits.forget_remote)
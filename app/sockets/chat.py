@@ -3,9 +3,12 @@ import logging
 from datetime import datetime, timezone
 from flask import request
 from flask_socketio import emit
-from app.extensions import socketio, db
-from app.models import ChatMessage
-from .utils import get_user_from_token
+from app.extensions import socketio
+from app.services.access import get_lobby_access
+from app.services.chat import ChatService, HISTORY_LIMIT, MAX_HISTORY_LIMIT
+from app.services.exceptions import ValidationError
+from .session import get_session_user
+from .ingest import chat_ingest
 from app.utils.dice import roll_dice as roll_dice_util
 
 logger = logging.getLogger(__name__)
@@ -15,15 +18,20 @@ def handle_message(data):
     token = data.get('token')
     lobby_id = data.get('lobby_id')
     raw_message = data.get('message')
-    if not token or not lobby_id or not raw_message:
+    if not lobby_id or not raw_message:
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         logger.warning("Message send attempt with invalid token")
         emit('error', {'message': 'Invalid token'})
         return
 
+    lobby = get_lobby_access(lobby_id)
+    if not lobby or not lobby.is_member(user.id):
+        emit('error', {'message': 'Access denied'})
+        return
+
     # Проверяем, является ли сообщение командой
     final_text = raw_message
     if raw_message.startswith('/roll'):
@@ -50,20 +58,37 @@ def handle_message(data):
             }, room=request.sid)
             return
 
-    # Сохраняем сообщение в БД
-    msg = ChatMessage(
-        lobby_id=lobby_id,
-        user_id=user.id,
-        username=user.username,
-        message=final_text
-    )
-    db.session.add(msg)
-    db.session.commit()
-    logger.info(f"Message from {user.username} in lobby {lobby_id}: {final_text}")
+    # Рассылаем всем в комнате сразу, в БД сообщение попадёт пакетом (см. ingest.py)
+    chat_ingest.submit(lobby.id, user, final_text)
+    logger.debug(f"Message from {user.username} in lobby {lobby_id}: {final_text}")
+
+@socketio.on('get_chat_history')
+def handle_get_chat_history(data):
+    """Страница истории: {lobby_id, before | after, limit} -> chat_history_page."""
+    token = data.get('token')
+    lobby_id = data.get('lobby_id')
+    if not lobby_id:
+        return
 
-    # Рассылаем всем в комнате
-    emit('new_message', {
-        'username': user.username,
-        'message': final_text,
-        'timestamp': msg.timestamp.isoformat()
-    }, room=f"lobby_{lobby_id}")
\ No newline at end of file
+    user = get_session_user(token)
+    if not user:
+        emit('error', {'message': 'Invalid token'})
+        return
+
+    lobby = get_lobby_access(lobby_id)
+    if not lobby or not lobby.is_member(user.id):
+        emit('error', {'message': 'Access denied'})
+        return
+
+    limit = data.get('limit', HISTORY_LIMIT)
+    if not isinstance(limit, int) or limit < 1 or limit > MAX_HISTORY_LIMIT:
+        emit('error', {'message': f'limit must be between 1 and {MAX_HISTORY_LIMIT}'})
+        return
+
+    chat_ingest.flush()
+    try:
+        page = ChatService.get_history(lobby.id, before=data.get('before'), after=data.get('after'), limit=limit)
+    except ValidationError as e:
+        emit('error', {'message': str(e)})
+        return
+    emit('chat_history_page', page, room=request.sid)
\ No newline at end of file
@@ -5,12 +5,17 @@ from datetime import datetime, timezone
 from flask import request
 from flask_socketio import emit
 from app.extensions import socketio, db
-from app.models import Lobby, LobbyParticipant, LobbyCharacter
+from app.models import LobbyCharacter
+from app.services.access import get_lobby_access
+from app.services.character import CharacterService
 from app.utils.dice import roll_dice as roll_dice_util
-from .utils import get_user_from_token
+from .character_edits import character_edits
+from .session import get_session_user
 
 logger = logging.getLogger(__name__)
 
+MAX_BATCH_ROLLS = 50
+
 @socketio.on('roll_skill')
 def handle_roll_skill(data):
     token = data.get('token')
@@ -19,52 +24,33 @@ def handle_roll_skill(data):
     skill_name = data.get('skill_name')
     extra_modifier = data.get('extra_modifier', 0)
 
-    if not all([token, lobby_id, character_id, skill_name]):
+    if not all([lobby_id, character_id, skill_name]):
         emit('error', {'message': 'Missing data'}, room=request.sid)
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         emit('error', {'message': 'Invalid token'}, room=request.sid)
         return
 
-    participant = LobbyParticipant.query.filter_by(lobby_id=lobby_id, user_id=user.id).first()
-    if not participant:
+    lobby = get_lobby_access(lobby_id)
+    if not lobby or not lobby.participant(user.id):
         emit('error', {'message': 'You are not in this lobby'}, room=request.sid)
         return
 
+    # Бонусы берутся из БД: несохранённые правки листа сначала записываются
+    character_edits.flush(character_id)
     character = LobbyCharacter.query.get(character_id)
     if not character:
         emit('error', {'message': 'Character not found'}, room=request.sid)
         return
 
-    lobby = Lobby.query.get(lobby_id)
-    is_gm = (lobby.gm_id == user.id)
+    is_gm = lobby.is_gm(user.id)
     if character.owner_id != user.id and not is_gm:
         emit('error', {'message': 'You cannot roll for this character'}, room=request.sid)
         return
 
-    # Поиск навыка в данных персонажа (универсальный)
-    char_data = character.data
-    skill_bonus = None
-
-    if isinstance(char_data, dict):
-        if 'skills' in char_data:
-            skill_bonus = char_data['skills'].get(skill_name)
-        elif 'data' in char_data and isinstance(char_data['data'], dict):
-            if 'skills' in char_data['data']:
-                skill_bonus = char_data['data']['skills'].get(skill_name)
-            else:
-                for k, v in char_data['data'].items():
-                    if isinstance(v, dict) and skill_name in v:
-                        skill_bonus = v[skill_name]
-                        break
-        else:
-            for k, v in char_data.items():
-                if isinstance(v, dict) and skill_name in v:
-                    skill_bonus = v[skill_name]
-                    break
-
+    skill_bonus = CharacterService.get_skill_bonus(character, skill_name)
     if skill_bonus is None:
         logger.warning(f"Skill {skill_name} not found for character {character_id}")
         emit('error', {'message': f'Skill {skill_name} not found'}, room=request.sid)
@@ -81,4 +67,82 @@ def handle_roll_skill(data):
         'username': 'System (Roll)',
         'message': message,
         'timestamp': datetime.now(timezone.utc).isoformat()
-    }, room=f"lobby_{lobby_id}")
\ No newline at end of file
+    }, room=f"lobby_{lobby_id}")
+
+@socketio.on('roll_skills_batch')
+def handle_roll_skills_batch(data):
+    """
+    Групповая проверка: rolls — список {character_id, skill_name, extra_modifier}.
+    Персонажи грузятся одним запросом, результат уходит в комнату одним сообщением.
+    GM бросает за любых персонажей комнаты, игрок — только за своих.
+    """
+    token = data.get('token')
+    lobby_id = data.get('lobby_id')
+    rolls = data.get('rolls')
+
+    if not lobby_id or not isinstance(rolls, list) or not rolls:
+        emit('error', {'message': 'Missing data'}, room=request.sid)
+        return
+    if len(rolls) > MAX_BATCH_ROLLS:
+        emit('error', {'message': f'Too many rolls (max {MAX_BATCH_ROLLS})'}, room=request.sid)
+        return
+    if not all(isinstance(r, dict) and isinstance(r.get('character_id'), int) and isinstance(r.get('skill_name'), str)
+               for r in rolls):
+        emit('error', {'message': 'Each roll needs character_id and skill_name'}, room=request.sid)
+        return
+
+    user = get_session_user(token)
+    if not user:
+        emit('error', {'message': 'Invalid token'}, room=request.sid)
+        return
+
+    lobby = get_lobby_access(lobby_id)
+    if not lobby or not lobby.participant(user.id):
+        emit('error', {'message': 'You are not in this lobby'}, room=request.sid)
+        return
+
+    is_gm = lobby.is_gm(user.id)
+    character_ids = {r['character_id'] for r in rolls}
+    character_edits.flush_many(character_ids)
+    characters = {c.id: c for c in LobbyCharacter.query.filter(
+        LobbyCharacter.id.in_(character_ids), LobbyCharacter.lobby_id == lobby_id)}
+
+    results = []
+    lines = []
+    for r in rolls:
+        character = characters.get(r['character_id'])
+        skill_name = r['skill_name']
+        entry = {'character_id': r['character_id'], 'skill_name': skill_name}
+        if character is None:
+            entry['error'] = 'Character not found'
+        elif character.owner_id != user.id and not is_gm:
+            entry['error'] = 'You cannot roll for this character'
+        else:
+            skill_bonus = CharacterService.get_skill_bonus(character, skill_name)
+            extra_modifier = r.get('extra_modifier', 0)
+            if skill_bonus is None:
+                entry['error'] = f'Skill {skill_name} not found'
+            elif not isinstance(extra_modifier, (int, float)):
+                entry['error'] = 'Invalid modifier'
+            else:
+                d20 = random.randint(1, 20)
+                total = d20 + skill_bonus + extra_modifier
+                entry.update({'character_name': character.name, 'd20': d20, 'bonus': skill_bonus,
+                              'extra_modifier': extra_modifier, 'total': total})
+                lines.append(f"{character.name}: {skill_name} 1d20 ({d20}) + {skill_bonus} + {extra_modifier} = **{total}**")
+        results.append(entry)
+
+    failed = [e for e in results if 'error' in e]
+    if failed:
+        # Ошибки видит только бросающий; удачные броски всё равно уходят в комнату
+        emit('error', {'message': 'Some rolls failed', 'rolls': failed}, room=request.sid)
+    if not lines:
+        return
+
+    logger.info(f"Batch skill roll: {user.username} rolled {len(lines)} checks in lobby {lobby_id}")
+    emit('new_message', {
+        'username': 'System (Roll)',
+        'message': f"Групповая проверка ({user.username}):\n" + "\n".join(lines),
+        'rolls': [e for e in results if 'error' not in e],
+        'timestamp': datetime.now(timezone.utc).isoformat()
+    }, room=f"lobby_{lobby_id}")
@@ -0,0 +1,223 @@
+# app/sockets/ingest.py
+"""
+Приём сообщений чата с групповой записью в БД.
+
+Воркер, владеющий комнатой (см. app.backends.sharding; без брокера — всегда),
+присваивает сообщению seq, сразу рассылает его в комнату и кладёт строку
+в буфер. Фоновая задача пишет буфер одним INSERT + COMMIT не позже чем
+через FLUSH_INTERVAL после первого сообщения (или сразу при FLUSH_BATCH строк).
+
+Гарантии:
+- порядок: seq внутри комнаты строго возрастает и совпадает с порядком
+  рассылки (присвоение и emit под блокировкой комнаты); между комнатами
+  порядок не определён;
+- долговечность: сообщение рассылается ДО записи в БД. При падении процесса
+  теряются сообщения последних FLUSH_INTERVAL мс (клиенты их видели, в истории
+  их не будет); при остановке (выход или SIGTERM/SIGINT, см. app.utils.shutdown)
+  буфер сбрасывается. Если пакет не записался, строки пишутся по одной, не
+  записавшиеся логируются и отбрасываются (в истории будет разрыв seq);
+- чтение: история в этом процессе перед выборкой сбрасывает буфер
+  (flush), поэтому видит всё разосланное; на других воркерах задержка —
+  до FLUSH_INTERVAL.
+
+Воркер без владения комнатой пишет сообщение синхронно
+(ChatService.create_message) и рассылает после COMMIT, как раньше.
+
+Записанные сообщения сразу добавляются в поисковый индекс комнаты
+(ChatSearchService.index_new), если он уже построен.
+
+Раз в CHAT_ARCHIVE_INTERVAL секунд archive() переносит сообщения старше
+CHAT_ARCHIVE_AFTER_DAYS дней из chat_messages в сжатые сегменты архива
+(ChatArchiveService) — только в комнатах, которыми владеет этот воркер.
+"""
+
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+from sqlalchemy import insert
+from app.extensions import socketio, db
+from app.backends.sharding import shards
+from app.models import ChatMessage
+from app.services.chat import ChatService
+from app.services.chat_archive import ChatArchiveService
+from app.services.chat_search import ChatSearchService
+from app.utils.shutdown import on_shutdown
+from .scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 0.005  # сек
+FLUSH_BATCH = 200       # строк; при достижении буфер пишется сразу
+
+
+class ChatIngest:
+    def __init__(self, interval=FLUSH_INTERVAL, batch=FLUSH_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self.app = None
+        self._buffer = []            # словари-строки ChatMessage
+        self._seqs = {}              # lobby_id -> последний присвоенный seq
+        self._lobby_locks = {}       # lobby_id -> Lock
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._task = None
+        self.flushes = 0
+        self.rows = 0
+        self.dropped = 0
+        self.archived = 0
+
+    def init_app(self, app):
+        self.app = app
+        on_shutdown(self.flush)
+        days = app.config['CHAT_ARCHIVE_AFTER_DAYS']
+        if days > 0:
+            scheduler.every(('chat', 'archive'), app.config['CHAT_ARCHIVE_INTERVAL'],
+                            self.archive, timedelta(days=days))
+
+    def submit(self, lobby_id, user, text):
+        """Принимает сообщение, рассылает new_message и возвращает его payload."""
+        if not shards.is_local(lobby_id):
+            message = ChatService.create_message(lobby_id, user.id, user.username, text)
+            payload = ChatService.serialize(message)
+            self._index(lobby_id, [{'seq': message.seq, 'username': message.username, 'message': message.message}])
+            socketio.emit('new_message', payload, room=f"lobby_{lobby_id}")
+            return payload
+
+        with self._lobby_lock(lobby_id):
+            seq = self._next_seq(lobby_id)
+            now = datetime.now(timezone.utc)
+            with self._lock:
+                self._buffer.append({
+                    'lobby_id': lobby_id, 'user_id': user.id, 'username': user.username,
+                    'message': text, 'timestamp': now, 'seq': seq
+                })
+                full = len(self._buffer) >= self.batch
+            payload = ChatService.payload(seq, user.username, text, now)
+            socketio.emit('new_message', payload, room=f"lobby_{lobby_id}")
+
+        self._ensure_started()
+        if full:
+            self.flush()
+        else:
+            self._wakeup.set()
+        return payload
+
+    def flush(self):
+        """Пишет всё, что накопилось в буфере. Возвращает число записанных строк."""
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        if not batch or self.app is None:
+            return 0
+        with self.app.app_context():
+            try:
+                db.session.execute(insert(ChatMessage), batch)
+                db.session.commit()
+                written = len(batch)
+            except Exception:
+                db.session.rollback()
+                logger.exception(f"Chat batch of {len(batch)} rows failed, retrying row by row")
+                written = self._insert_rows(batch)
+            else:
+                by_lobby = {}
+                for row in batch:
+                    by_lobby.setdefault(row['lobby_id'], []).append(row)
+                for lobby_id, rows in by_lobby.items():
+                    self._index(lobby_id, rows)
+        with self._lock:
+            self.flushes += 1
+            self.rows += written
+            self.dropped += len(batch) - written
+        return written
+
+    def archive(self, max_age):
+        """Переносит в архив сообщения старше max_age. Возвращает число перенесённых сообщений."""
+        self.flush()
+        # В БД время хранится без часового пояса (UTC)
+        cutoff = (datetime.now(timezone.utc) - max_age).replace(tzinfo=None)
+        archived = 0
+        with self.app.app_context():
+            for lobby_id in ChatArchiveService.lobbies_to_archive(cutoff):
+                if not shards.is_local(lobby_id):
+                    continue
+                # Старые сообщения без seq сначала нумеруются, иначе их нельзя архивировать по порядку
+                ChatService.ensure_sequence(lobby_id)
+                archived += ChatArchiveService.archive_lobby(lobby_id, cutoff)
+        with self._lock:
+            self.archived += archived
+        return archived
+
+    def forget_remote(self):
+        """После перебалансировки: дописывает буфер и забывает seq комнат, ушедших на другие воркеры."""
+        self.flush()
+        with self._lock:
+            for lobby_id in [l for l in self._seqs if not shards.is_local(l)]:
+                del self._seqs[lobby_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffered': len(self._buffer),
+                'flushes': self.flushes,
+                'rows': self.rows,
+                'dropped': self.dropped,
+                'archived': self.archived,
+                'avg_batch': round(self.rows / self.flushes, 2) if self.flushes else 0.0
+            }
+
+    def _next_seq(self, lobby_id):
+        seq = self._seqs.get(lobby_id)
+        if seq is None:
+            # Первое сообщение комнаты в этом процессе: продолжаем нумерацию из БД
+            self.flush()
+            seq = ChatService.ensure_sequence(lobby_id)
+        seq += 1
+        self._seqs[lobby_id] = seq
+        return seq
+
+    def _lobby_lock(self, lobby_id):
+        with self._lock:
+            lock = self._lobby_locks.get(lobby_id)
+            if lock is None:
+                lock = self._lobby_locks[lobby_id] = threading.Lock()
+            return lock
+
+    def _index(self, lobby_id, rows):
+        # Ошибка индекса не должна терять сообщения: не проиндексированное догонит поиск
+        try:
+            ChatSearchService.index_new(lobby_id, rows)
+        except Exception:
+            db.session.rollback()
+            logger.exception(f"Chat search indexing failed in lobby {lobby_id}")
+
+    def _insert_rows(self, batch):
+        written = 0
+        for row in batch:
+            try:
+                db.session.execute(insert(ChatMessage), [row])
+                db.session.commit()
+                written += 1
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Dropped chat message seq={row['seq']} in lobby {row['lobby_id']}: {e}")
+        return written
+
+    def _ensure_started(self):
+        if self._task is None:
+            with self._lock:
+                if self._task is None:
+                    self._task = socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # Ждём, пока соберётся пакет: сообщения, пришедшие за интервал, уйдут одним COMMIT
+            socketio.sleep(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Chat flush failed")
+
+
+chat_ingest = ChatIngest()
+shards.on_change(chat_ingest.forget_remote)
@@ -1,11 +1,19 @@
-# app/sockets/kick.py
 import logging
 from flask_socketio import emit
 from app.extensions import socketio
+from .session import presence
 
 logger = logging.getLogger(__name__)
 
 def kick_user(user_id, lobby_id):
-    """Отправляет сигнал о кике пользователю."""
+    """Отправляет сигнал о кике пользователю и сразу отзывает его сокет-сессии в комнате."""
     logger.info(f"Kicking user {user_id} from lobby {lobby_id}")
-    socketio.emit('kicked', {'reason': 'banned'}, room=f"user_{user_id}")
\ No newline at end of file
+    socketio.emit('kicked', {'reason': 'banned'}, room=f"user_{user_id}")
+    revoked = presence.revoke(user_id, lobby_id)
+    if revoked:
+        socketio.emit('user_left', {
+            'user_id': user_id, 'username': revoked[0].username
+        }, room=f"lobby_{lobby_id}")
+    # Сокеты на других воркерах отключаются через очередь сообщений
+    for entry in revoked:
+        socketio.server.disconnect(entry.sid, namespace='/')
@@ -4,8 +4,9 @@ from flask_socketio import emit, join_room, leave_room
 from app.extensions import socketio, db
 from app.models.location import Location
 from app.models.location_character import LocationCharacter
-from app.sockets.utils import get_user_from_token
-from app.models import LobbyParticipant, LobbyCharacter
+from app.sockets.session import get_session_user
+from app.models import LobbyCharacter
+from app.services.access import get_lobby_access
 
 logger = logging.getLogger(__name__)
 
@@ -14,10 +15,10 @@ def handle_join_location(data):
     token = data.get('token')
     location_id = data.get('location_id')
     character_id = data.get('character_id')
-    if not all([token, location_id, character_id]):
+    if not all([location_id, character_id]):
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         emit('error', {'message': 'Invalid token'}, room=request.sid)
         return
@@ -35,10 +36,8 @@ def handle_join_location(data):
         return
 
     # Проверяем, что пользователь в лобби локации
-    participant = LobbyParticipant.query.filter_by(
-        lobby_id=location.lobby_id, user_id=user.id
-    ).first()
-    if not participant:
+    lobby = get_lobby_access(location.lobby_id)
+    if not lobby or not lobby.participant(user.id):
         emit('error', {'message': 'Not in lobby'}, room=request.sid)
         return
 
@@ -96,10 +95,10 @@ def handle_leave_location(data):
     token = data.get('token')
     location_id = data.get('location_id')
     character_id = data.get('character_id')
-    if not all([token, location_id, character_id]):
+    if not all([location_id, character_id]):
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         return
 
@@ -117,10 +116,10 @@ def handle_move_in_location(data):
     character_id = data.get('character_id')
     new_x = data.get('x')
     new_y = data.get('y')
-    if not all([token, location_id, character_id, new_x is not None, new_y is not None]):
+    if not all([location_id, character_id, new_x is not None, new_y is not None]):
         return
 
-    user = get_user_from_token(token)
+    user = get_session_user(token)
     if not user:
         emit('error', {'message': 'Invalid token'}, room=request.sid)
         return
@@ -136,8 +135,8 @@ def handle_move_in_location(data):
     location = Location.query.get(location_id)
     if not location:
         return
-    lobby = location.lobby
-    is_gm = (lobby.gm_id == user.id)
+    lobby = get_lobby_access(location.lobby_id)
+    is_gm = bool(lobby) and lobby.is_gm(user.id)
     if not is_gm and loc_char.character.owner_id != user.id:
         emit('error', {'message': 'Permission denied'}, room=request.sid)
         return
@@ -0,0 +1,190 @@
+# app/sockets/metrics.py
+"""
+Инструментирование сокет-обработчиков.
+
+instrument_handlers() оборачивает все зарегистрированные обработчики socketio.on
+и для каждого события считает:
+- число вызовов и ошибок;
+- гистограмму задержки обработчика (мс);
+- число SQL-запросов за вызов (через событие Engine before_cursor_execute);
+- гистограмму размера payload (байт JSON).
+
+Полезная нагрузка больше не пишется в лог на каждое событие: с вероятностью
+SOCKET_PAYLOAD_LOG_SAMPLE (0..1, по умолчанию 0) событие логируется целиком,
+поле token при этом скрывается. Снимок метрик отдаёт GET /metrics.
+"""
+
+import json
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PAYLOAD_BUCKETS_BYTES = (64, 256, 1024, 4096, 16384, 65536, 262144)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 25, 50)
+
+# Сервисные события без payload: размер не считаем
+NO_PAYLOAD_EVENTS = ('connect', 'disconnect')
+
+
+class Histogram:
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последний — всё, что больше верхней границы
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        """Верхняя граница корзины, в которую попадает p-й перцентиль (None — за пределами)."""
+        if not self.count:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def to_dict(self):
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 3),
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'buckets': buckets
+        }
+
+
+class EventStats:
+    __slots__ = ('calls', 'errors', 'latency', 'queries', 'payload')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BUCKETS_MS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.payload = Histogram(PAYLOAD_BUCKETS_BYTES)
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency_ms': self.latency.to_dict(),
+            'db_queries': self.queries.to_dict(),
+            'payload_bytes': self.payload.to_dict()
+        }
+
+
+class SocketMetrics:
+    def __init__(self):
+        self._events = {}  # event -> EventStats
+        self._lock = threading.Lock()
+        self._local = threading.local()  # счётчик SQL-запросов текущего обработчика
+        self.payload_log_sample = 0.0
+        self.started_at = time.time()
+
+    def record(self, event_name, latency_ms, queries, payload_size, failed):
+        with self._lock:
+            stats = self._events.get(event_name)
+            if stats is None:
+                stats = self._events[event_name] = EventStats()
+            stats.calls += 1
+            if failed:
+                stats.errors += 1
+            stats.latency.observe(latency_ms)
+            stats.queries.observe(queries)
+            if payload_size is not None:
+                stats.payload.observe(payload_size)
+
+    def count_query(self):
+        depth = getattr(self._local, 'depth', 0)
+        if depth:
+            self._local.queries += 1
+
+    def snapshot(self):
+        with self._lock:
+            events = {name: stats.to_dict() for name, stats in sorted(self._events.items())}
+        return {
+            'uptime_s': round(time.time() - self.started_at, 1),
+            'events': events
+        }
+
+    def wrap(self, event_name, handler):
+        if getattr(handler, '_instrumented', False):
+            return handler
+        measure_payload = event_name not in NO_PAYLOAD_EVENTS
+
+        @wraps(handler)
+        def instrumented(sid, *args):
+            local = self._local
+            depth = getattr(local, 'depth', 0)
+            if not depth:
+                local.queries = 0
+            local.depth = depth + 1
+            payload_size = _payload_size(args) if measure_payload else None
+            if measure_payload and self.payload_log_sample and random.random() < self.payload_log_sample:
+                logger.info(f"Sampled event {event_name} from {sid}: {_redact(args)}")
+            failed = False
+            started = time.perf_counter()
+            try:
+                return handler(sid, *args)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                latency_ms = (time.perf_counter() - started) * 1000
+                local.depth = depth
+                self.record(event_name, latency_ms, local.queries, payload_size, failed)
+
+        instrumented._instrumented = True
+        return instrumented
+
+
+def _payload_size(args):
+    try:
+        return len(json.dumps(args, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _redact(args):
+    return [
+        {k: ('***' if k == 'token' else v) for k, v in arg.items()} if isinstance(arg, dict) else arg
+        for arg in args
+    ]
+
+
+metrics = SocketMetrics()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    metrics.count_query()
+
+
+def instrument_handlers(socketio, payload_log_sample=0.0):
+    """Оборачивает все обработчики socketio.on (уже зарегистрированные в сервере или отложенные)."""
+    metrics.payload_log_sample = payload_log_sample
+    if socketio.server is not None:
+        for namespace, handlers in socketio.server.handlers.items():
+            for event_name, handler in list(handlers.items()):
+                handlers[event_name] = metrics.wrap(event_name, handler)
+    socketio.handlers = [(event_name, metrics.wrap(event_name, handler), namespace)
+                         for event_name, handler, namespace in socketio.handlers]
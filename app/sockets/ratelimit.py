@@ -0,0 +1,184 @@
+# app/sockets/ratelimit.py
+"""
+Ограничение частоты сокет-событий (token bucket на пару пользователь + событие).
+
+Лимиты задаются в Config.SOCKET_RATE_LIMITS: событие -> {rate, burst, coalesce}.
+- rate  — сколько событий в секунду восполняется;
+- burst — ёмкость ведра (сколько можно отправить подряд);
+- coalesce — поле payload с id перетаскиваемого объекта. Для таких событий
+  (move_marker, move_in_location) лишние события не отклоняются: для каждого
+  объекта хранится только последнее, и оно выполняется, как только в ведре
+  появится токен. Промежуточные позиции теряются, конечная — нет.
+
+Остальные события сверх лимита отклоняются: клиент получает 'error'
+с полями message, event и retry_after (сек).
+
+Пользователь определяется по сессии sid (до authenticate — по самому sid),
+поэтому несколько вкладок одного пользователя делят общий лимит.
+Счётчики по событиям отдаёт GET /metrics (rate_limits).
+"""
+
+import logging
+import threading
+import time
+from functools import wraps
+from app.extensions import socketio
+from .scheduler import scheduler
+from .session import presence
+
+logger = logging.getLogger(__name__)
+
+PRUNE_INTERVAL = 60  # сек; полные (простаивающие) вёдра удаляются
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now):
+        """Забирает токен. Возвращает 0, если получилось, иначе — сколько секунд ждать."""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self):
+        self.limits = {}      # событие -> {'rate', 'burst', 'coalesce'}
+        self._buckets = {}    # (пользователь, событие) -> TokenBucket
+        self._pending = {}    # (пользователь, событие, id объекта) -> (sid, namespace, handler, args)
+        self._counters = {}   # событие -> {'allowed', 'rejected', 'coalesced', 'deferred'}
+        self._lock = threading.Lock()
+
+    def configure(self, limits):
+        self.limits = {event: dict(limit) for event, limit in (limits or {}).items() if limit}
+        if self.limits:
+            scheduler.every(('ratelimit', 'prune'), PRUNE_INTERVAL, self.prune)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'events': {event: dict(counters) for event, counters in sorted(self._counters.items())},
+                'buckets': len(self._buckets),
+                'pending': len(self._pending)
+            }
+
+    def prune(self):
+        now = time.monotonic()
+        with self._lock:
+            for key, bucket in list(self._buckets.items()):
+                bucket.refill(now)
+                if bucket.tokens >= bucket.burst:
+                    del self._buckets[key]
+
+    def wrap(self, event_name, handler, namespace='/'):
+        limit = self.limits.get(event_name)
+        if limit is None or getattr(handler, '_rate_limited', False):
+            return handler
+        coalesce = limit.get('coalesce')
+
+        @wraps(handler)
+        def limited(sid, *args):
+            user_key = _user_key(sid)
+            wait = self._take(user_key, event_name, limit)
+            object_id = _object_id(args, coalesce) if coalesce else None
+            if object_id is not None:
+                pending_key = (user_key, event_name, object_id)
+                with self._lock:
+                    superseded = self._pending.pop(pending_key, None) if not wait else self._pending.get(pending_key)
+                    if wait:
+                        self._pending[pending_key] = (sid, namespace, handler, args)
+                    if superseded is not None:
+                        self._count(event_name, 'coalesced')
+                if wait:
+                    if superseded is None:
+                        scheduler.schedule(('ratelimit',) + pending_key, wait, self._run_pending, pending_key, limit)
+                    return None
+                if superseded is not None:
+                    scheduler.cancel(('ratelimit',) + pending_key)
+            elif wait:
+                with self._lock:
+                    self._count(event_name, 'rejected')
+                logger.debug(f"Rate limit: {event_name} from {sid} rejected")
+                socketio.emit('error', {
+                    'message': f'Too many {event_name} events, slow down',
+                    'event': event_name,
+                    'retry_after': round(wait, 3)
+                }, to=sid, namespace=namespace)
+                return None
+            with self._lock:
+                self._count(event_name, 'allowed')
+            return handler(sid, *args)
+
+        limited._rate_limited = True
+        return limited
+
+    def _run_pending(self, pending_key, limit):
+        """Выполняет последнее отложенное событие объекта (вызывается планировщиком)."""
+        user_key, event_name, _ = pending_key
+        wait = self._take(user_key, event_name, limit)
+        if wait:
+            scheduler.schedule(('ratelimit',) + pending_key, wait, self._run_pending, pending_key, limit)
+            return
+        with self._lock:
+            pending = self._pending.pop(pending_key, None)
+            if pending is not None:
+                self._count(event_name, 'deferred')
+        if pending is None:
+            return
+        sid, namespace, handler, args = pending
+        if not socketio.server.manager.is_connected(sid, namespace):
+            return
+        handler(sid, *args)
+
+    def _take(self, user_key, event_name, limit):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get((user_key, event_name))
+            if bucket is None:
+                bucket = self._buckets[(user_key, event_name)] = TokenBucket(limit['rate'], limit['burst'], now)
+            return bucket.take(now)
+
+    def _count(self, event_name, counter):
+        counters = self._counters.get(event_name)
+        if counters is None:
+            counters = self._counters[event_name] = {'allowed': 0, 'rejected': 0, 'coalesced': 0, 'deferred': 0}
+        counters[counter] += 1
+
+
+def _user_key(sid):
+    session = presence.get(sid)
+    return session.user.id if session is not None else ('sid', sid)
+
+
+def _object_id(args, field):
+    data = args[0] if args else None
+    if not isinstance(data, dict):
+        return None
+    value = data.get(field)
+    return value if isinstance(value, (int, str)) else None
+
+
+rate_limiter = RateLimiter()
+
+
+def limit_handlers(socketio, limits):
+    """Оборачивает обработчики событий из limits (уже зарегистрированные в сервере или отложенные)."""
+    rate_limiter.configure(limits)
+    if socketio.server is not None:
+        for namespace, handlers in socketio.server.handlers.items():
+            for event_name, handler in list(handlers.items()):
+                handlers[event_name] = rate_limiter.wrap(event_name, handler, namespace)
+    socketio.handlers = [(event_name, rate_limiter.wrap(event_name, handler, namespace or '/'), namespace)
+                         for event_name, handler, namespace in socketio.handlers]
@@ -0,0 +1,92 @@
+# app/sockets/scheduler.py
+"""
+Единый планировщик отложенных задач для сокетов.
+
+Вместо threading.Timer на каждое подключение все дедлайны хранятся в одной
+куче и обслуживаются одной фоновой задачей socketio (поток, green thread —
+в зависимости от async_mode). Подходит для таймаутов аутентификации, а также
+для периодических проверок (idle/heartbeat) через every().
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from app.extensions import socketio
+
+logger = logging.getLogger(__name__)
+
+TICK = 0.5  # максимальный интервал сна фоновой задачи, сек
+
+
+class Scheduler:
+    def __init__(self, tick=TICK):
+        self.tick = tick
+        self._heap = []           # (deadline, seq, key)
+        self._jobs = {}           # key -> (deadline, seq, callback, args, interval)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._task = None
+
+    def schedule(self, key, delay, callback, *args):
+        """Запланировать callback(*args) через delay секунд. Повторный key заменяет задачу."""
+        self._add(key, delay, callback, args, None)
+
+    def every(self, key, interval, callback, *args):
+        """Вызывать callback(*args) каждые interval секунд (до cancel(key))."""
+        self._add(key, interval, callback, args, interval)
+
+    def cancel(self, key):
+        """Отменяет задачу. Запись в куче удаляется лениво при извлечении."""
+        with self._lock:
+            return self._jobs.pop(key, None) is not None
+
+    def pending(self):
+        return len(self._jobs)
+
+    def _add(self, key, delay, callback, args, interval):
+        deadline = time.monotonic() + delay
+        seq = next(self._seq)
+        with self._lock:
+            self._jobs[key] = (deadline, seq, callback, args, interval)
+            heapq.heappush(self._heap, (deadline, seq, key))
+            if self._task is None:
+                self._task = socketio.start_background_task(self._run)
+
+    def _pop_due(self, now):
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, seq, key = heapq.heappop(self._heap)
+                job = self._jobs.get(key)
+                if job is None or job[1] != seq:
+                    continue  # отменена или перепланирована
+                _, _, callback, args, interval = job
+                if interval is None:
+                    del self._jobs[key]
+                else:
+                    next_seq = next(self._seq)
+                    self._jobs[key] = (now + interval, next_seq, callback, args, interval)
+                    heapq.heappush(self._heap, (now + interval, next_seq, key))
+                due.append((key, callback, args))
+            next_deadline = self._heap[0][0] if self._heap else None
+        return due, next_deadline
+
+    def _run(self):
+        logger.info("Socket scheduler started")
+        while True:
+            due, next_deadline = self._pop_due(time.monotonic())
+            for key, callback, args in due:
+                try:
+                    callback(*args)
+                except Exception:
+                    logger.exception(f"Scheduled job {key!r} failed")
+            if next_deadline is None:
+                delay = self.tick
+            else:
+                delay = min(self.tick, max(0.0, next_deadline - time.monotonic()))
+            socketio.sleep(delay)
+
+
+scheduler = Scheduler()
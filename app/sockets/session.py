@@ -0,0 +1,128 @@
+# app/sockets/session.py
+"""
+Сессии сокетов и присутствие пользователей в комнатах.
+
+JWT декодируется один раз в handle_authenticate, дальше обработчики берут
+пользователя из сессии. Токен проверяется повторно только после истечения
+срока действия (клиент по-прежнему присылает его в каждом событии).
+Бан отзывает сессию сразу (см. kick.py).
+
+PresenceRegistry хранит sid -> сессия, а индекс присутствия (app.backends) —
+комната -> {user_id: {sid, ...}}, поэтому список онлайн-пользователей комнаты
+берётся без обхода всех подключений, а несколько вкладок одного пользователя
+не мешают друг другу: пользователь «уходит» из комнаты только вместе с
+последней вкладкой. С брокером индекс общий для всех воркеров.
+"""
+
+import logging
+import time
+from collections import namedtuple
+from flask import request
+from app.backends.presence import PresenceIndex
+from .utils import decode_user_token
+
+logger = logging.getLogger(__name__)
+
+SessionUser = namedtuple('SessionUser', ['id', 'username'])
+
+
+class SocketSession:
+    __slots__ = ('sid', 'user', 'lobby_id', 'expires_at')
+
+    def __init__(self, sid, user, lobby_id, expires_at=None):
+        self.sid = sid
+        self.user = user
+        self.lobby_id = lobby_id
+        self.expires_at = expires_at  # unix time из claim 'exp', None – бессрочно
+
+    def is_expired(self, now=None):
+        if self.expires_at is None:
+            return False
+        return (now or time.time()) >= self.expires_at
+
+
+class PresenceRegistry:
+    """
+    Локальные сессии (sid -> SocketSession) этого воркера плюс индекс присутствия,
+    который может быть общим для всех воркеров (см. app.backends).
+    """
+
+    def __init__(self, index=None):
+        self._sessions = {}   # sid -> SocketSession (только сокеты этого воркера)
+        self.index = index or PresenceIndex()
+
+    def use_index(self, index):
+        self.index = index
+
+    def get(self, sid):
+        return self._sessions.get(sid)
+
+    def sessions(self):
+        """Снимок локальных сессий этого воркера."""
+        return list(self._sessions.values())
+
+    def bind(self, sid, user, lobby_id, expires_at=None):
+        """
+        Привязывает пользователя (объект с id и username) к sid в комнате lobby_id.
+        Возвращает (session, came_online): came_online=True, если это первая вкладка
+        пользователя в комнате.
+        """
+        session = SocketSession(sid, SessionUser(user.id, user.username), lobby_id, expires_at)
+        self._sessions[sid] = session
+        came_online = self.index.bind(sid, user.id, user.username, lobby_id)
+        return session, came_online
+
+    def unbind(self, sid):
+        """Удаляет сессию sid. Возвращает (session, went_offline) или (None, False)."""
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return None, False
+        _, went_offline = self.index.unbind(sid)
+        return session, went_offline
+
+    def revoke(self, user_id, lobby_id=None):
+        """
+        Удаляет все сессии пользователя (в комнате lobby_id или во всех), в том числе
+        на других воркерах. Возвращает записи PresenceEntry.
+        """
+        revoked = self.index.revoke(user_id, lobby_id)
+        for entry in revoked:
+            self._sessions.pop(entry.sid, None)
+        if revoked:
+            logger.info(f"Revoked {len(revoked)} socket session(s) of user {user_id}")
+        return revoked
+
+    def online_users(self, lobby_id):
+        return self.index.online_users(lobby_id)
+
+    def is_online(self, user_id, lobby_id):
+        return self.index.is_online(user_id, lobby_id)
+
+    def replay(self):
+        """Операции для восстановления записей этого воркера в общем индексе."""
+        return [('presence.bind', [s.sid, s.user.id, s.user.username, s.lobby_id])
+                for s in self.sessions()]
+
+
+presence = PresenceRegistry()
+
+
+def get_session_user(token=None):
+    """
+    Возвращает пользователя текущего sid (SessionUser) или None.
+    Если срок токена истёк, проверяет присланный токен заново: он должен быть
+    валиден и принадлежать тому же пользователю, иначе сессия отзывается.
+    """
+    session = presence.get(request.sid)
+    if session is None:
+        return None
+    if not session.is_expired():
+        return session.user
+
+    claims = decode_user_token(token) if token else None
+    if not claims or str(claims.get('sub')) != str(session.user.id):
+        logger.info(f"Socket session of user {session.user.id} expired")
+        presence.unbind(request.sid)
+        return None
+    session.expires_at = claims.get('exp')
+    return session.user
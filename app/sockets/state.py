@@ -0,0 +1,110 @@
+# app/sockets/state.py
+"""
+Состояние комнаты (GameState.map_data) в памяти воркера-владельца.
+
+Если комната закреплена за этим воркером (см. app.backends.sharding), map_data
+читается из БД один раз и дальше меняется в памяти; каждое изменение сразу
+записывается в БД (write-through), поэтому REST и другие воркеры видят
+актуальные данные. Если комната не закреплена (несколько воркеров без
+WORKER_URL), состояние, как и раньше, читается из БД на каждое событие.
+
+При изменении состава воркеров rebalance() переводит сокеты переехавших
+комнат на нового владельца и забывает их состояние.
+"""
+
+import logging
+import threading
+from app.extensions import socketio, db
+from app.backends.sharding import shards
+from app.models import GameState
+from .session import presence
+
+logger = logging.getLogger(__name__)
+
+
+class LobbyStateStore:
+    def __init__(self):
+        self._states = {}  # lobby_id -> map_data
+        self._locks = {}   # lobby_id -> RLock
+        self._locks_guard = threading.Lock()
+
+    def lock(self, lobby_id):
+        """
+        Блокировка комнаты: чтение-изменение-сохранение map_data выполняется под ней,
+        иначе параллельные обработчики (потоки или green threads, уступающие управление
+        на запросах к БД) теряют изменения друг друга.
+        """
+        lobby_id = int(lobby_id)
+        with self._locks_guard:
+            lock = self._locks.get(lobby_id)
+            if lock is None:
+                lock = self._locks[lobby_id] = threading.RLock()
+            return lock
+
+    def get(self, lobby_id):
+        """map_data комнаты (создаёт GameState, если его ещё нет)."""
+        lobby_id = int(lobby_id)
+        state = self._states.get(lobby_id)
+        if state is not None:
+            return state
+        with self.lock(lobby_id):
+            state = self._states.get(lobby_id)
+            if state is not None:
+                return state
+            state = self._load(lobby_id)
+            if shards.is_local(lobby_id):
+                self._states[lobby_id] = state
+            return state
+
+    def save(self, lobby_id, state):
+        """Записывает map_data комнаты в БД. При ошибке состояние в памяти сбрасывается."""
+        lobby_id = int(lobby_id)
+        try:
+            GameState.query.filter_by(lobby_id=lobby_id).update({'map_data': state})
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            self.drop(lobby_id)
+            raise
+
+    def drop(self, lobby_id):
+        self._states.pop(int(lobby_id), None)
+
+    def lobbies(self):
+        return list(self._states)
+
+    def _load(self, lobby_id):
+        game_state = GameState.query.filter_by(lobby_id=lobby_id).first()
+        if not game_state:
+            game_state = GameState(lobby_id=lobby_id)
+            db.session.add(game_state)
+            db.session.commit()
+        state = dict(game_state.map_data or {})
+        state.setdefault('markers', [])
+        # Держим в памяти собственную копию, а не объект сессии SQLAlchemy
+        db.session.expunge(game_state)
+        return state
+
+
+lobby_states = LobbyStateStore()
+
+
+def rebalance():
+    """Переводит сокеты комнат, сменивших владельца, на новый воркер."""
+    for lobby_id in lobby_states.lobbies():
+        if not shards.is_local(lobby_id):
+            lobby_states.drop(lobby_id)
+
+    moved = 0
+    for session in presence.sessions():
+        url = shards.redirect_url(session.lobby_id)
+        if url is None:
+            continue
+        socketio.emit('shard_redirect', {'url': url}, to=session.sid)
+        socketio.server.disconnect(session.sid, namespace='/')
+        moved += 1
+    if moved:
+        logger.info(f"Rebalance: moved {moved} sockets to other workers")
+
+
+shards.on_change(rebalance)
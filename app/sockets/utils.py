@@ -1,16 +1,20 @@
-# app/sockets/utils.py
 import logging
 from flask_jwt_extended import decode_token
 from app.models import User
 
 logger = logging.getLogger(__name__)
 
-def get_user_from_token(token):
-    """Вспомогательная функция для получения пользователя по JWT-токену."""
+def decode_user_token(token):
+    """Декодирует и проверяет JWT-токен. Возвращает claims или None."""
     try:
-        decoded = decode_token(token)
-        user_id = decoded['sub']
-        return User.query.get(user_id)
+        return decode_token(token)
     except Exception as e:
         logger.error(f"Token decode error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def get_user_from_token(token):
+    """Вспомогательная функция для получения пользователя по JWT-токену."""
+    decoded = decode_user_token(token)
+    if not decoded:
+        return None
+    return User.query.get(decoded['sub'])
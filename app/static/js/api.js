@@ -100,8 +100,8 @@ export const Server = {
     },
 
     // ----- Персонажи -----
-    async getLobbyCharacters(lobbyId) {
-        return apiFetch(`/lobbies/${lobbyId}/characters`);
+    async getLobbyCharacters(lobbyId, summary = false) {
+        return apiFetch(`/lobbies/${lobbyId}/characters${summary ? '?summary=1' : ''}`);
     },
 
     async createLobbyCharacter(lobbyId, name, data = {}) {
@@ -124,6 +124,14 @@ export const Server = {
         });
     },
 
+    async patchCharacter(characterId, patch, version = null) {
+        return apiFetch(`/lobbies/characters/${characterId}`, {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(version === null ? patch : { patch, version }),
+        });
+    },
+
     async deleteCharacter(characterId) {
         return apiFetch(`/lobbies/characters/${characterId}`, { method: 'DELETE' });
     },
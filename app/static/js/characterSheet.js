@@ -27,6 +27,10 @@ import { getSocket } from './socketHandlers.js';
 // ========== 1. СОСТОЯНИЕ И УТИЛИТЫ ==========
 let currentCharacterId = null;
 let currentCharacterData = null;
+// Последнее состояние, известное серверу, и его версия: автосохранение отправляет
+// только разницу (JSON Patch), входящие патчи применяются по порядку версий.
+let lastSyncedData = null;
+let currentCharacterVersion = 0;
 let autoSaveTimer = null;
 const AUTO_SAVE_DELAY = 500;
 
@@ -369,33 +373,148 @@ function scheduleAutoSave() {
     autoSaveTimer = setTimeout(() => {
         if (currentCharacterId) {
             updateDataFromFields();
-            const socket = getSocket();
-            if (socket) {
-                socket.emit('update_character_data', {
-                    token: localStorage.getItem('access_token'),
-                    character_id: currentCharacterId,
-                    updates: { data: currentCharacterData }
-                });
-            } else {
-                Server.updateCharacter(currentCharacterId, { data: currentCharacterData })
-                    .then(() => console.log('Auto-saved via HTTP'))
-                    .catch(err => showNotification('Ошибка автосохранения: ' + err.message));
-            }
+            syncCharacterChanges();
         }
     }, AUTO_SAVE_DELAY);
 }
 
 function forceSyncCharacter() {
+    if (currentCharacterId) syncCharacterChanges();
+}
+
+// ========== JSON PATCH ==========
+function escapePointerToken(key) {
+    return String(key).replace(/~/g, '~0').replace(/\//g, '~1');
+}
+
+// Разница двух документов в виде операций RFC 6902. Массивы разной длины заменяются целиком.
+function diffToPatch(before, after, path = '', ops = []) {
+    if (before === after) return ops;
+    const isObject = v => v !== null && typeof v === 'object';
+    if (Array.isArray(before) && Array.isArray(after) && before.length === after.length) {
+        after.forEach((value, i) => diffToPatch(before[i], value, `${path}/${i}`, ops));
+    } else if (isObject(before) && isObject(after) && !Array.isArray(before) && !Array.isArray(after)) {
+        for (const key of Object.keys(before)) {
+            if (!(key in after)) ops.push({ op: 'remove', path: `${path}/${escapePointerToken(key)}` });
+        }
+        for (const [key, value] of Object.entries(after)) {
+            if (value === undefined) continue;
+            const childPath = `${path}/${escapePointerToken(key)}`;
+            if (!(key in before) || before[key] === undefined) ops.push({ op: 'add', path: childPath, value: structuredClone(value) });
+            else diffToPatch(before[key], value, childPath, ops);
+        }
+    } else if (JSON.stringify(before) !== JSON.stringify(after)) {
+        ops.push({ op: 'replace', path: path, value: structuredClone(after) });
+    }
+    return ops;
+}
+
+// Применяет патч к документу на месте; для '' возвращает новый корень. Ошибка — исключение.
+function applyJsonPatch(doc, patch) {
+    const parse = pointer => pointer === '' ? [] :
+        pointer.slice(1).split('/').map(t => t.replace(/~1/g, '/').replace(/~0/g, '~'));
+    const parentOf = (root, tokens) => {
+        let node = root;
+        for (const token of tokens.slice(0, -1)) {
+            if (node === null || typeof node !== 'object' || !(token in node)) throw new Error(`Path not found: ${token}`);
+            node = node[token];
+        }
+        return node;
+    };
+    const add = (root, tokens, value) => {
+        if (!tokens.length) return value;
+        const parent = parentOf(root, tokens);
+        const key = tokens[tokens.length - 1];
+        if (Array.isArray(parent)) parent.splice(key === '-' ? parent.length : Number(key), 0, value);
+        else parent[key] = value;
+        return root;
+    };
+    const remove = (root, tokens) => {
+        const parent = parentOf(root, tokens);
+        const key = tokens[tokens.length - 1];
+        if (!(key in parent)) throw new Error(`Path not found: ${key}`);
+        const value = parent[key];
+        if (Array.isArray(parent)) parent.splice(Number(key), 1);
+        else delete parent[key];
+        return value;
+    };
+    const get = (root, tokens) => tokens.length ? parentOf(root, tokens)[tokens[tokens.length - 1]] : root;
+
+    for (const op of patch) {
+        const tokens = parse(op.path);
+        if (op.op === 'add') doc = add(doc, tokens, structuredClone(op.value));
+        else if (op.op === 'remove') remove(doc, tokens);
+        else if (op.op === 'replace') {
+            if (tokens.length) remove(doc, tokens);
+            doc = add(doc, tokens, structuredClone(op.value));
+        } else if (op.op === 'move') doc = add(doc, tokens, remove(doc, parse(op.from)));
+        else if (op.op === 'copy') doc = add(doc, tokens, structuredClone(get(doc, parse(op.from))));
+        else if (op.op === 'test') {
+            if (JSON.stringify(get(doc, tokens)) !== JSON.stringify(op.value)) throw new Error(`Test failed: ${op.path}`);
+        } else throw new Error(`Unknown op: ${op.op}`);
+    }
+    return doc;
+}
+
+// Отправляет серверу изменения листа с момента последней синхронизации
+function syncCharacterChanges() {
+    if (!currentCharacterData || !lastSyncedData) return;
+    const patch = diffToPatch(lastSyncedData, currentCharacterData);
+    if (!patch.length) return;
+    lastSyncedData = structuredClone(currentCharacterData);
     const socket = getSocket();
-    if (socket && currentCharacterId) {
-        socket.emit('update_character_data', {
+    if (socket) {
+        socket.emit('patch_character_data', {
             token: localStorage.getItem('access_token'),
             character_id: currentCharacterId,
-            updates: { data: currentCharacterData }
+            patch: patch
+        });
+    } else {
+        const characterId = currentCharacterId;
+        Server.patchCharacter(characterId, patch)
+            .then(result => onCharacterVersion(characterId, result.version))
+            .catch(err => showNotification('Ошибка автосохранения: ' + err.message));
+    }
+}
+
+// Версия после собственного изменения: если между ними был пропущен чужой патч — перечитываем лист
+function onCharacterVersion(characterId, version) {
+    if (characterId !== currentCharacterId) return;
+    if (version === currentCharacterVersion + 1) currentCharacterVersion = version;
+    else if (version > currentCharacterVersion) resyncCharacter();
+}
+
+async function resyncCharacter() {
+    const characterId = currentCharacterId;
+    try {
+        const character = await Server.getCharacter(characterId);
+        if (characterId !== currentCharacterId) return;
+        currentCharacterData = Object.assign(character.data || {}, {
+            ownerId: character.owner_id,
+            ownerUsername: character.owner_username,
+            visible_to: character.visible_to || []
         });
+        lastSyncedData = structuredClone(currentCharacterData);
+        currentCharacterVersion = character.version || 0;
+        refreshCharacterView();
+    } catch (err) {
+        showNotification('Ошибка синхронизации персонажа: ' + err.message);
     }
 }
 
+function refreshCharacterView() {
+    // Принудительно обновляем инвентарь и экипировку (они всегда в DOM)
+    renderInventoryTab(currentCharacterData);
+    renderEquipmentTab(currentCharacterData);
+
+    // Обновляем активную вкладку для немедленного отображения
+    const activeTab = document.querySelector('#sheet-tabs .tab-btn.active')?.dataset.tab;
+    if (activeTab === 'basic') renderBasicTab(currentCharacterData);
+    else if (activeTab === 'skills') renderSkillsTab(currentCharacterData);
+    else if (activeTab === 'settings') renderSettingsTab(currentCharacterData);
+    else if (activeTab === 'notes') renderNotesTab(currentCharacterData);
+}
+
 // ========== УНИВЕРСАЛЬНАЯ МОДЕЛЬ ПРЕДМЕТА ==========
 function generateItemId() {
     return 'item_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
@@ -8649,6 +8768,8 @@ export async function openCharacterSheet(characterId) {
         currentCharacterData.ownerId = character.owner_id;
         currentCharacterData.ownerUsername = character.owner_username;
         currentCharacterData.visible_to = character.visible_to || [];
+        lastSyncedData = structuredClone(currentCharacterData);
+        currentCharacterVersion = character.version || 0;
         await getAllItemTemplates();
         await renderCharacterSheet(character.name, currentCharacterData);
         document.getElementById('character-sheet-modal').style.display = 'flex';
@@ -8660,21 +8781,35 @@ export async function openCharacterSheet(characterId) {
             socket.on('character_data_updated', (data) => {
                 if (data.character_id === currentCharacterId && data.updated_by !== parseInt(localStorage.getItem('user_id'))) {
                     currentCharacterData = data.updates.data || currentCharacterData;
-
-                    // Принудительно обновляем инвентарь и экипировку (они всегда в DOM)
-                    renderInventoryTab(currentCharacterData);
-                    renderEquipmentTab(currentCharacterData);
-
-                    // Обновляем активную вкладку для немедленного отображения
-                    const activeTab = document.querySelector('#sheet-tabs .tab-btn.active')?.dataset.tab;
-                    if (activeTab === 'basic') renderBasicTab(currentCharacterData);
-                    else if (activeTab === 'skills') renderSkillsTab(currentCharacterData);
-                    else if (activeTab === 'settings') renderSettingsTab(currentCharacterData);
-                    else if (activeTab === 'notes') renderNotesTab(currentCharacterData);
-
+                    lastSyncedData = structuredClone(currentCharacterData);
+                    if (data.version !== undefined) currentCharacterVersion = data.version;
+                    refreshCharacterView();
+                    showNotification('Данные персонажа обновлены', 'system', 'bottom-left');
+                }
+            });
+            socket.off('character_data_patched');
+            socket.on('character_data_patched', (data) => {
+                if (data.character_id !== currentCharacterId || data.version <= currentCharacterVersion) return;
+                if (data.version !== currentCharacterVersion + 1) {
+                    // Пропущен патч — берём лист целиком
+                    resyncCharacter();
+                    return;
+                }
+                try {
+                    lastSyncedData = applyJsonPatch(lastSyncedData, data.patch);
+                    currentCharacterData = applyJsonPatch(currentCharacterData, data.patch);
+                } catch (err) {
+                    resyncCharacter();
+                    return;
+                }
+                currentCharacterVersion = data.version;
+                refreshCharacterView();
+                if (data.updated_by !== parseInt(localStorage.getItem('user_id'))) {
                     showNotification('Данные персонажа обновлены', 'system', 'bottom-left');
                 }
             });
+            socket.off('character_patch_applied');
+            socket.on('character_patch_applied', (data) => onCharacterVersion(data.character_id, data.version));
         }
     } catch (error) {
         showNotification(error.message);
@@ -8689,6 +8824,7 @@ export function closeCharacterSheet() {
     document.getElementById('character-sheet-modal').style.display = 'none';
     currentCharacterId = null;
     currentCharacterData = null;
+    lastSyncedData = null;
     if (autoSaveTimer) clearTimeout(autoSaveTimer);
     autoSaveTimer = null;
     draggedItem = null;
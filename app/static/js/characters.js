@@ -10,7 +10,8 @@ export function initCharacters(lobbyId) {
 
 export async function loadLobbyCharacters() {
     try {
-        const characters = await Server.getLobbyCharacters(currentLobbyId);
+        // Для списка хватает имён; лист целиком загружается при открытии
+        const characters = await Server.getLobbyCharacters(currentLobbyId, true);
         displayLobbyCharacters(characters);
     } catch (error) {
         console.error('Error loading characters', error);
@@ -8,13 +8,22 @@ import { applyWeather } from './weather.js';
 
 let socket;
 let currentLobbyId;
+let lastMessageCursor = null;  // курсор последнего полученного сообщения чата
 
 export function initSocket(lobbyId, token) {
     currentLobbyId = lobbyId;
-    socket = io();
+    // Подключаемся после того, как узнаем воркер, обслуживающий комнату
+    socket = io({ autoConnect: false });
 
     socket.on('connect', () => {
-        socket.emit('authenticate', { token, lobby_id: lobbyId });
+        // После переподключения сервер пришлёт только пропущенные сообщения
+        socket.emit('authenticate', { token, lobby_id: lobbyId, since: lastMessageCursor });
+    });
+
+    // Комната обслуживается другим воркером (или переехала при перебалансировке)
+    socket.on('shard_redirect', (data) => {
+        socket.io.uri = data.url;
+        socket.disconnect().connect();
     });
 
     socket.on('authenticated', (data) => {
@@ -27,11 +36,8 @@ export function initSocket(lobbyId, token) {
     });
 
     socket.on('new_message', (data) => {
-        if (data.username.startsWith('System')) {
-            showNotification(data.message, 'system', 'bottom-left');
-        } else {
-            addMessage(data.username, data.message, data.timestamp);
-        }
+        if (data.cursor) lastMessageCursor = data.cursor;
+        showChatMessage(data);
     });
 
     socket.on('error', (data) => {
@@ -44,13 +50,17 @@ export function initSocket(lobbyId, token) {
     });
 
     socket.on('chat_history', (messages) => {
-        messages.forEach(msg => {
-            if (msg.username.startsWith('System')) {
-                showNotification(msg.message, 'system', 'bottom-left');
-            } else {
-                addMessage(msg.username, msg.message, msg.timestamp);
-            }
-        });
+        messages.forEach(showChatMessage);
+        if (messages.length) lastMessageCursor = messages[messages.length - 1].cursor;
+    });
+
+    socket.on('chat_history_page', (page) => {
+        if (page.direction !== 'newer') return;
+        page.messages.forEach(showChatMessage);
+        if (page.newer) lastMessageCursor = page.newer;
+        if (page.has_more) {
+            socket.emit('get_chat_history', { token, lobby_id: lobbyId, after: lastMessageCursor, limit: 100 });
+        }
     });
 
     socket.on('online_users', (userIds) => {
@@ -100,9 +110,33 @@ export function initSocket(lobbyId, token) {
         window.weatherSettings = settings;
     });
 
+    connectToLobbyShard(lobbyId, token);
     return socket;
 }
 
+function showChatMessage(msg) {
+    if (msg.username.startsWith('System')) {
+        showNotification(msg.message, 'system', 'bottom-left');
+    } else {
+        addMessage(msg.username, msg.message, msg.timestamp);
+    }
+}
+
+async function connectToLobbyShard(lobbyId, token) {
+    try {
+        const response = await fetch(`/lobbies/${lobbyId}/shard`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (response.ok) {
+            const data = await response.json();
+            if (data.url) socket.io.uri = data.url;
+        }
+    } catch (e) {
+        console.error('Failed to resolve lobby shard', e);
+    }
+    socket.connect();
+}
+
 export function sendMessage(message) {
     if (!socket) return;
     socket.emit('send_message', { token: localStorage.getItem('access_token'), lobby_id: currentLobbyId, message });
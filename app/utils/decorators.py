@@ -2,7 +2,7 @@
 from functools import wraps
 from flask import jsonify
 from flask_jwt_extended import get_jwt_identity
-from app.models import Lobby, LobbyParticipant
+from app.services.access import get_lobby_access
 from app.services.exceptions import NotFoundError, PermissionDenied
 
 def get_lobby_id_from_args(args, kwargs):
@@ -30,8 +30,9 @@ def requires_participant(f):
     """
     Декоратор, проверяющий, что текущий пользователь является участником комнаты.
     В декорируемую функцию передаются дополнительные аргументы:
-        lobby: объект Lobby
-        participant: объект LobbyParticipant
+        lobby: LobbyAccess из кэша прав (id, gm_id, is_active)
+        participant: ParticipantAccess (lobby_id, user_id, is_banned)
+    Полный объект Lobby (если нужен) обработчик загружает сам.
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -41,13 +42,11 @@ def requires_participant(f):
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
 
-        lobby = Lobby.query.get(lobby_id)
-        if not lobby or not lobby.is_active:
+        lobby = get_lobby_access(lobby_id)
+        if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
 
-        participant = LobbyParticipant.query.filter_by(
-            lobby_id=lobby_id, user_id=user_id
-        ).first()
+        participant = lobby.participant(user_id)
         if not participant:
             return jsonify({'error': 'You are not in this lobby'}), 403
         if participant.is_banned:
@@ -62,7 +61,7 @@ def requires_participant(f):
 def requires_gm(f):
     """
     Декоратор, проверяющий, что текущий пользователь является GM комнаты.
-    В декорируемую функцию передаётся дополнительный аргумент lobby.
+    В декорируемую функцию передаётся дополнительный аргумент lobby (LobbyAccess).
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -72,8 +71,8 @@ def requires_gm(f):
         except ValueError as e:
             return jsonify({'error': str(e)}), 400
 
-        lobby = Lobby.query.get(lobby_id)
-        if not lobby or not lobby.is_active:
+        lobby = get_lobby_access(lobby_id)
+        if not lobby:
             return jsonify({'error': 'Lobby not found'}), 404
 
         if lobby.gm_id != user_id:
@@ -1,30 +1,413 @@
 # app/utils/dice.py
+"""
+Движок бросков кубиков.
+
+Поддерживаемая нотация (регистр и пробелы не важны):
+- NdM, dM, d% (= d100); N — число кубиков (по умолчанию 1);
+- модификаторы кубиков: khN / kN — оставить N старших, klN — N младших,
+  dhN — отбросить N старших, dlN — N младших, ! — взрыв (максимум на кубике
+  добавляет в пул ещё один кубик, не больше EXPLODE_ROUNDS раз подряд);
+- числа, + - * / (деление целочисленное, с округлением вниз), унарный минус, скобки.
+Пример: (4d6kh3 + 2) * 2 - 1d4!
+
+parse_dice() компилирует выражение в дерево узлов и кэширует результат
+(одинаковые /roll разбираются один раз). Стоимость броска считается при
+компиляции, до вычисления: выражение дороже MAX_COST отклоняется.
+
+Кубики бросаются по одному, только пока их не больше DETAIL_LIMIT (тогда их
+видно в описании). Больший пул бросается через число выпадений каждой грани
+(последовательные биномиальные выборки): память и время O(M) вместо O(N),
+поэтому 100000000d6 стоит как шесть выборок, а не как сто миллионов кубиков.
+"""
+
 import random
 import re
+from functools import lru_cache
+from math import floor, log, lgamma, sqrt
+
+MAX_EXPRESSION_LENGTH = 200
+MAX_NODES = 50          # чисел, кубиков и операций в выражении
+MAX_DEPTH = 16          # вложенность скобок и унарных минусов
+MAX_DICE = 10 ** 9      # кубиков в одном броске NdM
+MAX_SIDES = 10 ** 6
+MAX_COST = 20000        # условных операций на бросок (см. Dice.cost)
+DETAIL_LIMIT = 100      # до стольких кубиков каждый бросается и показывается отдельно
+EXPLODE_ROUNDS = 20     # максимум взрывов подряд
+
+_TOKEN_RE = re.compile(r'\s*(?:(\d+)|(kh|kl|dh|dl|k|d|%|!|\(|\)|\+|-|\*|/))')
+
+
+class DiceError(ValueError):
+    """Ошибка в выражении броска (сообщение показывается пользователю)."""
+
+
+# ---- Узлы скомпилированного выражения ----
+
+class Number:
+    __slots__ = ('value',)
+    cost = 1
+
+    def __init__(self, value):
+        self.value = value
+
+    def roll(self, rng):
+        return self.value, str(self.value)
+
+
+class Group:
+    __slots__ = ('inner', 'cost')
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.cost = inner.cost
+
+    def roll(self, rng):
+        value, text = self.inner.roll(rng)
+        return value, f"({text})"
+
+
+class Negate:
+    __slots__ = ('operand', 'cost')
+
+    def __init__(self, operand):
+        self.operand = operand
+        self.cost = operand.cost + 1
+
+    def roll(self, rng):
+        value, text = self.operand.roll(rng)
+        return -value, f"-{text}"
+
+
+class BinaryOp:
+    __slots__ = ('op', 'left', 'right', 'cost')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+        self.cost = left.cost + right.cost + 1
+
+    def roll(self, rng):
+        left, left_text = self.left.roll(rng)
+        right, right_text = self.right.roll(rng)
+        if self.op == '+':
+            value = left + right
+        elif self.op == '-':
+            value = left - right
+        elif self.op == '*':
+            value = left * right
+        else:
+            if right == 0:
+                raise DiceError("Деление на ноль")
+            value = left // right
+        return value, f"{left_text} {self.op} {right_text}"
+
+
+class Dice:
+    """NdM с модификаторами keep/drop и взрывом."""
+    __slots__ = ('count', 'sides', 'keep', 'explode', 'cost')
+
+    def __init__(self, count, sides, keep=None, explode=False):
+        self.count = count
+        self.sides = sides
+        self.keep = keep          # ('kh'|'kl'|'dh'|'dl', n) или None
+        self.explode = explode
+        # Поштучно — по операции на кубик, через грани — по операции на грань
+        base = count if count <= DETAIL_LIMIT else sides
+        self.cost = base * (EXPLODE_ROUNDS + 1) if explode else base
+
+    @property
+    def notation(self):
+        text = f"{self.count}d{self.sides}"
+        if self.keep:
+            text += f"{self.keep[0]}{self.keep[1]}"
+        return text + ('!' if self.explode else '')
+
+    def roll(self, rng):
+        if self.count <= DETAIL_LIMIT:
+            return self._roll_each(rng)
+        return self._roll_counts(rng)
+
+    def _kept_count(self, pool_size):
+        mode, n = self.keep
+        if mode in ('kh', 'kl'):
+            return min(n, pool_size)
+        return max(0, pool_size - n)
+
+    def _roll_each(self, rng):
+        rolls = []   # (значение, взорвался)
+        pending = self.count
+        for round_ in range(EXPLODE_ROUNDS + 1):
+            exploded = 0
+            for _ in range(pending):
+                value = rng.randint(1, self.sides)
+                boom = self.explode and value == self.sides and round_ < EXPLODE_ROUNDS
+                rolls.append((value, boom))
+                exploded += boom
+            if not exploded:
+                break
+            pending = exploded
+
+        kept = [True] * len(rolls)
+        if self.keep:
+            mode, _ = self.keep
+            # kh/dl оставляют старшие, kl/dh — младшие
+            highest_first = mode in ('kh', 'dl')
+            order = sorted(range(len(rolls)), key=lambda i: rolls[i][0], reverse=highest_first)
+            keep_n = self._kept_count(len(rolls))
+            for i in order[keep_n:]:
+                kept[i] = False
+
+        total = sum(value for (value, _), keep in zip(rolls, kept) if keep)
+        parts = []
+        for (value, boom), keep in zip(rolls, kept):
+            text = f"{value}!" if boom else str(value)
+            parts.append(text if keep else f"~~{text}~~")
+        return total, f"{self.notation} [{', '.join(parts)}]"
+
+    def _roll_counts(self, rng):
+        counts = [0] * (self.sides + 1)   # counts[грань] — сколько раз выпала
+        pending = self.count
+        rolled = 0
+        for round_ in range(EXPLODE_ROUNDS + 1):
+            new = face_counts(pending, self.sides, rng)
+            for face in range(1, self.sides + 1):
+                counts[face] += new[face]
+            rolled += pending
+            if not self.explode or round_ == EXPLODE_ROUNDS or not new[self.sides]:
+                break
+            pending = new[self.sides]
+
+        if self.keep:
+            mode, _ = self.keep
+            keep_n = self._kept_count(rolled)
+            faces = range(self.sides, 0, -1) if mode in ('kh', 'dl') else range(1, self.sides + 1)
+            total = 0
+            for face in faces:
+                take = min(counts[face], keep_n)
+                total += take * face
+                keep_n -= take
+                if not keep_n:
+                    break
+        else:
+            total = sum(face * n for face, n in enumerate(counts))
+        extra = f", {rolled - self.count} взрыв." if rolled > self.count else ''
+        return total, f"{self.notation} [Σ {total}{extra}]"
+
+
+class DiceExpression:
+    """Скомпилированное выражение: roll() можно вызывать сколько угодно раз."""
+    __slots__ = ('source', 'root', 'cost')
+
+    def __init__(self, source, root):
+        self.source = source
+        self.root = root
+        self.cost = root.cost
+
+    def roll(self, rng=random):
+        """Возвращает (результат, расшифровка)."""
+        return self.root.roll(rng)
+
+
+# ---- Разбор ----
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+        self.nodes = 0
+
+    @staticmethod
+    def _tokenize(text):
+        tokens = []
+        pos = 0
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if not match:
+                raise DiceError(f"Непонятный символ «{text[pos]}»")
+            number, symbol = match.groups()
+            tokens.append(int(number) if number is not None else symbol)
+            pos = match.end()
+        return tokens
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def node(self, node):
+        self.nodes += 1
+        if self.nodes > MAX_NODES:
+            raise DiceError(f"Слишком длинное выражение (больше {MAX_NODES} элементов)")
+        return node
+
+    def parse(self):
+        if not self.tokens:
+            raise DiceError("Пустое выражение")
+        root = self.expression(0)
+        if self.peek() is not None:
+            raise DiceError(f"Лишнее «{self.peek()}» в выражении")
+        return root
+
+    def expression(self, depth):
+        left = self.term(depth)
+        while self.peek() in ('+', '-'):
+            op = self.take()
+            left = self.node(BinaryOp(op, left, self.term(depth)))
+        return left
+
+    def term(self, depth):
+        left = self.factor(depth)
+        while self.peek() in ('*', '/'):
+            op = self.take()
+            left = self.node(BinaryOp(op, left, self.factor(depth)))
+        return left
+
+    def factor(self, depth):
+        if depth > MAX_DEPTH:
+            raise DiceError("Слишком глубокая вложенность")
+        token = self.peek()
+        if token == '-':
+            self.take()
+            return self.node(Negate(self.factor(depth + 1)))
+        if token == '(':
+            self.take()
+            inner = self.expression(depth + 1)
+            if self.take() != ')':
+                raise DiceError("Не закрыта скобка")
+            return self.node(Group(inner))
+        if isinstance(token, int):
+            self.take()
+            if self.peek() == 'd':
+                return self.dice(token)
+            return self.node(Number(token))
+        if token == 'd':
+            return self.dice(1)
+        raise DiceError("Ожидалось число, кубик или скобка" if token is None else f"Неожиданное «{token}»")
+
+    def dice(self, count):
+        self.take()  # 'd'
+        sides = self.take()
+        if sides == '%':
+            sides = 100
+        if not isinstance(sides, int):
+            raise DiceError("После d нужно число граней")
+        if count < 1 or sides < 1:
+            raise DiceError("Количество и тип кубиков должны быть положительными")
+        if count > MAX_DICE:
+            raise DiceError(f"Не больше {MAX_DICE} кубиков за бросок")
+        if sides > MAX_SIDES:
+            raise DiceError(f"Не больше {MAX_SIDES} граней")
+
+        keep = None
+        explode = False
+        while self.peek() in ('k', 'kh', 'kl', 'dh', 'dl', '!'):
+            modifier = self.take()
+            if modifier == '!':
+                if sides < 2:
+                    raise DiceError("Взрываться может кубик хотя бы с двумя гранями")
+                explode = True
+                continue
+            if keep is not None:
+                raise DiceError("Можно указать только один модификатор k/d")
+            n = self.take()
+            if not isinstance(n, int):
+                raise DiceError(f"После {modifier} нужно число")
+            keep = ('kh' if modifier == 'k' else modifier, n)
+        return self.node(Dice(count, sides, keep, explode))
+
+
+@lru_cache(maxsize=1024)
+def _compile(source):
+    root = _Parser(source).parse()
+    if root.cost > MAX_COST:
+        raise DiceError("Слишком дорогой бросок: уменьшите число кубиков или граней")
+    return DiceExpression(source, root)
+
+
+def parse_dice(expression):
+    """Компилирует выражение (с кэшем). Бросает DiceError, если оно неверно или слишком дорогое."""
+    if not isinstance(expression, str):
+        raise DiceError("Выражение должно быть строкой")
+    source = ' '.join(expression.lower().split())
+    if len(source) > MAX_EXPRESSION_LENGTH:
+        raise DiceError(f"Выражение длиннее {MAX_EXPRESSION_LENGTH} символов")
+    return _compile(source)
+
+
+# ---- Выборки ----
+
+def face_counts(n, sides, rng=random):
+    """
+    Сколько раз выпала каждая грань при броске n кубиков dM (список, индекс — грань).
+    Точное распределение: число выпадений грани i — Bin(оставшиеся, 1/(M-i+1)).
+    """
+    counts = [0] * (sides + 1)
+    remaining = n
+    for face in range(1, sides):
+        hit = binomial(remaining, 1 / (sides - face + 1), rng)
+        counts[face] = hit
+        remaining -= hit
+        if not remaining:
+            break
+    counts[sides] += remaining
+    return counts
+
+
+def binomial(n, p, rng=random):
+    """Выборка из Bin(n, p) за O(1) в среднем (инверсия при малом n*p, иначе BTRS)."""
+    if n <= 0 or p <= 0:
+        return 0
+    if p >= 1:
+        return n
+    if p > 0.5:
+        return n - binomial(n, 1 - p, rng)
+    if n * p < 10:
+        # Число успехов = сколько геометрических прыжков уместилось в n испытаний
+        c = log(1 - p)
+        x = y = 0
+        while True:
+            y += floor(log(1 - rng.random()) / c) + 1
+            if y > n:
+                return x
+            x += 1
+    # BTRS (Hörmann, 1993)
+    spq = sqrt(n * p * (1 - p))
+    b = 1.15 + 2.53 * spq
+    a = -0.0873 + 0.0248 * b + 0.01 * p
+    c = n * p + 0.5
+    vr = 0.92 - 4.2 / b
+    alpha = (2.83 + 5.1 / b) * spq
+    lpq = log(p / (1 - p))
+    m = floor((n + 1) * p)
+    h = lgamma(m + 1) + lgamma(n - m + 1)
+    while True:
+        u = rng.random() - 0.5
+        v = rng.random()
+        us = 0.5 - abs(u)
+        k = floor((2 * a / us + b) * u + c)
+        if k < 0 or k > n:
+            continue
+        if us >= 0.07 and v <= vr:
+            return k
+        if v <= 0:
+            continue
+        v = log(v * alpha / (a / (us * us) + b))
+        if v <= h - lgamma(k + 1) - lgamma(n - k + 1) + (k - m) * lpq:
+            return k
 
 
 def roll_dice(expression):
     """
-    Парсит выражение вида 2d6+3, 1d20, d8 и т.д.
-    Возвращает кортеж (результат, описание_броска)
+    Бросает выражение (см. описание модуля), например 2d6+3, 4d6kh3, (1d8+2)*2.
+    Возвращает кортеж (результат, описание_броска); при ошибке — (None, текст ошибки).
     """
-    expression = expression.replace(' ', '').lower()
-    # Регулярное выражение для разбора: число d число (опционально +- число)
-    match = re.match(r'^(\d*)d(\d+)([+-]\d+)?$', expression)
-    if not match:
-        return None, "Неверный формат. Используйте /roll 2d6+3"
-
-    num_dice = int(match.group(1)) if match.group(1) else 1
-    dice_type = int(match.group(2))
-    modifier = int(match.group(3)) if match.group(3) else 0
-
-    if num_dice <= 0 or dice_type <= 0:
-        return None, "Количество и тип кубиков должны быть положительными"
-
-    rolls = [random.randint(1, dice_type) for _ in range(num_dice)]
-    total = sum(rolls) + modifier
-    rolls_str = '+'.join(map(str, rolls))
-    if modifier:
-        rolls_str = f"{rolls_str}{modifier:+d}"
-
-    return total, f"Бросок {num_dice}d{dice_type}{modifier:+d}: {rolls_str} = **{total}**"
\ No newline at end of file
+    try:
+        compiled = parse_dice(expression)
+        total, detail = compiled.roll()
+    except DiceError as e:
+        return None, f"{e}. Пример: /roll 2d6+3"
+    return total, f"Бросок {compiled.source}: {detail} = **{total}**"
@@ -0,0 +1,280 @@
+# app/utils/dice_stats.py
+"""
+Точные распределения выражений бросков (см. app/utils/dice.py).
+
+distribution() обходит скомпилированное дерево выражения и строит PMF
+каждого узла: сумма/разность — свёртка, NdM — свёртки возведением в
+степень (O(log N) свёрток), keep/drop — динамика по граням, взрыв —
+распределение одного кубика с хвостом до EXPLODE_ROUNDS взрывов (раунды
+с вероятностью меньше EXPLODE_EPSILON отбрасываются).
+
+Свёртки делает NumPy, если он установлен; без него — чистый Python
+с меньшим бюджетом работы. Динамика keep/drop всегда на чистом Python,
+у неё свой бюджет (MAX_KEEP_WORK) и предварительная оценка размера
+(MAX_KEEP_SIZE), не зависящие от NumPy. Результат кэшируется по
+нормализованному выражению, повторный запрос ничего не пересчитывает.
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+from math import comb, sqrt
+from .dice import parse_dice, DiceError, Number, Group, Negate, BinaryOp, EXPLODE_ROUNDS
+
+try:
+    import numpy
+except ImportError:  # NumPy необязателен
+    numpy = None
+
+MAX_SUPPORT = 20000               # значений в распределении (в том числе промежуточном)
+MAX_WORK = 2 * 10 ** 8 if numpy is not None else 5 * 10 ** 6   # умножений в свёртках на выражение
+MAX_KEEP_DICE = 100               # keep/drop считается динамикой, она дорогая
+MAX_KEEP_SIZE = 20000             # кубиков * граней * оставленных для одного keep/drop
+MAX_KEEP_WORK = 2 * 10 ** 6       # шагов динамики keep/drop на выражение (около секунды)
+EXPLODE_EPSILON = 1e-15
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class Distribution:
+    """PMF выражения: значения lo..lo+len(pmf)-1."""
+
+    def __init__(self, source, lo, pmf):
+        self.source = source
+        self.lo = lo
+        self.pmf = pmf
+        cdf, running = [], 0.0
+        for p in pmf:
+            running += p
+            cdf.append(min(running, 1.0))
+        self.cdf = cdf
+        values = range(lo, lo + len(pmf))
+        self.mean = sum(v * p for v, p in zip(values, pmf))
+        self.stdev = sqrt(max(0.0, sum((v - self.mean) ** 2 * p for v, p in zip(values, pmf))))
+        self.percentiles = {str(q): self.percentile(q) for q in PERCENTILES}
+        self._dict = None
+
+    @property
+    def hi(self):
+        return self.lo + len(self.pmf) - 1
+
+    def percentile(self, q):
+        """Наименьшее значение, для которого P(X <= value) >= q%."""
+        target = q / 100 - 1e-12
+        for i, c in enumerate(self.cdf):
+            if c >= target:
+                return self.lo + i
+        return self.hi
+
+    def at_most(self, value):
+        if value < self.lo:
+            return 0.0
+        if value >= self.hi:
+            return 1.0
+        return self.cdf[value - self.lo]
+
+    def at_least(self, value):
+        return max(0.0, 1.0 - self.at_most(value - 1))
+
+    def to_dict(self):
+        if self._dict is None:
+            self._dict = {
+                'expression': self.source,
+                'min': self.lo,
+                'max': self.hi,
+                'mean': round(self.mean, 6),
+                'stdev': round(self.stdev, 6),
+                'percentiles': self.percentiles,
+                'pmf': self.pmf,
+                'cdf': self.cdf
+            }
+        return self._dict
+
+
+def distribution(expression):
+    """Точное распределение выражения (с кэшем). Бросает DiceError."""
+    return _distribution(parse_dice(expression).source)
+
+
+@lru_cache(maxsize=256)
+def _distribution(source):
+    root = parse_dice(source).root
+    _check_support(root)
+    lo, pmf = _Analyzer().pmf(root)
+    return Distribution(source, lo, [float(p) for p in pmf])
+
+
+def _check_support(node):
+    """Границы значений узла без вычислений: отклоняет слишком широкие распределения заранее."""
+    if isinstance(node, Number):
+        lo = hi = node.value
+    elif isinstance(node, Group):
+        lo, hi = _check_support(node.inner)
+    elif isinstance(node, Negate):
+        inner_lo, inner_hi = _check_support(node.operand)
+        lo, hi = -inner_hi, -inner_lo
+    elif isinstance(node, BinaryOp):
+        a_lo, a_hi = _check_support(node.left)
+        b_lo, b_hi = _check_support(node.right)
+        if node.op == '+':
+            lo, hi = a_lo + b_lo, a_hi + b_hi
+        elif node.op == '-':
+            lo, hi = a_lo - b_hi, a_hi - b_lo
+        else:
+            # Для * и / достаточно грубой оценки по модулю
+            bound = max(abs(a_lo), abs(a_hi)) * (max(abs(b_lo), abs(b_hi)) if node.op == '*' else 1)
+            lo, hi = -bound, bound
+    else:
+        kept = node.count if node.keep is None else _kept(node)
+        if node.keep is not None and node.explode:
+            raise DiceError("Распределение для keep/drop вместе со взрывом не считается")
+        if node.keep is not None and node.count > MAX_KEEP_DICE:
+            raise DiceError(f"Распределение keep/drop считается не больше чем для {MAX_KEEP_DICE} кубиков")
+        if node.keep is not None and node.count * node.sides * kept > MAX_KEEP_SIZE:
+            raise DiceError("Распределение keep/drop слишком дорого считать")
+        lo, hi = kept, kept * node.sides * (_explode_rounds(node.sides) if node.explode else 1)
+    if hi - lo + 1 > MAX_SUPPORT:
+        raise DiceError(f"Слишком широкое распределение (больше {MAX_SUPPORT} значений)")
+    return lo, hi
+
+
+def _kept(node):
+    mode, n = node.keep
+    return min(n, node.count) if mode in ('kh', 'kl') else max(0, node.count - n)
+
+
+def _explode_rounds(sides):
+    """Сколько раундов взрыва учитывать: дальше вероятность меньше EXPLODE_EPSILON."""
+    rounds, p = 1, 1.0 / sides
+    while rounds <= EXPLODE_ROUNDS and p >= EXPLODE_EPSILON:
+        rounds += 1
+        p /= sides
+    return rounds
+
+
+class _Analyzer:
+    def __init__(self):
+        self.work = 0
+        self.keep_work = 0
+
+    def spend(self, amount):
+        self.work += amount
+        if self.work > MAX_WORK:
+            raise DiceError("Распределение слишком дорого считать")
+
+    def spend_keep(self, amount):
+        self.keep_work += amount
+        if self.keep_work > MAX_KEEP_WORK:
+            raise DiceError("Распределение keep/drop слишком дорого считать")
+
+    def pmf(self, node):
+        if isinstance(node, Number):
+            return node.value, [1.0]
+        if isinstance(node, Group):
+            return self.pmf(node.inner)
+        if isinstance(node, Negate):
+            return _negate(self.pmf(node.operand))
+        if isinstance(node, BinaryOp):
+            left, right = self.pmf(node.left), self.pmf(node.right)
+            if node.op == '+':
+                return self.add(left, right)
+            if node.op == '-':
+                return self.add(left, _negate(right))
+            return self.combine(left, right, node.op)
+        return self.dice(node)
+
+    def convolve(self, a, b):
+        self.spend(len(a) * len(b))
+        if numpy is not None:
+            return numpy.convolve(a, b).tolist()
+        out = [0.0] * (len(a) + len(b) - 1)
+        for i, pa in enumerate(a):
+            if pa:
+                for j, pb in enumerate(b):
+                    out[i + j] += pa * pb
+        return out
+
+    def add(self, a, b):
+        return a[0] + b[0], self.convolve(a[1], b[1])
+
+    def combine(self, a, b, op):
+        """Произведение / целочисленное деление — перебором пар значений."""
+        self.spend(len(a[1]) * len(b[1]))
+        result = defaultdict(float)
+        for i, pa in enumerate(a[1]):
+            if not pa:
+                continue
+            x = a[0] + i
+            for j, pb in enumerate(b[1]):
+                if not pb:
+                    continue
+                y = b[0] + j
+                if op == '/' and y == 0:
+                    raise DiceError("Деление на ноль возможно")
+                result[x * y if op == '*' else x // y] += pa * pb
+        lo, hi = min(result), max(result)
+        if hi - lo + 1 > MAX_SUPPORT:
+            raise DiceError(f"Слишком широкое распределение (больше {MAX_SUPPORT} значений)")
+        return lo, [result.get(v, 0.0) for v in range(lo, hi + 1)]
+
+    def dice(self, node):
+        if node.keep is not None:
+            return self.keep(node)
+        single = _exploding_die(node.sides) if node.explode else (1, [1.0 / node.sides] * node.sides)
+        return self.power(single, node.count)
+
+    def power(self, single, n):
+        result, base = (0, [1.0]), single
+        while n:
+            if n & 1:
+                result = self.add(result, base)
+            n >>= 1
+            if n:
+                base = self.add(base, base)
+        return result
+
+    def keep(self, node):
+        """Сумма k старших (или младших) из N кубиков: динамика по граням, от крайней."""
+        mode, _ = node.keep
+        n, m = node.count, node.sides
+        k = _kept(node)
+        highest = mode in ('kh', 'dl')
+        faces = range(m, 0, -1) if highest else range(1, m + 1)
+        states = {(0, 0): 1.0}   # (кубиков распределено, сумма оставленных) -> вероятность
+        for step, face in enumerate(faces):
+            # Оставшиеся кубики равномерны на ещё не пройденных гранях
+            q = 1.0 / (m - step)
+            new = defaultdict(float)
+            for (assigned, total), p in states.items():
+                rest = n - assigned
+                self.spend_keep(rest + 1)
+                taken_before = min(assigned, k)
+                # Сколько из оставшихся кубиков выпало этой гранью: Bin(rest, q); на последней — все
+                counts = [(rest, 1.0)] if q == 1.0 else \
+                    [(c, comb(rest, c) * q ** c * (1 - q) ** (rest - c)) for c in range(rest + 1)]
+                for c, pc in counts:
+                    take = min(c, k - taken_before)
+                    new[(assigned + c, total + take * face)] += p * pc
+            states = new
+        sums = defaultdict(float)
+        for (_, total), p in states.items():
+            sums[total] += p
+        lo, hi = min(sums), max(sums)
+        return lo, [sums.get(v, 0.0) for v in range(lo, hi + 1)]
+
+
+def _negate(dist):
+    lo, pmf = dist
+    return -(lo + len(pmf) - 1), pmf[::-1]
+
+
+def _exploding_die(sides):
+    """PMF одного взрывающегося кубика: r взрывов дают sides*r + x."""
+    rounds = _explode_rounds(sides)
+    pmf = [0.0] * (sides * rounds)
+    p = 1.0 / sides
+    for r in range(rounds):
+        last = r == rounds - 1
+        # В последнем учтённом раунде максимум уже не взрывается
+        for x in range(1, sides + 1 if last else sides):
+            pmf[sides * r + x - 1] = p
+        p /= sides
+    return 1, pmf
@@ -0,0 +1,153 @@
+# app/utils/json_patch.py
+"""
+JSON Patch (RFC 6902) поверх JSON Pointer (RFC 6901).
+
+Операции: add, remove, replace, move, copy, test. Патч применяется к копии
+документа целиком: если любая операция не проходит, исходный документ не
+меняется (JsonPatchError с номером операции).
+"""
+
+import copy
+
+MAX_OPERATIONS = 500
+
+
+class JsonPatchError(ValueError):
+    """Некорректный патч или операция, которую нельзя применить к документу."""
+
+
+def parse_pointer(pointer):
+    """'/a/b~1c/0' -> ['a', 'b/c', '0']; '' — весь документ."""
+    if not isinstance(pointer, str):
+        raise JsonPatchError("Path must be a string")
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise JsonPatchError(f"Invalid path '{pointer}'")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _array_index(container, token, allow_end=False):
+    if allow_end and token == '-':
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token[0] == '0'):
+        raise JsonPatchError(f"Invalid array index '{token}'")
+    index = int(token)
+    limit = len(container) if allow_end else len(container) - 1
+    if index > limit:
+        raise JsonPatchError(f"Array index {index} out of range")
+    return index
+
+
+def _walk(doc, tokens):
+    node = doc
+    for token in tokens:
+        if isinstance(node, dict):
+            if token not in node:
+                raise JsonPatchError(f"Path not found: '{token}'")
+            node = node[token]
+        elif isinstance(node, list):
+            node = node[_array_index(node, token)]
+        else:
+            raise JsonPatchError(f"Cannot descend into scalar at '{token}'")
+    return node
+
+
+def _get(doc, tokens):
+    return _walk(doc, tokens)
+
+
+def _add(doc, tokens, value):
+    if not tokens:
+        return value
+    parent = _walk(doc, tokens[:-1])
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, key, allow_end=True), value)
+    else:
+        raise JsonPatchError(f"Cannot add to scalar at '{key}'")
+    return doc
+
+
+def _remove(doc, tokens):
+    if not tokens:
+        raise JsonPatchError("Cannot remove the whole document")
+    parent = _walk(doc, tokens[:-1])
+    key = tokens[-1]
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchError(f"Path not found: '{key}'")
+        return parent.pop(key)
+    if isinstance(parent, list):
+        return parent.pop(_array_index(parent, key))
+    raise JsonPatchError(f"Cannot remove from scalar at '{key}'")
+
+
+def _replace(doc, tokens, value):
+    if not tokens:
+        return value
+    _remove(doc, tokens)
+    return _add(doc, tokens, value)
+
+
+def _equal(a, b):
+    """Сравнение по правилам JSON: true и 1 — разные значения."""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_equal(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_equal(x, y) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)):
+        return a == b
+    return type(a) is type(b) and a == b
+
+
+def apply_patch(document, patch):
+    """Возвращает новый документ с применённым патчем (исходный не меняется)."""
+    if not isinstance(patch, list):
+        raise JsonPatchError("Patch must be a list of operations")
+    if len(patch) > MAX_OPERATIONS:
+        raise JsonPatchError(f"Patch is limited to {MAX_OPERATIONS} operations")
+
+    doc = copy.deepcopy(document)
+    for number, operation in enumerate(patch):
+        try:
+            doc = _apply_operation(doc, operation)
+        except JsonPatchError as e:
+            raise JsonPatchError(f"Operation {number}: {e}")
+    return doc
+
+
+def _apply_operation(doc, operation):
+    if not isinstance(operation, dict):
+        raise JsonPatchError("Operation must be an object")
+    op = operation.get('op')
+    tokens = parse_pointer(operation.get('path'))
+
+    if op in ('add', 'replace', 'test'):
+        if 'value' not in operation:
+            raise JsonPatchError(f"'{op}' requires a value")
+        value = operation['value']
+        if op == 'add':
+            return _add(doc, tokens, copy.deepcopy(value))
+        if op == 'replace':
+            return _replace(doc, tokens, copy.deepcopy(value))
+        if not _equal(_get(doc, tokens), value):
+            raise JsonPatchError(f"Test failed at '{operation['path']}'")
+        return doc
+    if op == 'remove':
+        _remove(doc, tokens)
+        return doc
+    if op in ('move', 'copy'):
+        source = parse_pointer(operation.get('from'))
+        if op == 'move':
+            if tokens[:len(source)] == source and len(tokens) > len(source):
+                raise JsonPatchError("Cannot move a value into its own child")
+            value = _remove(doc, source) if source else doc
+        else:
+            value = copy.deepcopy(_get(doc, source))
+        return _add(doc, tokens, value)
+    raise JsonPatchError(f"Unknown operation '{op}'")
@@ -0,0 +1,75 @@
+# app/utils/shutdown.py
+"""
+Сброс буферов при остановке процесса.
+
+Буферы с отложенной записью (чат — app.sockets.ingest, листы персонажей —
+app.sockets.character_edits) регистрируют сброс через on_shutdown().
+install() вызывает зарегистрированное один раз: при обычном выходе (atexit)
+и по SIGTERM/SIGINT — atexit при остановке сигналом не срабатывает, а воркеры
+останавливают именно так. После сброса вызывается прежний обработчик сигнала
+(сервера или по умолчанию), так что процесс завершается как обычно.
+"""
+
+import atexit
+import logging
+import os
+import signal
+import threading
+
+logger = logging.getLogger(__name__)
+
+SHUTDOWN_TIMEOUT = 10   # сек на сброс буферов по сигналу
+
+_callbacks = []
+_lock = threading.Lock()
+_done = False
+_installed = False
+
+
+def on_shutdown(callback):
+    """callback() будет вызван один раз при остановке процесса."""
+    _callbacks.append(callback)
+
+
+def run_shutdown():
+    """Вызывает зарегистрированные сбросы (повторный вызов ничего не делает)."""
+    global _done
+    with _lock:
+        if _done:
+            return
+        _done = True
+    for callback in _callbacks:
+        try:
+            callback()
+        except Exception:
+            logger.exception(f"Shutdown callback {callback!r} failed")
+
+
+def _handle_signal(signum, frame, previous):
+    logger.info(f"Signal {signum}: flushing buffers before exit")
+    # Сброс в отдельном потоке: сигнал мог прервать главный поток, пока тот держит
+    # блокировку буфера, — ждём не дольше SHUTDOWN_TIMEOUT вместо взаимоблокировки
+    worker = threading.Thread(target=run_shutdown, daemon=True)
+    worker.start()
+    worker.join(SHUTDOWN_TIMEOUT)
+    if callable(previous):
+        previous(signum, frame)
+    elif previous != signal.SIG_IGN:
+        signal.signal(signum, signal.SIG_DFL)
+        os.kill(os.getpid(), signum)
+
+
+def install():
+    """Подключает сброс к atexit и SIGTERM/SIGINT (один раз на процесс)."""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    atexit.register(run_shutdown)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            previous = signal.getsignal(signum)
+            signal.signal(signum, lambda s, f, previous=previous: _handle_signal(s, f, previous))
+        except ValueError:
+            # Сигналы ставятся только из главного потока (например, приложение создано в потоке)
+            logger.warning(f"Signal {signum} handler not installed: not in the main thread")
@@ -0,0 +1,238 @@
+# benchmarks/socket_bench.py
+"""
+Нагрузочное сравнение режимов сервера Socket.IO (SOCKETIO_ASYNC_MODE).
+
+Для каждого режима запускается run.py на отдельной SQLite-базе, затем:
+1. подключаются --clients сокетов (все в одной комнате), считается, сколько
+   успели пройти authenticate за --connect-timeout;
+2. --senders клиентов параллельно шлют send_message и move_marker, время
+   события — от emit до получения собственной рассылки (new_message /
+   marker_moved), то есть с записью в БД и fan-out на всю комнату.
+
+Запуск из корня репозитория:
+    python benchmarks/socket_bench.py --modes threading,eventlet --clients 200
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import socketio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def prepare_database(db_path):
+    """Создаёт таблицы в отдельном процессе (без monkey patching)."""
+    code = (
+        "from app import create_app\n"
+        "from app.extensions import db\n"
+        "app = create_app('development')\n"
+        "with app.app_context(): db.create_all()\n"
+    )
+    subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(db_path), check=True,
+                   env=dict(os.environ, DEV_DATABASE_URL=f'sqlite:///{db_path}', PYTHONPATH=ROOT))
+
+
+def start_server(mode, port, workdir):
+    env = dict(os.environ,
+               SOCKETIO_ASYNC_MODE=mode,
+               PORT=str(port),
+               DEV_DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+               PYTHONPATH=ROOT,
+               # Бенчмарк меряет сервер, а не лимиты частоты (app/sockets/ratelimit.py)
+               SOCKET_RATE_LIMITS=json.dumps({'send_message': None, 'move_marker': None, 'add_marker': None}))
+    env.pop('BROKER_URL', None)
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'run.py')], cwd=workdir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    base = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(base + '/', timeout=1)
+            return process, base
+        except requests.RequestException:
+            time.sleep(0.3)
+    stop_server(process)
+    raise RuntimeError(f'Server in {mode} mode did not start')
+
+
+def stop_server(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def seed(base):
+    """Создаёт GM и комнату. Возвращает (token, lobby_id)."""
+    name = 'bench' + uuid.uuid4().hex[:8]
+    requests.post(base + '/auth/register', json={'username': name, 'email': name + '@bench.local', 'password': 'bench123'})
+    token = requests.post(base + '/auth/login', json={'username': name, 'password': 'bench123'}).json()['access_token']
+    lobby = requests.post(base + '/lobbies/', json={'name': 'bench'}, headers={'Authorization': f'Bearer {token}'}).json()
+    return token, lobby['id']
+
+
+class BenchClient:
+    def __init__(self, base, token, lobby_id):
+        self.base = base
+        self.token = token
+        self.lobby_id = lobby_id
+        self.sio = socketio.Client(reconnection=False)
+        self.authenticated = threading.Event()
+        self._waiters = {}   # ключ события -> threading.Event
+        self._added = {}     # имя маркера -> id
+        self.marker_id = None
+        self.sio.on('authenticated', lambda data: self.authenticated.set())
+        self.sio.on('new_message', self._on_message)
+        self.sio.on('marker_moved', self._on_marker_moved)
+        self.sio.on('marker_added', self._on_marker_added)
+
+    def connect(self, timeout):
+        self.sio.connect(self.base, transports=['polling'], wait_timeout=timeout)
+        self.sio.emit('authenticate', {'token': self.token, 'lobby_id': self.lobby_id})
+        return self.authenticated.wait(timeout)
+
+    def disconnect(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+    def _on_message(self, data):
+        self._release(('msg', data.get('message')))
+
+    def _on_marker_moved(self, data):
+        self._release(('move', data['id'], data['position'].get('x')))
+
+    def _on_marker_added(self, data):
+        self._added[data.get('name')] = data.get('id')
+        self._release(('add', data.get('name')))
+
+    def _release(self, key):
+        event = self._waiters.get(key)
+        if event is not None:
+            event.set()
+
+    def timed(self, key, event_name, payload, timeout=10):
+        event = self._waiters[key] = threading.Event()
+        started = time.perf_counter()
+        self.sio.emit(event_name, payload)
+        ok = event.wait(timeout)
+        del self._waiters[key]
+        return (time.perf_counter() - started) * 1000 if ok else None
+
+    def add_marker(self):
+        name = 'bench-' + uuid.uuid4().hex
+        self.timed(('add', name), 'add_marker', {'lobby_id': self.lobby_id, 'marker': {'type': 'poi', 'name': name}})
+        self.marker_id = self._added.get(name)
+
+
+def run_senders(clients, events):
+    """Параллельные send_message и move_marker. Возвращает латентности (мс) и число потерь."""
+    chat, move, lost = [], [], [0]
+    lock = threading.Lock()
+
+    def work(client):
+        client.add_marker()
+        for i in range(events):
+            text = f'bench {uuid.uuid4().hex}'
+            latency = client.timed(('msg', text), 'send_message', {'lobby_id': client.lobby_id, 'message': text})
+            x = i + 1
+            latency_move = client.timed(('move', client.marker_id, x), 'move_marker', {
+                'lobby_id': client.lobby_id, 'marker_id': client.marker_id, 'position': {'x': x, 'y': 0, 'z': 0}
+            })
+            with lock:
+                for value, bucket in ((latency, chat), (latency_move, move)):
+                    if value is None:
+                        lost[0] += 1
+                    else:
+                        bucket.append(value)
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        list(pool.map(work, clients))
+    return chat, move, lost[0]
+
+
+def bench_mode(mode, args, port):
+    workdir = tempfile.mkdtemp(prefix=f'ttrpg-bench-{mode}-')
+    prepare_database(os.path.join(workdir, 'bench.db'))
+    process, base = start_server(mode, port, workdir)
+    clients = []
+    try:
+        token, lobby_id = seed(base)
+        started = time.perf_counter()
+
+        def connect(_):
+            client = BenchClient(base, token, lobby_id)
+            try:
+                ok = client.connect(args.connect_timeout)
+            except Exception:
+                ok = False
+            return client, ok
+
+        with ThreadPoolExecutor(max_workers=min(64, args.clients)) as pool:
+            results = list(pool.map(connect, range(args.clients)))
+        connect_time = time.perf_counter() - started
+        clients = [client for client, ok in results]
+        connected = [client for client, ok in results if ok]
+
+        senders = connected[:args.senders]
+        chat, move, lost = run_senders(senders, args.events) if senders else ([], [], 0)
+        return {
+            'mode': mode,
+            'connected': len(connected),
+            'connect_s': connect_time,
+            'chat_p50': percentile(chat, 50), 'chat_p99': percentile(chat, 99),
+            'move_p50': percentile(move, 50), 'move_p99': percentile(move, 99),
+            'lost': lost,
+        }
+    finally:
+        for client in clients:
+            client.disconnect()
+        stop_server(process)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Socket.IO async modes')
+    parser.add_argument('--modes', default='threading,eventlet')
+    parser.add_argument('--clients', type=int, default=200, help='connected sockets per mode')
+    parser.add_argument('--senders', type=int, default=10, help='sockets sending events concurrently')
+    parser.add_argument('--events', type=int, default=50, help='events of each type per sender')
+    parser.add_argument('--connect-timeout', type=float, default=15)
+    parser.add_argument('--port', type=int, default=5300)
+    args = parser.parse_args()
+
+    rows = []
+    for offset, mode in enumerate(args.modes.split(',')):
+        print(f'== {mode}', flush=True)
+        rows.append(bench_mode(mode.strip(), args, args.port + offset))
+
+    print(f"\n{'mode':<10} {'sockets':>9} {'connect,s':>10} {'chat p50':>9} {'chat p99':>9} "
+          f"{'move p50':>9} {'move p99':>9} {'lost':>5}")
+    for row in rows:
+        print(f"{row['mode']:<10} {row['connected']:>4}/{args.clients:<4} {row['connect_s']:>10.2f} "
+              f"{row['chat_p50']:>9.1f} {row['chat_p99']:>9.1f} {row['move_p50']:>9.1f} {row['move_p99']:>9.1f} "
+              f"{row['lost']:>5}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,33 @@
 import os
+
+# Кооперативный режим (eventlet/gevent): monkey patching должен пройти
+# до импорта приложения, SQLAlchemy и драйвера БД
+ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+if ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+if ASYNC_MODE in ('eventlet', 'gevent'):
+    # psycopg2 — C-расширение, monkey patching его не касается: без psycogreen
+    # каждый запрос к PostgreSQL блокирует весь процесс
+    try:
+        if ASYNC_MODE == 'eventlet':
+            from psycogreen.eventlet import patch_psycopg
+        else:
+            from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError:
+        import warnings
+        warnings.warn('psycogreen is not installed: PostgreSQL queries will block the event loop')
+
 from app import create_app, socketio
 
 app = create_app(os.getenv('FLASK_ENV') or 'development')
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # allow_unsafe_werkzeug: в режиме threading сервер — Werkzeug (dev-сервер, запуск без TTY)
+    socketio.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)), debug=True,
+                 allow_unsafe_werkzeug=True)
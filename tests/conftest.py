@@ -0,0 +1,31 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Конфигурация читает окружение при импорте app.config: БД задаём до импорта приложения
+os.environ['DEV_DATABASE_URL'] = 'sqlite://'
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app
+    from app.extensions import db
+    app = create_app('development')
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def db_session(app):
+    from app.extensions import db
+    yield db.session
+    db.session.rollback()
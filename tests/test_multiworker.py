@@ -0,0 +1,163 @@
+# tests/test_multiworker.py
+"""
+Несколько воркеров на одной машине через локальный брокер (app.backends.broker).
+
+Брокер запускается в потоке теста, два воркера — отдельными процессами с общей
+SQLite-базой и BROKER_URL (состояние Socket.IO и присутствия у каждого процесса
+своё, как в продакшене). Клиенты подключаются к разным воркерам.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+import socketio
+
+from app.backends.broker import BrokerServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TIMEOUT = 10
+
+WORKER_SCRIPT = """
+import os
+from app import create_app, socketio
+from app.extensions import db
+app = create_app('development')
+with app.app_context():
+    db.create_all()
+socketio.run(app, host='127.0.0.1', port=int(os.environ['PORT']), debug=False, use_reloader=False,
+             allow_unsafe_werkzeug=True)
+"""
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url, process):
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Worker exited with code {process.returncode}")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Worker at {url} did not start")
+
+
+@pytest.fixture
+def cluster(tmp_path):
+    broker = BrokerServer(('127.0.0.1', 0))
+    threading.Thread(target=broker.serve_forever, daemon=True).start()
+    broker_url = f"broker://127.0.0.1:{broker.server_address[1]}"
+
+    workers = []
+    try:
+        for name in ('a', 'b'):
+            port = _free_port()
+            env = dict(os.environ, PORT=str(port), BROKER_URL=broker_url,
+                       DEV_DATABASE_URL=f"sqlite:///{tmp_path / 'cluster.db'}", PYTHONPATH=ROOT)
+            env.pop('WORKER_URL', None)
+            process = subprocess.Popen([sys.executable, '-c', WORKER_SCRIPT], cwd=tmp_path, env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            workers.append((f"http://127.0.0.1:{port}", process))
+            # Второй воркер стартует после того, как первый создал таблицы
+            _wait_http(workers[-1][0], process)
+        yield [url for url, _ in workers]
+    finally:
+        for _, process in workers:
+            process.terminate()
+        for _, process in workers:
+            try:
+                process.wait(TIMEOUT)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        broker.shutdown()
+        broker.server_close()
+
+
+def _register(url, name):
+    requests.post(f"{url}/auth/register",
+                  json={'username': name, 'email': f'{name}@example.com', 'password': 'secret1'})
+    reply = requests.post(f"{url}/auth/login", json={'username': name, 'password': 'secret1'}).json()
+    return reply['access_token'], reply['user_id']
+
+
+class _Client:
+    """Socket.IO-клиент, который копит полученные события."""
+
+    def __init__(self, url):
+        self.events = []
+        self.changed = threading.Condition()
+        self.disconnected = threading.Event()
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('*', self._record)
+        self.sio.on('disconnect', lambda *args: self.disconnected.set())
+        self.sio.connect(url, transports=['polling'])
+
+    def _record(self, event, *args):
+        with self.changed:
+            self.events.append((event, args[0] if args else None))
+            self.changed.notify_all()
+
+    def wait_for(self, event, predicate=lambda data: True):
+        deadline = time.time() + TIMEOUT
+        with self.changed:
+            while True:
+                for name, data in self.events:
+                    if name == event and predicate(data):
+                        return data
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise AssertionError(f"No {event} event, got {[name for name, _ in self.events]}")
+                self.changed.wait(remaining)
+
+    def close(self):
+        if self.sio.connected:
+            self.sio.disconnect()
+
+
+def test_workers_share_chat_presence_and_bans(cluster):
+    url_a, url_b = cluster
+    gm_token, gm_id = _register(url_a, 'gmuser')
+    player_token, player_id = _register(url_b, 'player')
+
+    lobby = requests.post(f"{url_a}/lobbies/", json={'name': 'Cluster'},
+                          headers={'Authorization': f'Bearer {gm_token}'}).json()
+    reply = requests.post(f"{url_b}/lobbies/join_by_code", json={'code': lobby['invite_code']},
+                          headers={'Authorization': f'Bearer {player_token}'})
+    assert reply.status_code == 200
+
+    gm, player = _Client(url_a), _Client(url_b)
+    try:
+        gm.sio.emit('authenticate', {'token': gm_token, 'lobby_id': lobby['id']})
+        gm.wait_for('authenticated')
+        player.sio.emit('authenticate', {'token': player_token, 'lobby_id': lobby['id']})
+        player.wait_for('authenticated')
+
+        # Присутствие общее: игрок на воркере b видит ГМ с воркера a, ГМ получает user_joined
+        online = player.wait_for('online_users')
+        assert {gm_id, player_id} <= set(online)
+        gm.wait_for('user_joined', lambda data: data['user_id'] == player_id)
+
+        # Сообщение, отправленное на воркер b, доходит до клиента воркера a
+        player.sio.emit('send_message', {'token': player_token, 'lobby_id': lobby['id'], 'message': 'hello'})
+        gm.wait_for('new_message', lambda data: data.get('message') == 'hello')
+
+        # Бан на воркере a отключает сокет игрока на воркере b
+        reply = requests.post(f"{url_a}/lobbies/{lobby['id']}/ban/{player_id}",
+                              headers={'Authorization': f'Bearer {gm_token}'})
+        assert reply.status_code == 200
+        assert player.disconnected.wait(TIMEOUT)
+    finally:
+        gm.close()
+        player.close()
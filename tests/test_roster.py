@@ -0,0 +1,97 @@
+# tests/test_roster.py
+"""Ростер комнаты (ParticipantService.get_roster) — фиксированное число запросов."""
+
+import itertools
+
+import pytest
+from sqlalchemy import event
+
+from app.extensions import db
+from app.models import User, Lobby, LobbyParticipant, LobbyCharacter, CharacterViewer
+from app.services.participant import ParticipantService
+
+_ids = itertools.count(1)
+
+
+def _user():
+    n = next(_ids)
+    user = User(username=f'user{n}', email=f'user{n}@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def _lobby(players, characters_per_player):
+    """Комната с ГМ и players игроками; у каждого игрока characters_per_player персонажей."""
+    gm = _user()
+    lobby = Lobby(name='L', gm_id=gm.id, invite_code=f'code{next(_ids)}')
+    db.session.add(lobby)
+    db.session.flush()
+    db.session.add(LobbyParticipant(lobby_id=lobby.id, user_id=gm.id))
+    users = [_user() for _ in range(players)]
+    for user in users:
+        db.session.add(LobbyParticipant(lobby_id=lobby.id, user_id=user.id))
+        for i in range(characters_per_player):
+            character = LobbyCharacter(lobby_id=lobby.id, owner_id=user.id, name=f'{user.username}-{i}',
+                                       data={'skills': {'stealth': i}}, visible_to=[])
+            db.session.add(character)
+            db.session.flush()
+            # Персонажей первого игрока видят все
+            if user is users[0]:
+                for other in users[1:]:
+                    db.session.add(CharacterViewer(character_id=character.id, user_id=other.id))
+    db.session.commit()
+    return lobby, gm, users
+
+
+def _count_queries(fn):
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        result = fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return len(statements), result
+
+
+def _roster_queries(lobby_id, user_id):
+    ParticipantService.get_roster(lobby_id, user_id)   # прогрев кэша доступа и индекса видимости
+    db.session.expire_all()
+    return _count_queries(lambda: ParticipantService.get_roster(lobby_id, user_id))
+
+
+@pytest.mark.parametrize('viewer', ['gm', 'player'])
+def test_roster_query_count_does_not_grow(db_session, viewer):
+    small, small_gm, small_users = _lobby(players=1, characters_per_player=1)
+    large, large_gm, large_users = _lobby(players=20, characters_per_player=3)
+
+    if viewer == 'gm':
+        small_viewer, large_viewer = small_gm.id, large_gm.id
+    else:
+        small_viewer, large_viewer = small_users[-1].id, large_users[-1].id
+
+    small_count, small_roster = _roster_queries(small.id, small_viewer)
+    large_count, large_roster = _roster_queries(large.id, large_viewer)
+
+    assert len(small_roster) == 2
+    assert len(large_roster) == 21
+    assert small_count == large_count
+    assert large_count <= 2
+
+
+def test_roster_respects_visibility(db_session):
+    lobby, gm, users = _lobby(players=3, characters_per_player=2)
+
+    gm_roster = {entry['user_id']: entry for entry in ParticipantService.get_roster(lobby.id, gm.id)}
+    assert all(len(gm_roster[u.id]['characters']) == 2 for u in users)
+
+    viewer = users[-1]
+    roster = {entry['user_id']: entry for entry in ParticipantService.get_roster(lobby.id, viewer.id)}
+    assert len(roster[users[0].id]['characters']) == 2   # общие
+    assert roster[users[1].id]['characters'] == []       # чужие скрытые
+    assert len(roster[viewer.id]['characters']) == 2     # свои
+    assert roster[gm.id]['is_gm'] is True
@@ -0,0 +1,181 @@
+# tests/test_template_search.py
+"""Поиск шаблонов (TemplateSearchService): фильтры и пагинация курсором по глобальным и локальным."""
+
+import itertools
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from app.extensions import db
+from app.models import User, Lobby
+from app.models.templates import ItemTemplate
+from app.models.lobby_templates import LobbyItemTemplate
+from app.services.exceptions import ValidationError
+from app.services.template_search import TemplateSearchService
+from app.services.templates import LOCAL_TEMPLATE_OFFSET
+
+_ids = itertools.count(1)
+
+
+@pytest.fixture
+def lobby(db_session):
+    n = next(_ids)
+    gm = User(username=f'searcher{n}', email=f'searcher{n}@example.com', password_hash='x')
+    db.session.add(gm)
+    db.session.flush()
+    lobby = Lobby(name='Search', gm_id=gm.id, invite_code=f'search{n}')
+    db.session.add(lobby)
+    db.session.flush()
+    return lobby
+
+
+def _global(**fields):
+    template = ItemTemplate(**dict({'category': 'weapon', 'attributes': {}}, **fields))
+    db.session.add(template)
+    db.session.flush()
+    return template
+
+
+def _local(lobby, **fields):
+    template = LobbyItemTemplate(lobby_id=lobby.id, created_by=lobby.gm_id,
+                                 **dict({'category': 'weapon', 'attributes': {}}, **fields))
+    db.session.add(template)
+    db.session.flush()
+    return template
+
+
+def _names(result):
+    return [t['name'] for t in result['templates']]
+
+
+def _search(lobby, **kwargs):
+    return TemplateSearchService.search(lobby.id, **kwargs)
+
+
+def test_prefix_and_substring(lobby):
+    # Латиница: lower() в SQLite тестов не знает кириллицы (в PostgreSQL знает)
+    _global(name='Pistol PM')
+    _global(name='Flare gun')
+    _local(lobby, name='Sawn-off pistol')
+    _local(lobby, name='100% spirit')
+
+    assert _names(_search(lobby, q='pist')) == ['Pistol PM']
+    assert _names(_search(lobby, q='PIST', match='substring')) == ['Pistol PM', 'Sawn-off pistol']
+    # % и _ в запросе — обычные символы
+    assert _names(_search(lobby, q='100%')) == ['100% spirit']
+    assert _names(_search(lobby, q='%', match='substring')) == ['100% spirit']
+
+
+def test_local_templates_of_other_lobbies_are_hidden(lobby):
+    other = Lobby(name='Other', gm_id=lobby.gm_id, invite_code=f'other{next(_ids)}')
+    db.session.add(other)
+    db.session.flush()
+    _local(other, name='Чужой')
+    mine = _local(lobby, name='Свой')
+
+    result = _search(lobby)
+    assert _names(result) == ['Свой']
+    assert result['templates'][0]['key'] == mine.id + LOCAL_TEMPLATE_OFFSET
+    assert result['templates'][0]['source'] == 'local'
+
+
+def test_category_and_range_filters(lobby):
+    _global(name='A', category='weapon', subcategory='pistol', price=100, weight=1.0)
+    _global(name='B', category='weapon', subcategory='rifle', price=500, weight=3.5)
+    _global(name='C', category='armor', price=300, weight=8.0)
+    _local(lobby, name='D', category='weapon', subcategory='pistol', price=250, weight=0.9)
+
+    assert _names(_search(lobby, category='weapon', subcategory='pistol')) == ['A', 'D']
+    assert _names(_search(lobby, ranges={'price': (200, 400)})) == ['C', 'D']
+    assert _names(_search(lobby, ranges={'price': (None, 300), 'weight': (1.0, None)})) == ['A', 'C']
+    assert _names(_search(lobby, category='weapon', ranges={'weight': (None, 1.0)})) == ['A', 'D']
+
+
+def test_attribute_filters(lobby):
+    _global(name='AK', attributes={'caliber': '5.45', 'auto': True, 'capacity': 30})
+    _global(name='SKS', attributes={'caliber': '7.62', 'auto': False, 'capacity': 10})
+    _local(lobby, name='Saiga', attributes={'caliber': '7.62', 'auto': False, 'capacity': '30'})
+
+    ranges, attrs = TemplateSearchService.parse_args(MultiDict({'attr.caliber': '7.62'}))
+    assert _names(_search(lobby, ranges=ranges, attrs=attrs)) == ['Saiga', 'SKS']
+
+    # Число и строка в JSON совпадают по тексту
+    _, attrs = TemplateSearchService.parse_args(MultiDict({'attr.capacity': '30'}))
+    assert _names(_search(lobby, attrs=attrs)) == ['AK', 'Saiga']
+
+    _, attrs = TemplateSearchService.parse_args(MultiDict({'attr.auto': 'true'}))
+    assert _names(_search(lobby, attrs=attrs)) == ['AK']
+
+    _, attrs = TemplateSearchService.parse_args(MultiDict({'attr.capacity.min': '5', 'attr.capacity.max': '20'}))
+    assert attrs == {'capacity': (5.0, 20.0)}
+    assert _names(_search(lobby, attrs=attrs)) == ['SKS']
+
+
+def test_parse_args_rejects_bad_numbers():
+    with pytest.raises(ValidationError):
+        TemplateSearchService.parse_args(MultiDict({'min_price': 'cheap'}))
+    with pytest.raises(ValidationError):
+        TemplateSearchService.parse_args(MultiDict({'attr.capacity.max': 'many'}))
+    ranges, _ = TemplateSearchService.parse_args(MultiDict({'max_weight': '2.5'}))
+    assert ranges == {'weight': (None, 2.5)}
+
+
+def _pages(lobby, **kwargs):
+    keys, cursor = [], None
+    while True:
+        result = _search(lobby, cursor=cursor, limit=3, **kwargs)
+        keys.extend(t['key'] for t in result['templates'])
+        cursor = result['next_cursor']
+        if cursor is None:
+            return keys
+
+
+@pytest.mark.parametrize('sort', ['name', 'price'])
+@pytest.mark.parametrize('order', ['asc', 'desc'])
+def test_keyset_paging_across_union(lobby, sort, order):
+    # Повторы значений сортировки в обеих таблицах: порядок решает ключ
+    templates = []
+    for i in range(5):
+        templates.append(_global(name=f'Item {i % 2}', price=i % 3))
+        templates.append(_local(lobby, name=f'item {i % 2}', price=i % 3))
+
+    def sort_key(template):
+        key = template.id + (LOCAL_TEMPLATE_OFFSET if isinstance(template, LobbyItemTemplate) else 0)
+        return (template.name.lower() if sort == 'name' else template.price), key
+
+    expected = [key for _, key in sorted(map(sort_key, templates), reverse=order == 'desc')]
+    assert _pages(lobby, sort=sort, order=order) == expected
+
+
+def test_paging_is_stable_when_templates_are_added(lobby):
+    for i in range(6):
+        _global(name=f'B{i}', price=10)
+    first = _search(lobby, sort='price', limit=3)
+    # Новый шаблон раньше курсора не сдвигает следующую страницу
+    _local(lobby, name='A', price=5)
+    second = _search(lobby, sort='price', limit=3, cursor=first['next_cursor'])
+    assert _names(first) == ['B0', 'B1', 'B2']
+    assert _names(second) == ['B3', 'B4', 'B5']
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize('cursor', ['not-a-cursor', '', 'WyJhIl0', 'WzEsIDJd', 'WyJhIiwgImIiXQ'])
+def test_invalid_cursor_is_rejected(lobby, cursor):
+    # WyJhIl0 — ["a"], WzEsIDJd — [1, 2] при сортировке по name, WyJhIiwgImIiXQ — ["a", "b"]
+    with pytest.raises(ValidationError, match='Invalid cursor'):
+        _search(lobby, sort='name', cursor=cursor)
+
+
+def test_cursor_of_other_sort_is_rejected(lobby):
+    for i in range(3):
+        _global(name=f'T{i}', price=i)
+    cursor = _search(lobby, sort='name', limit=1)['next_cursor']
+    with pytest.raises(ValidationError, match='Invalid cursor'):
+        _search(lobby, sort='price', cursor=cursor)
+
+
+@pytest.mark.parametrize('kwargs', [{'sort': 'id'}, {'order': 'up'}, {'match': 'regex'}, {'limit': 0},
+                                    {'limit': 1000}])
+def test_invalid_arguments(lobby, kwargs):
+    with pytest.raises(ValidationError):
+        _search(lobby, **kwargs)
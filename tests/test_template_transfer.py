@@ -0,0 +1,130 @@
+# tests/test_template_transfer.py
+"""Импорт и экспорт шаблонов (TemplateTransferService): форматы, режимы, отчёт по строкам."""
+
+import io
+import json
+
+import pytest
+
+from app.extensions import db
+from app.models.templates import ItemTemplate
+from app.services.template_transfer import TemplateTransferService
+
+ROWS = [
+    {'name': 'AK-74', 'category': 'weapon', 'subcategory': 'rifle', 'price': 1500, 'weight': 3.3,
+     'attributes': {'caliber': '5.45', 'auto': True}, 'compatible_ids': [2]},
+    {'name': 'Магазин 5.45', 'category': 'ammo', 'description': 'На 30 патронов', 'price': 50, 'weight': 0.2},
+]
+COMPARED = ('name', 'category', 'subcategory', 'description', 'price', 'weight', 'volume',
+            'attributes', 'compatible_ids')
+
+
+@pytest.fixture
+def templates(db_session):
+    # Импорт коммитит пачки сам — чистим каталог после теста
+    yield
+    db.session.rollback()
+    ItemTemplate.query.delete()
+    db.session.commit()
+
+
+def _ndjson(rows):
+    return [json.dumps(row, ensure_ascii=False) + '\n' for row in rows]
+
+
+def _import(lines, **kwargs):
+    return TemplateTransferService.import_lines(iter(lines), **kwargs)
+
+
+def _export(fmt):
+    return ''.join(TemplateTransferService.export(None, fmt))
+
+
+def _catalog():
+    db.session.expire_all()
+    return {t.name: {f: getattr(t, f) for f in COMPARED} for t in ItemTemplate.query.order_by(ItemTemplate.id)}
+
+
+@pytest.mark.parametrize('fmt', ['ndjson', 'csv'])
+def test_round_trip(templates, fmt):
+    report = _import(_ndjson(ROWS))
+    assert (report['created'], report['updated'], report['failed']) == (2, 0, 0)
+    before = _catalog()
+    assert before['AK-74']['attributes'] == {'caliber': '5.45', 'auto': True}
+    assert before['Магазин 5.45']['subcategory'] is None
+
+    exported = _export(fmt)
+    report = _import(io.StringIO(exported, newline=''), fmt=fmt)
+    assert (report['created'], report['updated'], report['failed']) == (0, 2, 0)
+    assert _catalog() == before
+    assert ItemTemplate.query.count() == 2
+
+
+def test_insert_mode_keeps_existing(templates):
+    _import(_ndjson(ROWS))
+    changed = [dict(ROWS[0], price=1), {'name': 'Новый', 'category': 'misc'}]
+
+    report = _import(_ndjson(changed), mode='insert')
+    assert (report['created'], report['updated'], report['failed']) == (1, 0, 1)
+    assert report['errors'][0]['line'] == 1
+    assert 'already exists' in report['errors'][0]['errors']['_row'][0]
+    assert _catalog()['AK-74']['price'] == 1500
+
+    report = _import(_ndjson(changed), mode='upsert')
+    assert (report['created'], report['updated'], report['failed']) == (0, 2, 0)
+    assert _catalog()['AK-74']['price'] == 1
+
+
+def test_errors_are_reported_per_line(templates):
+    lines = _ndjson(ROWS[:1]) + [
+        '{not json\n',
+        '\n',
+        '[1, 2]\n',
+        json.dumps({'category': 'weapon'}) + '\n',
+        json.dumps({'name': 'X' * 101, 'category': 'weapon'}) + '\n',
+    ] + _ndjson(ROWS[1:])
+
+    report = _import(lines)
+    assert (report['created'], report['failed']) == (2, 4)
+    errors = {e['line']: e['errors'] for e in report['errors']}
+    assert errors[2] == {'_row': ['Invalid JSON']}
+    assert errors[4] == {'_row': ['Expected a JSON object']}
+    assert 'name' in errors[5]
+    assert 'name' in errors[6]
+    assert set(errors) == {2, 4, 5, 6}
+
+
+def test_csv_errors_use_file_line_numbers(templates):
+    lines = [
+        'name,category,attributes,price\n',
+        'Нож,weapon,"{""sharp"": true}",10\n',
+        'Фляга,misc,{broken,5\n',
+        'Бинт,medicine,{},cheap\n',
+        'Лишнее,misc,{},1,2\n',
+    ]
+    report = _import(lines, fmt='csv')
+    assert (report['created'], report['failed']) == (1, 3)
+    errors = {e['line']: e['errors'] for e in report['errors']}
+    assert errors[3] == {'attributes': ['Invalid JSON']}
+    assert 'price' in errors[4]
+    assert errors[5] == {'_row': ['Too many values']}
+    assert _catalog()['Нож']['attributes'] == {'sharp': True}
+
+
+def test_duplicates_in_batch_upsert_last_wins(templates):
+    rows = [dict(ROWS[0], price=1), ROWS[1], dict(ROWS[0], price=2)]
+    report = _import(_ndjson(rows))
+    assert (report['created'], report['updated'], report['failed']) == (2, 0, 1)
+    assert report['errors'][0]['line'] == 1
+    assert 'Overwritten by line 3' in report['errors'][0]['errors']['_row'][0]
+    assert _catalog()['AK-74']['price'] == 2
+
+
+def test_duplicates_in_batch_insert_first_wins(templates):
+    rows = [dict(ROWS[0], price=1), ROWS[1], dict(ROWS[0], price=2)]
+    report = _import(_ndjson(rows), mode='insert')
+    assert (report['created'], report['updated'], report['failed']) == (2, 0, 1)
+    assert report['errors'][0]['line'] == 3
+    assert 'Duplicate of line 1' in report['errors'][0]['errors']['_row'][0]
+    assert _catalog()['AK-74']['price'] == 1
+    assert ItemTemplate.query.count() == 2